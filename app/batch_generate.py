@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+AI創作工房 バッチ生成CLI
+YAMLファイル群からUIなしで画像を一括生成する
+
+使用例:
+    python app/batch_generate.py old2/ -o output/ --workers 4
+    python app/batch_generate.py "old3/*.yaml" -o output/ --resolution 4K
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from constants import ASPECT_RATIOS, GENERATION_MAX_WORKERS, API_BUDGET_ACTION
+from logic.budget_guard import BudgetGuard, BUDGET_WARN, BUDGET_BLOCK
+from logic.batch_runner import collect_prompt_files, plan_batch, run_batch, write_outputs
+from logic.usage_tracker import get_tracker, get_usage_outcome
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(
+        description="YAMLプロンプトから画像を一括生成します（UIなし）"
+    )
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="YAMLファイル、ディレクトリ、またはglobパターン"
+    )
+    parser.add_argument(
+        "-o", "--output", required=True,
+        help="画像とメタデータの出力先ディレクトリ"
+    )
+    parser.add_argument(
+        "--api-key", default=None,
+        help="Google AI API Key（省略時は環境変数 GEMINI_API_KEY / GOOGLE_API_KEY）"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=GENERATION_MAX_WORKERS,
+        help=f"並列実行数（デフォルト: {GENERATION_MAX_WORKERS}）"
+    )
+    parser.add_argument(
+        "--resolution", choices=["1K", "2K", "4K"], default="2K",
+        help="解像度（デフォルト: 2K）"
+    )
+    parser.add_argument(
+        "--aspect-ratio", choices=sorted(set(ASPECT_RATIOS.values())), default=None,
+        help="アスペクト比（省略時はYAMLの aspect_ratio、なければ 1:1）"
+    )
+    parser.add_argument(
+        "--ref-dir", action="append", default=[],
+        help="参照画像を探す追加ディレクトリ（複数指定可）"
+    )
+    parser.add_argument(
+        "-r", "--recursive", action="store_true",
+        help="ディレクトリ指定時にサブディレクトリも検索"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="出力済みの画像があっても再生成する"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="結果キャッシュを使わずにAPIを呼び出す"
+    )
+    parser.add_argument(
+        "--no-usage", action="store_true",
+        help="API使用量を記録しない（予算の確認も行わない）"
+    )
+    parser.add_argument(
+        "--daily-budget", type=float, default=None,
+        help="1日の予算（USD、省略時は constants.py の API_DAILY_BUDGET）"
+    )
+    parser.add_argument(
+        "--monthly-budget", type=float, default=None,
+        help="1か月の予算（USD、省略時は constants.py の API_MONTHLY_BUDGET）"
+    )
+    parser.add_argument(
+        "--budget-action", choices=[BUDGET_WARN, BUDGET_BLOCK], default=API_BUDGET_ACTION,
+        help=f"予算を超える場合の動作（デフォルト: {API_BUDGET_ACTION}）"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    api_key = args.api_key or os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        print("エラー: API Keyを --api-key または環境変数で指定してください", file=sys.stderr)
+        return 2
+
+    yaml_paths = collect_prompt_files(args.inputs, recursive=args.recursive)
+    if not yaml_paths:
+        print("エラー: YAMLファイルが見つかりません", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = plan_batch(
+        yaml_paths,
+        args.output,
+        resolution=args.resolution,
+        aspect_ratio=args.aspect_ratio,
+        ref_dirs=args.ref_dir,
+        force=args.force
+    )
+
+    total = len(tasks)
+    print(f"{total}件のYAMLを処理します（並列数: {args.workers}）", flush=True)
+
+    tracker = None if args.no_usage else get_tracker()
+    budget_guard = None
+    if tracker is not None:
+        tracker.set_budget(daily=args.daily_budget, monthly=args.monthly_budget)
+        budget_guard = BudgetGuard(tracker, action=args.budget_action)
+    counts = {'success': 0, 'failed': 0, 'skipped': 0}
+    done = 0
+
+    # 1回目のCtrl+Cで残りをキャンセルし、送信中のリクエストを打ち切って記録する。2回目で強制終了
+    cancel_event = threading.Event()
+
+    def on_interrupt(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        print("キャンセルしています（強制終了はもう一度Ctrl+C）", flush=True)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+
+    # APIを呼んだものだけ使用量に記録（判定はGUIと共通のget_usage_outcome）
+    # 打ち切ったジョブの結果は後から届くため、トラッカーを閉じた後は記録しない
+    record_lock = threading.Lock()
+    closed = False
+
+    def record(task, result):
+        usage = get_usage_outcome(result)
+        if usage is None:
+            return
+        billed, outcome = usage
+        with record_lock:
+            if tracker is not None and not closed:
+                tracker.record_usage("normal", task['resolution'], billed, outcome, **result['metrics'])
+
+    for task, result, elapsed in run_batch(
+        tasks, api_key, max_workers=args.workers, use_cache=not args.no_cache,
+        dispatch_check=budget_guard, cancel_event=cancel_event, on_late_result=record
+    ):
+        done += 1
+        name = os.path.basename(task['yaml_path'])
+
+        if result.get('skipped'):
+            counts['skipped'] += 1
+            print(f"[{done}/{total}] スキップ（出力済み）: {name}", flush=True)
+            continue
+
+        if result['success'] and result['image']:
+            try:
+                write_outputs(task, result, "normal", elapsed)
+            except OSError as e:
+                # cached・metricsなどはそのまま引き継ぐ（キャッシュから返した結果は使用量に記録しない）
+                # APIが画像を返した時点で料金はかかっているため、billedとして記録する
+                result = dict(result, success=False, image=None, billed=True, error=f"保存に失敗しました: {e}")
+
+        record(task, result)
+
+        if result['success']:
+            counts['success'] += 1
+            refs = f" 参照画像{len(task['ref_images'])}枚" if task['ref_images'] else ""
+            cached = "（キャッシュ）" if result.get('cached') else ""
+            print(
+                f"[{done}/{total}] 完了{cached} {elapsed:.1f}秒{refs}: {name} -> {os.path.basename(task['image_path'])}",
+                flush=True
+            )
+        else:
+            counts['failed'] += 1
+            print(f"[{done}/{total}] 失敗: {name}: {result.get('error')}", flush=True)
+
+        for missing in task['missing_refs']:
+            print(f"    警告: 参照画像が見つかりません: {missing}", flush=True)
+
+    if tracker is not None:
+        print(
+            f"概算料金: 本日 ${tracker.get_today_cost():.2f} / 今月 ${tracker.get_month_cost():.2f}",
+            flush=True
+        )
+        with record_lock:
+            closed = True
+            tracker.close()
+
+    print(
+        f"完了: 成功 {counts['success']}件 / 失敗 {counts['failed']}件 / スキップ {counts['skipped']}件",
+        flush=True
+    )
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
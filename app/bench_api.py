@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+AI創作工房 API生成ベンチマーク
+本物のAPIの代わりにオフライン用の代替クライアントを使い、
+並列数・レート制限・再試行の設定ごとのスループットを計測する（API使用量は消費しない）
+
+使用例:
+    python app/bench_api.py --requests 40 --workers 4 --latency 2
+    python app/bench_api.py --requests 40 --workers 8 --rate-429 0.2 --rate-limit 60
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from constants import API_RATE_LIMIT_PER_MIN, API_RATE_LIMIT_BURST, API_RETRY_MAX_ATTEMPTS
+from logic.api_client import generate_image_with_api
+from logic.generation_engine import GenerationEngine
+from logic.retry_policy import get_retry_policy, set_rate_limit
+from logic.usage_tracker import percentile
+from logic import fake_gemini
+
+
+# ベンチマークで使うダミーのAPI Key
+BENCH_API_KEY = "fake-benchmark-key"
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(
+        description="代替クライアントで画像生成のスループットを計測します（APIは呼びません）"
+    )
+    parser.add_argument("--requests", type=int, default=20, help="生成リクエスト数（デフォルト: 20）")
+    parser.add_argument("--workers", type=int, default=4, help="並列実行数（デフォルト: 4）")
+    parser.add_argument("--resolution", choices=["1K", "2K", "4K"], default="1K", help="解像度（デフォルト: 1K）")
+    parser.add_argument("--latency", type=float, default=1.0, help="1回の応答の平均秒数（デフォルト: 1.0）")
+    parser.add_argument("--jitter", type=float, default=0.3, help="応答時間のばらつき ±秒（デフォルト: 0.3）")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429（レート制限）の発生率")
+    parser.add_argument("--rate-503", type=float, default=0.0, help="503（混雑）の発生率")
+    parser.add_argument("--rate-400", type=float, default=0.0, help="400（再試行しないエラー）の発生率")
+    parser.add_argument("--rate-text", type=float, default=0.0, help="テキストのみの応答の発生率")
+    parser.add_argument("--rate-safety", type=float, default=0.0, help="SAFETYブロックの発生率")
+    parser.add_argument("--rate-recitation", type=float, default=0.0, help="RECITATIONブロックの発生率")
+    parser.add_argument("--rate-empty", type=float, default=0.0, help="候補なし応答の発生率")
+    parser.add_argument(
+        "--rate-limit", type=float, default=API_RATE_LIMIT_PER_MIN,
+        help=f"1分あたりの最大リクエスト数（デフォルト: {API_RATE_LIMIT_PER_MIN}）"
+    )
+    parser.add_argument(
+        "--burst", type=int, default=API_RATE_LIMIT_BURST,
+        help=f"連続で送れるリクエスト数（デフォルト: {API_RATE_LIMIT_BURST}）"
+    )
+    parser.add_argument(
+        "--max-attempts", type=int, default=API_RETRY_MAX_ATTEMPTS,
+        help=f"一時的なエラーの最大試行回数（デフォルト: {API_RETRY_MAX_ATTEMPTS}）"
+    )
+    parser.add_argument("--retry-base-delay", type=float, default=0.5, help="再試行の基準待ち時間（デフォルト: 0.5秒）")
+    parser.add_argument("--timeout", type=float, default=None, help="1件の制限時間（秒）")
+    parser.add_argument("--image-scale", type=float, default=0.25, help="返す画像サイズの倍率（デフォルト: 0.25）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    config = fake_gemini.FakeGeminiConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        rates={
+            fake_gemini.OUTCOME_RATE_LIMIT: args.rate_429,
+            fake_gemini.OUTCOME_UNAVAILABLE: args.rate_503,
+            fake_gemini.OUTCOME_BAD_REQUEST: args.rate_400,
+            fake_gemini.OUTCOME_TEXT_ONLY: args.rate_text,
+            fake_gemini.OUTCOME_SAFETY: args.rate_safety,
+            fake_gemini.OUTCOME_RECITATION: args.rate_recitation,
+            fake_gemini.OUTCOME_EMPTY: args.rate_empty
+        },
+        image_scale=args.image_scale,
+        seed=args.seed
+    )
+    client = fake_gemini.install_fake_client(config)
+    set_rate_limit(BENCH_API_KEY, args.rate_limit, args.burst)
+    policy = get_retry_policy()
+    policy.max_attempts = max(1, args.max_attempts)
+    policy.base_delay = args.retry_base_delay
+
+    print(
+        f"{args.requests}件を並列数{args.workers}で生成します"
+        f"（応答 {args.latency}±{args.jitter}秒, 上限 {args.rate_limit:g}回/分）",
+        flush=True
+    )
+
+    done = threading.Event()
+    lock = threading.Lock()
+    results = []  # [(job, result)]
+
+    def on_complete(job, result):
+        with lock:
+            results.append((job, result))
+            if len(results) >= args.requests:
+                done.set()
+
+    engine = GenerationEngine(max_workers=args.workers, default_timeout=args.timeout)
+    started = time.time()
+    for i in range(args.requests):
+        engine.submit(
+            generate_image_with_api,
+            kwargs=dict(
+                api_key=BENCH_API_KEY,
+                yaml_prompt=f"benchmark prompt #{i}",
+                char_image_paths=[],
+                resolution=args.resolution,
+                use_cache=False
+            ),
+            label=f"bench-{i}",
+            on_complete=on_complete
+        )
+    done.wait()
+    wall = time.time() - started
+    engine.shutdown()
+
+    # 集計
+    latencies = [job.finished_at - job.started_at for job, _ in results if job.started_at]
+    waits = [job.started_at - job.submitted_at for job, _ in results if job.started_at]
+    succeeded = sum(1 for _, result in results if result.get('success'))
+    timed_out = sum(1 for _, result in results if result.get('timed_out'))
+    failed = len(results) - succeeded - timed_out
+
+    print("")
+    print(f"所要時間:     {wall:.2f}秒")
+    print(f"スループット: {len(results) / wall:.2f}件/秒（{len(results) / wall * 60:.1f}件/分）")
+    print(f"結果:         成功 {succeeded}件 / 失敗 {failed}件 / タイムアウト {timed_out}件")
+    print(
+        f"処理時間:     p50 {percentile(latencies, 0.5):.2f}秒 / "
+        f"p95 {percentile(latencies, 0.95):.2f}秒 / 最大 {max(latencies, default=0):.2f}秒"
+    )
+    print(
+        f"待ち時間:     p50 {percentile(waits, 0.5):.2f}秒 / "
+        f"p95 {percentile(waits, 0.95):.2f}秒"
+    )
+    ttfbs = [result['metrics']['ttfb'] for _, result in results if 'ttfb' in result.get('metrics', {})]
+    decodes = [
+        result['metrics']['decode_time'] for _, result in results
+        if 'decode_time' in result.get('metrics', {})
+    ]
+    print(
+        f"応答開始:     p50 {percentile(ttfbs, 0.5):.2f}秒 / "
+        f"p95 {percentile(ttfbs, 0.95):.2f}秒（最後の送信から応答ヘッダーまで）"
+    )
+    print(
+        f"デコード:     p50 {percentile(decodes, 0.5) * 1000:.1f}ms / "
+        f"p95 {percentile(decodes, 0.95) * 1000:.1f}ms"
+    )
+    print(
+        f"API呼び出し:  {client.stats['calls']}回（再試行 {client.stats['calls'] - len(results)}回）"
+        f" / 最大同時 {client.stats['max_in_flight']}件"
+    )
+    outcome_text = ", ".join(f"{k}: {v}" for k, v in sorted(client.outcome_counts.items()))
+    print(f"応答の内訳:   {outcome_text}")
+
+    errors = {}
+    for _, result in results:
+        if not result.get('success'):
+            message = (result.get('error') or '').splitlines()[0][:60]
+            errors[message] = errors.get(message, 0) + 1
+    for message, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"  失敗 {count}件: {message}")
+
+    fake_gemini.uninstall_fake_client()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
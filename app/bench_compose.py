@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+AI創作工房 漫画ページ合成ベンチマーク
+合成用の画像で漫画ページを大量に作り、1ページずつ順に描く場合と
+ワーカースレッド・ワーカープロセスで並列に描く場合のスループットを比較する
+
+使用例:
+    python app/bench_compose.py --pages 24 --workers 4
+    python app/bench_compose.py --pages 48 --template 8 --width 1440 --from-files
+    python app/bench_compose.py --pages 24 --output /tmp/book.pdf
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from logic.manga_book import render_pages, write_book
+from logic.manga_layout import TEMPLATES, compose_page, reduce_for_template
+
+
+# --templateの指定とテンプレート名
+TEMPLATE_CHOICES = {
+    "4": "4コマ（16:9縦並び）",
+    "8": "8コマ（4:3 2列）"
+}
+
+# 計測する描画方法 {名前: (並列数を使うか, プロセスで描画するか)}
+MODES = {
+    "serial": (False, False),
+    "threads": (True, False),
+    "processes": (True, True)
+}
+
+# ベンチマークで使う吹き出し
+BENCH_BUBBLES = [
+    {'text': "Hello!", 'style': "oval", 'position': (0.5, 0.2)},
+    {'text': "...!?", 'style': "burst", 'position': (0.3, 0.7)},
+    {'text': "Let's go", 'style': "rounded_rect", 'position': (0.7, 0.5)}
+]
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(
+        description="漫画ページの合成を、順に描く場合と並列に描く場合で計測します"
+    )
+    parser.add_argument("--pages", type=int, default=24, help="ページ数（デフォルト: 24）")
+    parser.add_argument("--workers", type=int, default=0, help="並列数（デフォルト: 0 = CPUコア数）")
+    parser.add_argument("--template", choices=list(TEMPLATE_CHOICES.keys()), default="8",
+                        help="テンプレート 4コマ / 8コマ（デフォルト: 8）")
+    parser.add_argument("--width", type=int, choices=[720, 1080, 1440], default=1080,
+                        help="出力幅（デフォルト: 1080）")
+    parser.add_argument("--source-size", default="1920x1080", help="コマ画像の大きさ（デフォルト: 1920x1080）")
+    parser.add_argument("--sources", type=int, default=8, help="使い回すコマ画像の枚数（デフォルト: 8）")
+    parser.add_argument("--from-files", action="store_true",
+                        help="コマ画像をJPEGファイルで渡す（ワーカーでデコードする）")
+    parser.add_argument("--modes", default="serial,threads,processes",
+                        help="計測する描画方法（カンマ区切り: serial,threads,processes）")
+    parser.add_argument("--output", default=None, help="最後にブックを書き出す先（.pdf / .cbz）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    return parser.parse_args(argv)
+
+
+def make_source_image(size: tuple, rng: random.Random) -> Image.Image:
+    """コマ画像の代わりに、ノイズの上に図形を描いた画像を作る"""
+    width, height = size
+    noise = Image.effect_noise((width, height), 48)
+    offsets = [rng.randint(0, 127) for _ in range(3)]
+    base = Image.merge("RGB", [noise.point(lambda v, o=o: v // 2 + o) for o in offsets])
+    draw = ImageDraw.Draw(base)
+    for _ in range(20):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse([x0, y0, x1, y1], fill=color, outline="black", width=3)
+    return base
+
+
+def build_pages(args, template_name: str, workdir: str) -> list:
+    """ベンチマーク用のページ（compose_pageに渡す形式）を作る"""
+    rng = random.Random(args.seed)
+    width, height = (int(v) for v in args.source_size.lower().split("x"))
+    template = TEMPLATES[template_name]
+    num_panels = template["cols"] * template["rows"]
+
+    sources = []
+    for i in range(max(1, args.sources)):
+        img = make_source_image((width, height), rng)
+        if args.from_files:
+            path = os.path.join(workdir, f"panel_{i:03d}.jpg")
+            img.save(path, quality=90)
+            sources.append(path)
+        else:
+            # コンポーザーで読み込んだ場合と同じく、縮小済みの画像を渡す
+            sources.append(reduce_for_template(img, template_name))
+
+    pages = []
+    for page_index in range(args.pages):
+        images = {i: sources[(page_index + i) % len(sources)] for i in range(num_panels)}
+        bubbles = {i: [dict(BENCH_BUBBLES[(page_index + i) % len(BENCH_BUBBLES)])] for i in range(num_panels)}
+        pages.append({
+            'template': template_name,
+            'output_width': args.width,
+            'images': images,
+            'bubbles': bubbles
+        })
+    return pages
+
+
+def page_digest(page) -> str:
+    """ページの画素のハッシュ（描画方法で結果が変わらないことの確認用）"""
+    return hashlib.md5(compose_page(page).tobytes()).hexdigest()
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    template_name = TEMPLATE_CHOICES[args.template]
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        print(f"不明な描画方法: {', '.join(unknown)}（{', '.join(MODES)}）")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.time()
+        pages = build_pages(args, template_name, workdir)
+        print(
+            f"{template_name} / 幅{args.width}px のページを{args.pages}枚、並列数{workers}で描画します"
+            f"（コマ画像 {args.source_size}{'・JPEGファイル' if args.from_files else ''}、"
+            f"準備 {time.time() - started:.2f}秒）",
+            flush=True
+        )
+
+        print("")
+        serial_rate = None
+        digests = None
+        for mode in modes:
+            parallel, use_processes = MODES[mode]
+            mode_workers = workers if parallel else 1
+            started = time.time()
+            results = list(render_pages(pages, page_digest, mode_workers, use_processes))
+            wall = time.time() - started
+            rate = len(results) / wall
+            if mode == "serial":
+                serial_rate = rate
+            speedup = f" / serial比 {rate / serial_rate:.2f}倍" if serial_rate else ""
+            same = ""
+            if digests is None:
+                digests = results
+            else:
+                same = " / 結果は同じ" if results == digests else " / 結果が異なります"
+            print(f"{mode:<10} {wall:6.2f}秒  {rate:6.2f}ページ/秒{speedup}{same}", flush=True)
+
+        if args.output:
+            print("")
+            started = time.time()
+            result = write_book(pages, args.output, compose_page, max_workers=workers)
+            wall = time.time() - started
+            if not result['success']:
+                print(f"ブックの書き出しに失敗しました: {result['error']}")
+                return 1
+            print(
+                f"ブック:     {wall:6.2f}秒  {result['pages'] / wall:6.2f}ページ/秒"
+                f"（{args.output}, {os.path.getsize(args.output) / 1e6:.1f}MB）"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,48 @@ MAX_SPEECH_LENGTH = 30
 MAX_RECENT_FILES = 5
 MAX_CHARACTERS = 5
 
+# API画像生成エンジン設定
+GENERATION_MAX_WORKERS = 4   # 同時に実行する生成ジョブ数
+GENERATION_QUEUE_SIZE = 64   # 待機キューの上限
+GENERATION_TIMEOUT_SEC = 600  # 1件の生成ジョブの制限時間（再試行を含む）、超えたらタイムアウト扱い
+GENERATION_ABORT_GRACE_SEC = 1.0  # キャンセル・タイムアウト後に処理が戻るのを待つ秒数、過ぎたら打ち切って枠を空ける
+VARIANT_COUNT_OPTIONS = ["1", "2", "3", "4"]  # 同じプロンプトで並列生成する候補数
+FOUR_PANEL_MAX_RETRIES = 1   # 4コマのコマ別生成で失敗したコマを自動で再生成する回数
+
+# API呼び出しの再試行・レート制限設定
+API_RETRY_MAX_ATTEMPTS = 4      # 一時的なエラー（429/503など）の最大試行回数
+API_RETRY_BASE_DELAY = 2.0      # 最初の再試行までの基準待ち時間（秒）、以降は倍々
+API_RETRY_MAX_DELAY = 60.0      # 再試行の待ち時間の上限（秒）
+API_RATE_LIMIT_PER_MIN = 20     # API Keyごとの1分あたりの最大リクエスト数
+API_RATE_LIMIT_BURST = 4        # 連続で送れるリクエスト数
+API_REQUEST_TIMEOUT_SEC = 300   # 1回のAPIリクエストの通信タイムアウト（秒）
+API_ABORT_POLL_SEC = 0.2       # 受信待ちの間にキャンセルを確認する間隔（秒）
+
+# API使用量の記録設定
+USAGE_LOG_COMPACT_EVENTS = 200  # 追記ログがこの件数に達したら集計ファイルにまとめる
+USAGE_STORE_BACKEND = "json"    # 保存先: "json"（api_usage.json）または "sqlite"（api_usage.db）
+USAGE_METRICS_WINDOW_DAYS = 30  # 所要時間などの集計に使う直近の日数
+USAGE_REFRESH_INTERVAL_MS = 5000  # 他のプロセスが記録した使用量を取り込む間隔（ミリ秒）
+
+# API料金の概算（成功した生成1回あたり、USD）。モード・解像度ごとに設定
+API_PRICE_TABLE = {
+    "normal": {"1K": 0.134, "2K": 0.134, "4K": 0.24},
+    "redraw": {"1K": 0.134, "2K": 0.134, "4K": 0.24},
+    "simple": {"1K": 0.134, "2K": 0.134, "4K": 0.24},
+    "refine": {"1K": 0.134, "2K": 0.134, "4K": 0.24}
+}
+API_DAILY_BUDGET = 0.0       # 1日の予算（USD）、0は無制限
+API_MONTHLY_BUDGET = 0.0     # 1か月の予算（USD）、0は無制限
+API_BUDGET_ACTION = "warn"   # 予算を超える場合: "warn"（警告して続行）または "block"（生成しない）
+
+# 生成結果キャッシュ設定
+RESULT_CACHE_MAX_MB = 1024   # キャッシュ全体の上限（MB）、超えたら古いものから削除
+
+# 参照画像の前処理設定（API送信前に縮小・再エンコード）
+REFERENCE_MAX_EDGE = 2048       # 長辺の最大ピクセル数
+REFERENCE_JPEG_QUALITY = 90     # 不透明画像のJPEG品質
+REFERENCE_CACHE_MAX_MB = 256    # エンコード済み画像のメモリキャッシュ上限（MB）
+
 # 年齢表現の安全な変換辞書（セーフティフィルター対策）
 # 直接的な年齢表現を間接的な体型・外見表現に変換
 AGE_EXPRESSION_CONVERSIONS = {
@@ -649,3 +691,48 @@ INFOGRAPHIC_LANGUAGES = {
     "Français": "French",
     "Deutsch": "German"
 }
+
+# ====================================================
+# 背景透過関連定数
+# ====================================================
+
+# 除去する色（背景透過ツールの選択肢）
+BG_REMOVAL_COLORS = {
+    "白": (255, 255, 255),
+    "黒": (0, 0, 0),
+    "緑（グリーンバック）": (0, 255, 0),
+    "青（ブルーバック）": (0, 0, 255)
+}
+
+# 透過画像のファイル名の接尾辞（入力ファイル名_transparent.png）
+BG_REMOVAL_OUTPUT_SUFFIX = "_transparent"
+
+# フォルダ一括処理の並列プロセス数（0ならCPUコア数）
+BG_REMOVAL_MAX_WORKERS = 0
+
+# 輪郭を半透明にする幅（ピクセル）と、半透明にする色の距離の幅（RGBの差の合計）
+BG_REMOVAL_FEATHER = 2
+BG_REMOVAL_EDGE_SOFTNESS = 120
+
+# プレビューの長辺（縮小した画像で透過を試す）と、スライダー操作から更新までの待ち時間（ミリ秒）
+BG_REMOVAL_PREVIEW_EDGE = 360
+BG_REMOVAL_PREVIEW_DELAY_MS = 60
+
+# このピクセル数以上の画像は帯（タイル）ごとに処理して作業用のメモリを抑える（2048x2048相当）
+BG_REMOVAL_TILED_MIN_PIXELS = 2048 * 2048
+# 帯1つのおおよそのピクセル数
+BG_REMOVAL_TILE_PIXELS = 2048 * 1024
+
+
+# ====================================================
+# 漫画ブック出力関連定数
+# ====================================================
+
+# 並列に描画するページ数（0ならCPUコア数）
+MANGA_BOOK_MAX_WORKERS = 0
+
+# ページをワーカープロセスで描画するか（Falseならワーカースレッド）
+MANGA_BOOK_USE_PROCESSES = True
+
+# PDFの解像度（dpi。ページの物理サイズだけが変わり、画質は変わらない）
+MANGA_BOOK_PDF_DPI = 144
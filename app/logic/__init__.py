@@ -13,7 +13,12 @@ from .yaml_generator import (
     build_texts_list,
     build_layout_instruction
 )
-from .api_client import generate_image_with_api, process_api_response
+from .api_client import (
+    generate_image_with_api,
+    process_api_response,
+    get_client_pool,
+    close_all_clients
+)
 from .file_manager import (
     load_yaml_file,
     save_yaml_file,
@@ -33,6 +38,8 @@ __all__ = [
     'build_layout_instruction',
     'generate_image_with_api',
     'process_api_response',
+    'get_client_pool',
+    'close_all_clients',
     'load_yaml_file',
     'save_yaml_file',
     'load_recent_files',
@@ -5,10 +5,253 @@ Gemini APIとの通信処理
 """
 
 import io
+import os
+import sys
+import threading
+import time
+from typing import Optional
+import httpcore
+import httpx
 from PIL import Image
 from google import genai
 from google.genai import types
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import API_REQUEST_TIMEOUT_SEC, API_ABORT_POLL_SEC
+
+from .result_cache import ResultCache, get_result_cache
+from .image_preprocessor import prepare_reference_image
+from .retry_policy import get_retry_policy, get_rate_limiter, RequestCancelled
+
+
+# 画像生成に使用するモデル
+MODEL_NAME = "gemini-3-pro-image-preview"
+
+# クライアントを再利用する最大アイドル時間（秒）
+CLIENT_IDLE_TIMEOUT = 600
+
+# API呼び出しの計測（スレッドごと）
+_call_timing = threading.local()
+
+
+def mark_first_byte(response=None):
+    """
+    応答ヘッダーを受信した時刻を記録（httpxのresponseイベントフック）
+
+    送信直前に計測を開始した呼び出しについて、最初の1回だけ記録する。
+    """
+    if getattr(_call_timing, 'first_byte_at', 0) is None:
+        _call_timing.first_byte_at = time.perf_counter()
+
+
+def _check_abort():
+    """呼び出し中のスレッドのcancel_eventがセットされていたら送受信を打ち切る"""
+    cancel_event = getattr(_call_timing, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise RequestCancelled()
+
+
+class _CancellableStream(httpcore.NetworkStream):
+    """
+    受信待ちの間もキャンセルを確認するソケットストリーム
+
+    同期httpxは応答を待つ間ソケットの読み込みでブロックし、別スレッドから
+    クライアントを閉じても起きないため、短い間隔に区切って読み込み、
+    その合間に呼び出し元のcancel_eventを確認する。全体の通信タイムアウトはそのまま守る。
+    """
+
+    def __init__(self, stream: httpcore.NetworkStream):
+        self._stream = stream
+
+    def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            _check_abort()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise httpcore.ReadTimeout("timed out")
+            wait = API_ABORT_POLL_SEC if remaining is None else min(API_ABORT_POLL_SEC, remaining)
+            try:
+                return self._stream.read(max_bytes, timeout=wait)
+            except httpcore.ReadTimeout:
+                continue
+
+    def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        _check_abort()
+        self._stream.write(buffer, timeout=timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        return _CancellableStream(
+            self._stream.start_tls(ssl_context, server_hostname=server_hostname, timeout=timeout)
+        )
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+
+class _CancellableBackend(httpcore.NetworkBackend):
+    """接続ごとに_CancellableStreamを返すネットワークバックエンド"""
+
+    def __init__(self, backend: httpcore.NetworkBackend):
+        self._backend = backend
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        _check_abort()
+        return _CancellableStream(self._backend.connect_tcp(
+            host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        ))
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        _check_abort()
+        return _CancellableStream(self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        ))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+def _create_transport() -> httpx.HTTPTransport:
+    """キャンセルで送信中のリクエストを打ち切れるhttpxトランスポートを作成"""
+    transport = httpx.HTTPTransport()
+    # httpxにはネットワークバックエンドを差し替える公開の引数がないため、接続プールの既定値を包む
+    pool = transport._pool
+    pool._network_backend = _CancellableBackend(pool._network_backend)
+    return transport
+
+
+def _create_client(api_key: str):
+    """
+    genai.Clientを作成
+
+    応答ヘッダーの受信時刻を計測するフックと、キャンセルで通信を打ち切れる
+    トランスポートを付ける。
+    """
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            client_args={
+                'event_hooks': {'response': [mark_first_byte]},
+                'transport': _create_transport()
+            }
+        )
+    )
+
+
+class ClientPool:
+    """
+    API Keyごとにgenai.Clientを保持するプール
+
+    生成のたびにクライアントを作り直すとTLSハンドシェイクや
+    接続確立のコストが毎回かかるため、同じAPI Keyでは接続を使い回す。
+    一定時間使われなかったクライアントは次回取得時に破棄する。
+    """
+
+    def __init__(self, idle_timeout: float = CLIENT_IDLE_TIMEOUT, client_factory=None):
+        """
+        Args:
+            idle_timeout: アイドル状態のクライアントを破棄するまでの秒数
+            client_factory: クライアントを作成する関数 (api_key) -> client
+                            （省略時はgenai.Client。テスト・ベンチマーク用に差し替え可能）
+        """
+        self.idle_timeout = idle_timeout
+        self._client_factory = client_factory or _create_client
+        self._clients = {}  # {api_key: (client, last_used)}
+        self._lock = threading.Lock()
+
+    def set_client_factory(self, client_factory=None):
+        """
+        クライアントの作成関数を差し替え（保持中のクライアントは閉じる）
+
+        Args:
+            client_factory: (api_key) -> client。Noneで既定のgenai.Clientに戻す
+        """
+        self.close_all()
+        with self._lock:
+            self._client_factory = client_factory or _create_client
+
+    def get_client(self, api_key: str):
+        """
+        API Keyに対応するクライアントを取得（なければ作成）
+
+        Args:
+            api_key: Google AI API Key
+
+        Returns:
+            genai.Client
+        """
+        with self._lock:
+            self._evict_idle_locked()
+            entry = self._clients.get(api_key)
+            if entry is not None:
+                client = entry[0]
+            else:
+                client = self._client_factory(api_key)
+            self._clients[api_key] = (client, time.monotonic())
+            return client
+
+    def evict_idle(self):
+        """アイドル時間を超えたクライアントを破棄"""
+        with self._lock:
+            self._evict_idle_locked()
+
+    def _evict_idle_locked(self):
+        """ロック取得済みの状態でアイドルクライアントを破棄"""
+        now = time.monotonic()
+        expired = [
+            key for key, (_, last_used) in self._clients.items()
+            if now - last_used > self.idle_timeout
+        ]
+        for key in expired:
+            client, _ = self._clients.pop(key)
+            _close_client(client)
+
+    def close_all(self):
+        """保持しているすべてのクライアントを閉じる（アプリ終了時）"""
+        with self._lock:
+            clients = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            _close_client(client)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+def _close_client(client):
+    """クライアントの接続を閉じる（closeを持たないSDKバージョンでは何もしない）"""
+    close = getattr(client, 'close', None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            print(f"Warning: Could not close API client: {e}")
+
+
+# シングルトンインスタンス
+_client_pool_instance = None
+_client_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """クライアントプールのシングルトンインスタンスを取得"""
+    global _client_pool_instance
+    with _client_pool_lock:
+        if _client_pool_instance is None:
+            _client_pool_instance = ClientPool()
+        return _client_pool_instance
+
+
+def close_all_clients():
+    """プール内のすべてのクライアントを閉じる"""
+    if _client_pool_instance is not None:
+        _client_pool_instance.close_all()
+
 
 def generate_image_with_api(
     api_key: str,
@@ -17,7 +260,9 @@ def generate_image_with_api(
     resolution: str = "2K",
     ref_image_path: str = None,
     aspect_ratio: str = "1:1",
-    mode: str = "normal"
+    mode: str = "normal",
+    use_cache: bool = True,
+    cancel_event: Optional[threading.Event] = None
 ) -> dict:
     """
     Gemini APIを使用して画像を生成
@@ -29,18 +274,50 @@ def generate_image_with_api(
         resolution: 解像度 ("1K", "2K", "4K")
         ref_image_path: 参考画像のパス
         aspect_ratio: アスペクト比 ("1:1", "16:9", "9:16", etc.)
-        mode: 生成モード ("normal", "redraw", "simple")
+        mode: 生成モード ("normal", "redraw", "simple", "refine")
+        use_cache: 同じ条件の生成結果があれば再利用するか（Falseで強制再生成）
+        cancel_event: セットされたら送信中のリクエスト・再試行・レート制限待ちを打ち切る
 
     Returns:
         結果を含む辞書:
         {
             'success': bool,
             'image': PIL.Image or None,
-            'error': str or None
+            'error': str or None,
+            'cached': bool,    # キャッシュから返した場合のみTrue
+            'cancelled': bool, # キャンセルされた場合のみTrue
+            'metrics': dict    # APIを呼んだ場合の計測値（キャッシュ時・送信前のキャンセル時はなし）
+                               # latency: 全体の秒数（再試行・レート制限待ちを含む）
+                               # ttfb: 最後の送信から応答ヘッダー受信までの秒数
+                               # decode_time: 画像のデコード秒数
+                               # prompt_chars / request_bytes / response_bytes
         }
     """
+    # 結果キャッシュを確認（ヒットすればAPIを呼ばない）
+    cache_key = None
+    if use_cache:
+        cache_key = _make_cache_key(
+            yaml_prompt=yaml_prompt,
+            char_image_paths=char_image_paths,
+            resolution=resolution,
+            ref_image_path=ref_image_path,
+            aspect_ratio=aspect_ratio,
+            mode=mode
+        )
+        if cache_key:
+            cached_image = get_result_cache().get(cache_key)
+            if cached_image is not None:
+                return {
+                    'success': True,
+                    'image': cached_image,
+                    'error': None,
+                    'cached': True
+                }
+
+    started = time.perf_counter()
+    sent = False  # 1回でも送信したか（打ち切った場合も課金・記録の対象になる）
     try:
-        client = genai.Client(api_key=api_key)
+        client = get_client_pool().get_client(api_key)
 
         # 解像度の設定（プロンプト用の説明）
         resolution_map = {
@@ -162,43 +439,181 @@ Generate the image at {resolution_instruction}.
         # Add reference image (for redraw mode and simple mode with reference)
         if ref_image_path:
             try:
-                ref_img = Image.open(ref_image_path)
-                contents.append(ref_img)
+                contents.append(_reference_part(ref_image_path))
             except Exception as e:
                 print(f"Error loading reference image {ref_image_path}: {e}")
 
         # Add character reference images
         for img_path in char_image_paths:
             try:
-                pil_img = Image.open(img_path)
-                contents.append(pil_img)
+                contents.append(_reference_part(img_path))
             except Exception as e:
                 print(f"Error loading image {img_path}: {e}")
 
+        config = types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE'],
+            image_config=types.ImageConfig(
+                aspect_ratio=aspect_ratio,
+                image_size=resolution
+            ),
+            # 応答が返らない場合に接続を打ち切る（ミリ秒）
+            http_options=types.HttpOptions(timeout=API_REQUEST_TIMEOUT_SEC * 1000)
+        )
+        rate_limiter = get_rate_limiter(api_key)
+
+        def call_api():
+            nonlocal sent
+            # 再試行を含め、1回の送信ごとにレート制限のトークンを消費する
+            if not rate_limiter.acquire(cancel_event=cancel_event):
+                raise RequestCancelled()
+            _call_timing.first_byte_at = None
+            _call_timing.sent_at = time.perf_counter()
+            sent = True
+            return client.models.generate_content(
+                model=MODEL_NAME,  # 画像生成対応モデル
+                contents=contents,
+                config=config
+            )
+
         # Call API with image_config for aspect ratio and resolution
-        response = client.models.generate_content(
-            model="gemini-3-pro-image-preview",  # 画像生成対応モデル
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size=resolution
-                )
+        # 429/503などの一時的なエラーはバックオフしながら再試行
+        _call_timing.cancel_event = cancel_event
+        try:
+            response = get_retry_policy().call(
+                call_api, on_retry=_log_retry, cancel_event=cancel_event
             )
-        )
+        finally:
+            _call_timing.cancel_event = None
+
+        first_byte_at = _call_timing.first_byte_at
 
         # Process response
-        return process_api_response(response)
+        result = process_api_response(response)
+        metrics = result.setdefault('metrics', {})
+        metrics['latency'] = time.perf_counter() - started
+        if first_byte_at is not None:
+            metrics['ttfb'] = first_byte_at - _call_timing.sent_at
+        metrics['prompt_chars'] = sum(len(item) for item in contents if isinstance(item, str))
+        metrics['request_bytes'] = get_payload_size(contents)
+
+        # 成功した結果は受信したデータのままキャッシュに保存（再エンコードで画質を落とさない）
+        image_data = result.pop('image_data', None)
+        if cache_key and result['success'] and image_data:
+            try:
+                get_result_cache().put(cache_key, image_data)
+            except Exception as e:
+                print(f"Warning: Could not cache generated image: {e}")
 
+        return result
+
+    except RequestCancelled:
+        result = {
+            'success': False,
+            'image': None,
+            'error': "キャンセルされました",
+            'cancelled': True
+        }
+        if sent:
+            # 送信済みのリクエストを打ち切った場合はAPIを呼んだものとして計測値を付ける
+            result['metrics'] = {'latency': time.perf_counter() - started}
+        return result
     except Exception as e:
         return {
             'success': False,
             'image': None,
-            'error': str(e)
+            'error': str(e),
+            'metrics': {'latency': time.perf_counter() - started}
         }
 
 
+def _log_retry(attempt: int, delay: float, exc: Exception):
+    """再試行の前にログを出力"""
+    print(f"Warning: API call failed (attempt {attempt}), retrying in {delay:.1f}s: {exc}")
+
+
+def get_payload_size(contents) -> int:
+    """送信内容のおおよそのバイト数（文字列はUTF-8、画像Partはデータ長）"""
+    total = 0
+    for item in contents or []:
+        if isinstance(item, str):
+            total += len(item.encode('utf-8'))
+        else:
+            inline_data = getattr(item, 'inline_data', None)
+            if inline_data is not None and inline_data.data:
+                total += len(inline_data.data)
+    return total
+
+
+def _reference_part(image_path: str) -> types.Part:
+    """
+    参照画像を縮小・再エンコードしてAPI送信用のPartに変換
+
+    エンコード結果はファイルのパス・更新時刻・サイズをキーにキャッシュされるため、
+    同じ参照画像を続けて使う場合は再エンコードしない。
+    """
+    prepared = prepare_reference_image(image_path)
+    return types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type)
+
+
+def is_result_cached(
+    yaml_prompt: str,
+    char_image_paths: list,
+    resolution: str = "2K",
+    ref_image_path: str = None,
+    aspect_ratio: str = "1:1",
+    mode: str = "normal",
+    **_
+) -> bool:
+    """
+    同じ条件の生成結果が結果キャッシュにあるか（generate_image_with_apiと同じ引数を受け取る）
+
+    Returns:
+        キャッシュから返せる（APIを呼ばない）場合はTrue
+    """
+    cache_key = _make_cache_key(
+        yaml_prompt=yaml_prompt,
+        char_image_paths=char_image_paths,
+        resolution=resolution,
+        ref_image_path=ref_image_path,
+        aspect_ratio=aspect_ratio,
+        mode=mode
+    )
+    return bool(cache_key) and get_result_cache().contains(cache_key)
+
+
+def _make_cache_key(
+    yaml_prompt: str,
+    char_image_paths: list,
+    resolution: str,
+    ref_image_path: str,
+    aspect_ratio: str,
+    mode: str
+) -> str:
+    """
+    生成条件から結果キャッシュのキーを作成
+
+    Returns:
+        キャッシュキー。参照画像を読めない場合はNone（キャッシュを使わない）
+    """
+    image_paths = []
+    if ref_image_path:
+        image_paths.append(ref_image_path)
+    image_paths.extend(char_image_paths or [])
+
+    try:
+        return ResultCache.make_key(
+            mode=mode,
+            prompt=yaml_prompt,
+            image_paths=[p for p in image_paths if os.path.isfile(p)],
+            resolution=resolution,
+            aspect_ratio=aspect_ratio,
+            model=MODEL_NAME
+        )
+    except OSError as e:
+        print(f"Warning: Could not build cache key: {e}")
+        return None
+
+
 def process_api_response(response) -> dict:
     """
     APIレスポンスを処理して画像を抽出
@@ -211,7 +626,8 @@ def process_api_response(response) -> dict:
         {
             'success': bool,
             'image': PIL.Image or None,
-            'error': str or None
+            'error': str or None,
+            'image_data': bytes  # 成功時のみ。受信した画像データそのもの（キャッシュ用）
         }
     """
     try:
@@ -297,12 +713,20 @@ def process_api_response(response) -> dict:
                 text_response = part.text
 
         if generated_img_data:
+            # ワーカースレッドでデコードまで済ませる（UIスレッドでの初回描画を軽くする）
+            decode_started = time.perf_counter()
             image_bytes = io.BytesIO(generated_img_data)
             image = Image.open(image_bytes)
+            image.load()
             return {
                 'success': True,
                 'image': image,
-                'error': None
+                'error': None,
+                'image_data': generated_img_data,
+                'metrics': {
+                    'response_bytes': len(generated_img_data),
+                    'decode_time': time.perf_counter() - decode_started
+                }
             }
         else:
             # 画像がなくテキストのみの場合
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+バッチ生成ロジック
+YAMLファイル群からUIなしで画像を一括生成する
+"""
+
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import ASPECT_RATIOS, GENERATION_MAX_WORKERS, GENERATION_TIMEOUT_SEC
+from logic.api_client import generate_image_with_api
+from logic.file_manager import load_yaml_file
+from logic.generation_engine import GenerationEngine
+
+
+# プロンプトとして扱うYAMLの拡張子
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+# 参照画像として扱う拡張子
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
+
+# メタデータセクションの区切り（file_manager.update_yaml_metadataと同じ形式）
+METADATA_SEPARATOR = "# ====================================================\n# メタデータ"
+
+
+def collect_prompt_files(inputs: list, recursive: bool = False) -> list:
+    """
+    ディレクトリ・globパターン・ファイルパスからYAMLファイルを収集
+
+    Args:
+        inputs: ディレクトリ、globパターン、またはファイルパスのリスト
+        recursive: ディレクトリ指定時にサブディレクトリも検索するか
+
+    Returns:
+        YAMLファイルパスのリスト（重複なし、入力順→名前順）
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = sorted(glob.glob(pattern, recursive=recursive))
+        elif os.path.isfile(item):
+            candidates = [item]
+        else:
+            candidates = sorted(glob.glob(item, recursive=True))
+
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(YAML_EXTENSIONS):
+                abs_path = os.path.abspath(path)
+                if abs_path not in paths:
+                    paths.append(abs_path)
+    return paths
+
+
+def strip_metadata_section(content: str) -> str:
+    """YAML本文から自動生成のメタデータセクションを取り除く"""
+    if METADATA_SEPARATOR in content:
+        content = content.split(METADATA_SEPARATOR)[0].rstrip() + "\n"
+    return content
+
+
+def _iter_strings(data):
+    """YAMLデータ内の文字列値を再帰的に列挙（_metadataは除外）"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == '_metadata':
+                continue
+            yield from _iter_strings(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _iter_strings(value)
+    elif isinstance(data, str):
+        yield data
+
+
+def resolve_reference_images(yaml_path: str, data, ref_dirs: list = None) -> tuple:
+    """
+    YAML内で参照されている画像ファイルを解決
+
+    Args:
+        yaml_path: YAMLファイルのパス（相対パスの基準）
+        data: 解析済みYAMLデータ
+        ref_dirs: 追加で検索するディレクトリのリスト
+
+    Returns:
+        (found: list, missing: list) 見つかった画像パスと見つからなかったファイル名
+    """
+    search_dirs = [os.path.dirname(os.path.abspath(yaml_path))] + list(ref_dirs or [])
+    found = []
+    missing = []
+
+    for value in _iter_strings(data):
+        name = value.strip()
+        if "\n" in name or not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        if os.path.isabs(name):
+            candidates = [name]
+        else:
+            candidates = [os.path.join(d, name) for d in search_dirs]
+
+        resolved = next((os.path.abspath(c) for c in candidates if os.path.isfile(c)), None)
+        if resolved:
+            if resolved not in found:
+                found.append(resolved)
+        elif name not in missing:
+            missing.append(name)
+
+    return found, missing
+
+
+def find_aspect_ratio(data, default: str = "1:1") -> str:
+    """
+    YAMLデータからアスペクト比を探す（最初に見つかった有効な値）
+
+    Args:
+        data: 解析済みYAMLデータ
+        default: 見つからない場合の値
+
+    Returns:
+        アスペクト比文字列
+    """
+    valid = set(ASPECT_RATIOS.values())
+    pending = [data]
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, dict):
+            value = node.get('aspect_ratio')
+            if isinstance(value, str) and value.strip() in valid:
+                return value.strip()
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return default
+
+
+def build_output_names(yaml_paths: list) -> dict:
+    """
+    出力ファイル名（拡張子なし）を決定
+
+    同じファイル名が複数ディレクトリにある場合は親ディレクトリ名を付けて区別する。
+
+    Returns:
+        {yaml_path: output_stem}
+    """
+    stems = {}
+    for path in yaml_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        stems.setdefault(stem, []).append(path)
+
+    names = {}
+    for stem, paths in stems.items():
+        for path in paths:
+            if len(paths) == 1:
+                names[path] = stem
+            else:
+                parent = os.path.basename(os.path.dirname(path))
+                names[path] = f"{parent}__{stem}"
+    return names
+
+
+def _safe_filename(name: str) -> str:
+    """ファイル名に使えない文字を置換"""
+    return re.sub(r'[<>:"/\\|?*]', '_', name).strip() or "untitled"
+
+
+def plan_batch(
+    yaml_paths: list,
+    output_dir: str,
+    resolution: str = "2K",
+    aspect_ratio: str = None,
+    ref_dirs: list = None,
+    force: bool = False
+) -> list:
+    """
+    バッチ生成の実行計画を作成
+
+    Args:
+        yaml_paths: YAMLファイルパスのリスト
+        output_dir: 出力ディレクトリ
+        resolution: 解像度
+        aspect_ratio: アスペクト比（NoneならYAMLから取得）
+        ref_dirs: 参照画像の追加検索ディレクトリ
+        force: 既存の出力があっても再生成するか
+
+    Returns:
+        タスク辞書のリスト:
+        {
+            'yaml_path', 'image_path', 'metadata_path', 'prompt',
+            'ref_images', 'missing_refs', 'aspect_ratio', 'resolution',
+            'skip': bool, 'error': str or None
+        }
+    """
+    names = build_output_names(yaml_paths)
+    tasks = []
+    for path in yaml_paths:
+        stem = _safe_filename(names[path])
+        task = {
+            'yaml_path': path,
+            'image_path': os.path.join(output_dir, f"{stem}.png"),
+            'metadata_path': os.path.join(output_dir, f"{stem}.json"),
+            'prompt': None,
+            'ref_images': [],
+            'missing_refs': [],
+            'aspect_ratio': aspect_ratio,
+            'resolution': resolution,
+            'skip': False,
+            'error': None
+        }
+
+        # 既存の出力があればスキップ（再開可能にする）
+        if not force and os.path.exists(task['image_path']):
+            task['skip'] = True
+            tasks.append(task)
+            continue
+
+        success, data, content, error = load_yaml_file(path)
+        if not success:
+            task['error'] = error or "YAMLを読み込めませんでした"
+            tasks.append(task)
+            continue
+
+        task['prompt'] = strip_metadata_section(content)
+        task['ref_images'], task['missing_refs'] = resolve_reference_images(path, data, ref_dirs)
+        if not aspect_ratio:
+            task['aspect_ratio'] = find_aspect_ratio(data)
+        tasks.append(task)
+    return tasks
+
+
+def write_outputs(task: dict, result: dict, mode: str, elapsed: float):
+    """
+    生成結果の画像とメタデータを書き出す
+
+    画像は一時ファイルに書いてから置き換えるため、
+    中断しても不完全な画像が「生成済み」と扱われることはない。
+    """
+    image_path = task['image_path']
+    temp_path = image_path + ".tmp"
+    try:
+        result['image'].save(temp_path, "PNG")
+        os.replace(temp_path, image_path)
+    finally:
+        # 書き込みに失敗した一時ファイルは残さない
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError as e:
+                print(f"Warning: Could not remove {temp_path}: {e}")
+
+    metadata = {
+        'source_yaml': task['yaml_path'],
+        'image': os.path.basename(image_path),
+        'mode': mode,
+        'resolution': task['resolution'],
+        'aspect_ratio': task['aspect_ratio'],
+        'reference_images': task['ref_images'],
+        'missing_references': task['missing_refs'],
+        'elapsed_sec': round(elapsed, 2),
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    with open(task['metadata_path'], 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def run_batch(
+    tasks: list,
+    api_key: str,
+    mode: str = "normal",
+    max_workers: int = GENERATION_MAX_WORKERS,
+    use_cache: bool = True,
+    generate_func=generate_image_with_api,
+    dispatch_check=None,
+    cancel_event: threading.Event = None,
+    on_late_result=None
+):
+    """
+    バッチ生成を実行し、完了したものから順に結果を返すジェネレーター
+
+    Args:
+        tasks: plan_batchで作成したタスクのリスト
+        api_key: Google AI API Key
+        mode: 生成モード
+        max_workers: 並列実行数
+        use_cache: 結果キャッシュを使うか
+        generate_func: 生成関数（テスト用に差し替え可能）
+        dispatch_check: 各ジョブの実行直前の確認（予算ガードなど、GenerationEngine参照）
+        cancel_event: セットされたら残りのジョブをキャンセルする
+                      （実行中のジョブは送信中のリクエストを打ち切り、キャンセル扱いの結果を返す）
+        on_late_result: 打ち切ったジョブ（結果の'abandoned'がTrue）の関数が後から戻ったときの
+                        コールバック (task, result)。ワーカースレッドから呼ばれる
+
+    Yields:
+        (task, result, elapsed) 完了した順
+        スキップ・読込エラーのタスクは最初にまとめて返す
+    """
+    for task in tasks:
+        if task['skip']:
+            yield task, {'success': True, 'image': None, 'error': None, 'skipped': True}, 0.0
+        elif task['error']:
+            yield task, {'success': False, 'image': None, 'error': task['error']}, 0.0
+
+    runnable = [t for t in tasks if not t['skip'] and not t['error']]
+    if not runnable:
+        return
+
+    completed = queue.Queue()
+    engine = GenerationEngine(
+        max_workers=max_workers,
+        default_timeout=GENERATION_TIMEOUT_SEC,
+        dispatch_check=dispatch_check
+    )
+    for task in runnable:
+        # ジョブごとのEventをgenerate_funcとエンジンで共有し、キャンセルを実行中の呼び出しにも伝える
+        job_cancel_event = threading.Event()
+        engine.submit(
+            generate_func,
+            kwargs=dict(
+                api_key=api_key,
+                yaml_prompt=task['prompt'],
+                char_image_paths=task['ref_images'],
+                resolution=task['resolution'],
+                ref_image_path=None,
+                aspect_ratio=task['aspect_ratio'],
+                mode=mode,
+                use_cache=use_cache,
+                cancel_event=job_cancel_event
+            ),
+            label=os.path.basename(task['yaml_path']),
+            meta={'task': task},
+            on_complete=lambda job, result: completed.put((job, result)),
+            cancel_event=job_cancel_event,
+            on_late_result=(
+                (lambda job, result: on_late_result(job.meta['task'], result))
+                if on_late_result else None
+            )
+        )
+
+    try:
+        cancelling = False
+        for _ in range(len(runnable)):
+            while True:
+                if not cancelling and cancel_event is not None and cancel_event.is_set():
+                    cancelling = True
+                    engine.cancel_all()
+                try:
+                    job, result = completed.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            elapsed = (job.finished_at or time.time()) - (job.started_at or job.submitted_at)
+            yield job.meta['task'], result, elapsed
+    finally:
+        engine.shutdown()
@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+"""
+単色背景の除去ロジック
+画像の端から連続した「指定色に近いピクセル」の領域を透過する
+
+NumPyがあれば配列演算で処理し（4K画像でも1秒前後）、なければ従来の
+ピクセル単位の幅優先探索で処理する。どちらも同じ透過マスクになる。
+NumPy版では、背景との境界付近を色の距離に応じて半透明にし（アンチエイリアス）、
+輪郭に残った背景色（色かぶり）を取り除くこともできる。
+大きな画像（ポスター・つなぎ合わせたページなど）は横長の帯（タイル）ごとに処理し、
+作業用のメモリを帯の大きさに抑える。
+"""
+
+import itertools
+import os
+import sys
+from collections import deque
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import (
+    BG_REMOVAL_EDGE_SOFTNESS, BG_REMOVAL_PREVIEW_EDGE, BG_REMOVAL_TILE_PIXELS, BG_REMOVAL_TILED_MIN_PIXELS
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# 処理方式
+METHOD_NUMPY = "numpy"    # 配列演算（デフォルト。大きな画像は自動で帯ごとの処理）
+METHOD_TILED = "tiled"    # 配列演算を帯ごとに行う（メモリを抑える）
+METHOD_LEGACY = "legacy"  # ピクセル単位の幅優先探索（比較用）
+
+
+def is_numpy_available() -> bool:
+    """NumPyが使えるかどうか"""
+    return np is not None
+
+
+def remove_color_background(
+    image: Image.Image,
+    target_color: tuple,
+    tolerance: int,
+    method: str = METHOD_NUMPY,
+    feather: int = 0,
+    softness: int = BG_REMOVAL_EDGE_SOFTNESS,
+    despill: bool = True,
+    in_place: bool = False
+) -> Image.Image:
+    """
+    端から連続した単色背景を透過した画像を作成
+
+    Args:
+        image: 入力画像（in_placeでなければ元の画像は変更しない）
+        target_color: 除去する色 (R, G, B)
+        tolerance: 許容値（RGB各チャンネルの差の絶対値の合計がこれ以下なら背景）
+        method: 処理方式 ("numpy" / "tiled" / "legacy")
+        feather: 背景から何ピクセル以内の輪郭を半透明にするか（0なら透過/不透過の2値。NumPy版のみ）
+        softness: 輪郭を半透明にする色の距離の幅（許容値＋この値で不透明になる）
+        despill: 半透明にした輪郭から背景色の色かぶりを取り除くか
+        in_place: RGBA画像なら、コピーせずにその画像へ書き込む（帯ごとの処理のみ）
+
+    Returns:
+        RGBA画像（背景部分のアルファが0）
+    """
+    if method in (METHOD_NUMPY, METHOD_TILED) and np is None:
+        print("Warning: NumPy is not installed, using legacy background removal")
+        method = METHOD_LEGACY
+
+    if method == METHOD_LEGACY:
+        if feather > 0:
+            print("Warning: Edge feathering requires NumPy, using hard edges")
+        return _remove_color_background_legacy(image, target_color, tolerance)
+
+    if method == METHOD_TILED or image.width * image.height >= BG_REMOVAL_TILED_MIN_PIXELS:
+        return remove_color_background_tiled(
+            image, target_color, tolerance,
+            feather=feather, softness=softness, despill=despill, in_place=in_place
+        )
+
+    img = image.convert("RGBA")
+    mask = compute_background_mask(img, target_color, tolerance)
+    return _apply_background_mask(img, mask, target_color, tolerance, feather, softness, despill)
+
+
+def remove_color_background_tiled(
+    image: Image.Image,
+    target_color: tuple,
+    tolerance: int,
+    feather: int = 0,
+    softness: int = BG_REMOVAL_EDGE_SOFTNESS,
+    despill: bool = True,
+    in_place: bool = False,
+    tile_pixels: int = BG_REMOVAL_TILE_PIXELS
+) -> Image.Image:
+    """
+    横長の帯ごとに単色背景を透過（結果はremove_color_backgroundと同じ）
+
+    画像全体で持つのは「背景色に近いか」「端から到達したか」の1ピクセル1ビットの
+    マスクだけで、色の距離・区間番号・アルファなどの作業用の配列は帯の大きさで済む。
+    フラッドフィルは帯ごとに行い、上下の帯の境目の行から到達を引き継いで、
+    上から下・下から上へ変化がなくなるまで繰り返す。
+
+    Args:
+        image: 入力画像
+        target_color: 除去する色 (R, G, B)
+        tolerance: 許容値
+        feather: 輪郭を半透明にする幅（ピクセル）
+        softness: 半透明にする色の距離の幅
+        despill: 色かぶりを取り除くか
+        in_place: RGBA画像なら、コピーせずにその画像へ書き込む
+        tile_pixels: 1つの帯のおおよそのピクセル数
+
+    Returns:
+        RGBA画像（背景部分のアルファが0）
+    """
+    width, height = image.size
+    if width == 0 or height == 0:
+        return image.convert("RGBA")
+
+    rows = max(1, tile_pixels // width)
+    strips = [(top, min(top + rows, height)) for top in range(0, height, rows)]
+
+    # 背景色に近いピクセル（1ピクセル1ビット）
+    candidates = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+    for top, bottom in strips:
+        strip = image.crop((0, top, width, bottom))
+        candidates[top:bottom] = np.packbits(color_distance_mask(strip, target_color, tolerance), axis=1)
+
+    reached = _flood_tiled(candidates, width, strips)
+
+    if in_place and image.mode == "RGBA":
+        result = image
+    else:
+        result = Image.new("RGBA", (width, height))
+
+    # 輪郭の半透明化は前後feather行の背景を見るので、その分だけ帯を広げて処理する
+    margin = max(feather, 0)
+    for top, bottom in strips:
+        upper, lower = max(0, top - margin), min(height, bottom + margin)
+        strip = image.crop((0, upper, width, lower)).convert("RGBA")
+        mask = _unpack_rows(reached[upper:lower], width)
+        strip = _apply_background_mask(strip, mask, target_color, tolerance, feather, softness, despill)
+        if upper != top or lower != bottom:
+            strip = strip.crop((0, top - upper, width, bottom - upper))
+        result.paste(strip, (0, top))
+    return result
+
+
+def _flood_tiled(candidates: "np.ndarray", width: int, strips: list) -> "np.ndarray":
+    """
+    ビット詰めのマスクに対して、帯ごとに端からのフラッドフィルを行う
+
+    Args:
+        candidates: 背景色に近いピクセルのビット詰めのマスク (高さ, (幅+7)//8)
+        width: 画像の幅
+        strips: 帯の行範囲 [(上端, 下端)]
+
+    Returns:
+        端から到達できるピクセルのビット詰めのマスク
+    """
+    height = candidates.shape[0]
+    reached = np.zeros_like(candidates)
+    order = list(range(len(strips)))
+    order += order[::-1][1:]  # 上から下、下から上（折り返しの帯は1回だけ）
+    # 前回処理したときの帯（上下1行を含む）の到達状態。変わっていなければ処理し直さない
+    processed = [None] * len(strips)
+
+    changed = True
+    while changed:
+        changed = False
+        for index in order:
+            top, bottom = strips[index]
+            # 上下1行ずつ隣の帯に重ねて、境目の行から到達を引き継ぐ
+            upper, lower = max(0, top - 1), min(height, bottom + 1)
+            if processed[index] is not None and np.array_equal(processed[index], reached[upper:lower]):
+                continue
+            mask = _unpack_rows(candidates[upper:lower], width)
+            seeds = _unpack_rows(reached[upper:lower], width)
+            seeds[:, 0] |= mask[:, 0]
+            seeds[:, -1] |= mask[:, -1]
+            if upper == 0:
+                seeds[0, :] |= mask[0, :]
+            if lower == height:
+                seeds[-1, :] |= mask[-1, :]
+
+            packed = np.packbits(flood_fill(mask, seeds), axis=1)
+            if not np.array_equal(packed, reached[upper:lower]):
+                reached[upper:lower] = packed
+                changed = True
+            processed[index] = packed
+    return reached
+
+
+def _unpack_rows(packed: "np.ndarray", width: int) -> "np.ndarray":
+    """ビット詰めのマスクをboolの配列に戻す"""
+    return np.unpackbits(packed, axis=1, count=width).view(bool)
+
+
+def _apply_background_mask(
+    img: Image.Image,
+    mask: "np.ndarray",
+    target_color: tuple,
+    tolerance: int,
+    feather: int,
+    softness: int,
+    despill: bool
+) -> Image.Image:
+    """
+    背景のマスクをアルファに反映（featherが正なら輪郭を半透明にする）
+
+    Args:
+        img: RGBA画像（この画像を更新して返す）
+        mask: 背景のマスク
+
+    Returns:
+        更新したRGBA画像
+    """
+    alpha = np.array(img.getchannel("A"))
+    alpha[mask] = 0
+    if feather > 0:
+        return _apply_soft_edges(img, mask, alpha, target_color, tolerance, feather, softness, despill)
+    img.putalpha(Image.fromarray(alpha, "L"))
+    return img
+
+
+def compute_background_mask(image: Image.Image, target_color: tuple, tolerance: int) -> "np.ndarray":
+    """
+    透過すべきピクセルのマスクを計算（NumPy版）
+
+    Args:
+        image: 入力画像
+        target_color: 除去する色 (R, G, B)
+        tolerance: 許容値（RGBの差の絶対値の合計）
+
+    Returns:
+        (高さ, 幅) のboolの配列。Trueが背景
+    """
+    return flood_from_border(color_distance_mask(image, target_color, tolerance))
+
+
+def color_distance_mask(image: Image.Image, target_color: tuple, tolerance: int) -> "np.ndarray":
+    """
+    指定色との距離（RGB各チャンネルの差の絶対値の合計）が許容値以下のピクセル
+
+    Returns:
+        (高さ, 幅) のboolの配列
+    """
+    rgb = image if image.mode == "RGB" else image.convert("RGB")
+    distance = None
+    for channel, target in zip(rgb.split(), target_color):
+        # |値 - 指定色| は0〜255に収まるので、チャンネルごとの変換表でPIL側で計算する
+        diff = np.asarray(channel.point([abs(value - int(target)) for value in range(256)]))
+        distance = diff.astype(np.uint16) if distance is None else distance + diff
+    return distance <= tolerance
+
+
+def flood_from_border(mask: "np.ndarray") -> "np.ndarray":
+    """
+    画像の端から4近傍でつながっているmaskの領域を取り出す
+
+    Args:
+        mask: (高さ, 幅) のboolの配列（背景色に近いピクセル）
+
+    Returns:
+        端から到達できるピクセルのboolの配列
+    """
+    height, width = mask.shape
+    if height == 0 or width == 0:
+        return np.zeros_like(mask, dtype=bool)
+
+    # 4辺の背景色のピクセルから開始
+    seeds = np.zeros(mask.shape, dtype=bool)
+    seeds[0, :] = True
+    seeds[-1, :] = True
+    seeds[:, 0] = True
+    seeds[:, -1] = True
+    return flood_fill(mask, seeds)
+
+
+def flood_fill(mask: "np.ndarray", seeds: "np.ndarray") -> "np.ndarray":
+    """
+    seedsから4近傍でつながっているmaskの領域を取り出す
+
+    行方向と列方向に「到達済みのピクセルを含む連続区間（ラン）全体を到達済みにする」
+    処理を交互に繰り返し、増えなくなったら終了する（スキャンラインのフラッドフィル）。
+    4近傍の経路は横方向と縦方向の移動の組み合わせなので、結果は幅優先探索と一致する。
+
+    Args:
+        mask: (高さ, 幅) のboolの配列（背景色に近いピクセル）
+        seeds: 開始点のboolの配列（mask外の点は無視）
+
+    Returns:
+        seedsから到達できるピクセルのboolの配列
+    """
+    mask = np.ascontiguousarray(mask, dtype=bool)
+    if mask.size == 0:
+        return np.zeros_like(mask)
+
+    # 行方向・列方向の区間番号（区間はmaskの中だけで変わらないので最初に1回だけ計算）
+    row_labels = _label_runs(mask)
+    col_ids, col_count = _label_runs(np.ascontiguousarray(mask.T))
+    col_labels = (np.ascontiguousarray(col_ids.T), col_count)
+
+    reached = seeds & mask
+    count = int(np.count_nonzero(reached))
+    for step in itertools.count():
+        run_ids, run_count = row_labels if step % 2 == 0 else col_labels
+        hit = np.zeros(run_count + 1, dtype=bool)
+        hit[run_ids[reached]] = True
+        hit[0] = False  # mask外
+        reached = hit[run_ids]
+
+        new_count = int(np.count_nonzero(reached))
+        # 直前の向きで広げた結果が、この向きでも増えなければ両方向とも広がらない
+        if step > 0 and new_count == count:
+            return reached
+        count = new_count
+
+
+def _label_runs(mask: "np.ndarray") -> tuple:
+    """
+    各行のmaskの連続区間（ラン）に1から通し番号を振る
+
+    Args:
+        mask: (行数, 列数) のboolの配列（C連続）
+
+    Returns:
+        (区間番号の配列（mask外は0）, 区間の数)
+    """
+    width = mask.shape[1]
+    flat = mask.ravel()
+
+    # 区間の先頭（行頭、または左隣がmask外）に印を付け、累積和で番号を振る
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    starts[::width] = flat[::width]
+    run_ids = np.cumsum(starts, dtype=np.int32).reshape(mask.shape)
+    count = int(run_ids[-1, -1])
+    run_ids[~mask] = 0
+    return run_ids, count
+
+
+def load_preview_source(path: str, max_edge: int = BG_REMOVAL_PREVIEW_EDGE) -> tuple:
+    """
+    プレビュー用に縮小した入力画像を読み込む
+
+    スライダー操作のたびに縮小画像だけを処理すれば、4K画像でも即座に結果を表示できる。
+
+    Args:
+        path: 画像ファイルのパス
+        max_edge: 縮小後の長辺
+
+    Returns:
+        (縮小したRGBA画像, 元の画像サイズ)
+    """
+    with Image.open(path) as img:
+        full_size = img.size
+        if max(full_size) > max_edge:
+            # draftが効く形式（JPEG）はデコード時点で縮小しておく
+            img.draft("RGB", (max_edge, max_edge))
+        small = img.convert("RGBA")
+    small.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return small, full_size
+
+
+def scale_feather(feather: int, preview_size: tuple, full_size: tuple) -> int:
+    """元画像用の輪郭の幅を縮小画像用に換算（0でなければ最低1ピクセル）"""
+    if feather <= 0:
+        return 0
+    scale = max(preview_size) / max(max(full_size), 1)
+    return max(1, round(feather * scale))
+
+
+def render_on_checkerboard(image: Image.Image, cell: int = 8) -> Image.Image:
+    """
+    透過画像を市松模様の上に重ねた表示用画像を作成
+
+    Args:
+        image: RGBA画像
+        cell: 市松模様の1マスのピクセル数
+
+    Returns:
+        RGB画像
+    """
+    width, height = image.size
+    board = Image.new("RGB", (cell * 2, cell * 2), (255, 255, 255))
+    board.paste((204, 204, 204), (cell, 0, cell * 2, cell))
+    board.paste((204, 204, 204), (0, cell, cell, cell * 2))
+    background = Image.new("RGB", (width, height))
+    for y in range(0, height, cell * 2):
+        for x in range(0, width, cell * 2):
+            background.paste(board, (x, y))
+    background.paste(image, (0, 0), image)
+    return background
+
+
+def _apply_soft_edges(
+    img: Image.Image,
+    mask: "np.ndarray",
+    alpha: "np.ndarray",
+    target_color: tuple,
+    tolerance: int,
+    feather: int,
+    softness: int,
+    despill: bool
+) -> Image.Image:
+    """
+    背景に接する輪郭のピクセルを半透明にし、色かぶりを取り除く
+
+    輪郭（背景からfeatherピクセル以内の前景）だけを1次元に取り出して計算するため、
+    4K画像でも処理量は輪郭のピクセル数に比例する。
+
+    Args:
+        img: RGBA画像（この画像を更新して返す）
+        mask: 背景のマスク
+        alpha: 背景を0にしたアルファ（更新する）
+        target_color: 背景色 (R, G, B)
+        tolerance: 許容値
+        feather: 輪郭の幅（ピクセル）
+        softness: 半透明にする色の距離の幅
+        despill: 色かぶりを取り除くか
+
+    Returns:
+        更新したRGBA画像
+    """
+    band = _dilate(mask, feather) & ~mask
+    ys, xs = np.nonzero(band)
+    if len(ys) == 0:
+        img.putalpha(Image.fromarray(alpha, "L"))
+        return img
+
+    pixels = np.array(img)
+    colors = pixels[ys, xs, :3].astype(np.float32)
+    background = np.asarray(target_color, dtype=np.float32)
+
+    # 色の距離が許容値〜許容値+softnessの範囲で、アルファを0→1に上げる
+    distance = np.abs(colors - background).sum(axis=1)
+    coverage = np.clip((distance - tolerance) / max(softness, 1), 0.0, 1.0)
+    coverage *= alpha[ys, xs] / 255.0
+
+    if despill:
+        colors = _remove_spill(colors, coverage, background)
+        pixels[ys, xs, :3] = np.rint(colors).astype(np.uint8)
+
+    alpha[ys, xs] = np.rint(coverage * 255).astype(np.uint8)
+    pixels[:, :, 3] = alpha
+    return Image.fromarray(pixels, "RGBA")
+
+
+def _remove_spill(colors: "np.ndarray", coverage: "np.ndarray", background: "np.ndarray") -> "np.ndarray":
+    """
+    輪郭の色から背景色の混ざりを取り除く
+
+    補正するのは出力のアルファが 0 < alpha < 255 になる半透明のピクセルだけで、
+    不透明のまま残るピクセル（前景の本来の色）は変えない。
+    半透明のピクセルは「前景色×a + 背景色×(1-a)」とみなして前景色を求め直し、
+    さらにグリーンバック・ブルーバックのような彩度の高い背景色では、
+    背景色の主成分のチャンネルが他のチャンネルを上回らないように抑える。
+
+    Args:
+        colors: (N, 3) の輪郭のピクセルの色
+        coverage: (N,) のアルファ (0〜1)
+        background: 背景色 (R, G, B)
+
+    Returns:
+        (N, 3) の補正した色
+    """
+    # 出力するアルファ（0〜255に丸めた値）で半透明かどうかを決める
+    alpha8 = np.rint(coverage * 255)
+    partial = (alpha8 > 0) & (alpha8 < 255)
+    a = coverage[partial, None]
+    spill = (colors[partial] - background * (1 - a)) / a
+
+    if background.max() - background.min() >= 128:
+        dominant = background >= background.max() - 1e-3
+        others = spill[:, ~dominant].max(axis=1, keepdims=True)
+        spill[:, dominant] = np.minimum(spill[:, dominant], others)
+    colors[partial] = np.clip(spill, 0, 255)
+    return colors
+
+
+def _dilate(mask: "np.ndarray", radius: int) -> "np.ndarray":
+    """maskを4近傍でradiusピクセル広げる"""
+    grown = mask.copy()
+    for _ in range(radius):
+        step = grown.copy()
+        step[1:, :] |= grown[:-1, :]
+        step[:-1, :] |= grown[1:, :]
+        step[:, 1:] |= grown[:, :-1]
+        step[:, :-1] |= grown[:, 1:]
+        grown = step
+    return grown
+
+
+def _remove_color_background_legacy(image: Image.Image, target_color: tuple, tolerance: int) -> Image.Image:
+    """単色背景を透過に変換（従来のフラッドフィル方式：ピクセル単位の幅優先探索）"""
+    img = image.convert("RGBA")
+    if img is image:
+        img = img.copy()
+    width, height = img.size
+    pixels = img.load()
+
+    def is_target_color(pixel):
+        """指定色かどうかを判定"""
+        r, g, b = pixel[0], pixel[1], pixel[2]
+        distance = abs(r - target_color[0]) + abs(g - target_color[1]) + abs(b - target_color[2])
+        return distance <= tolerance
+
+    # フラッドフィル用のマスク（透過すべきピクセル）
+    to_remove = set()
+
+    # 4辺の端から開始点を収集
+    start_points = []
+    # 上端と下端
+    for x in range(width):
+        start_points.append((x, 0))
+        start_points.append((x, height - 1))
+    # 左端と右端
+    for y in range(height):
+        start_points.append((0, y))
+        start_points.append((width - 1, y))
+
+    # BFSでフラッドフィル
+    visited = set()
+    queue = deque()
+
+    for point in start_points:
+        if point not in visited:
+            x, y = point
+            pixel = pixels[x, y]
+            if is_target_color(pixel):
+                queue.append(point)
+                visited.add(point)
+
+    while queue:
+        x, y = queue.popleft()
+        pixel = pixels[x, y]
+
+        if is_target_color(pixel):
+            to_remove.add((x, y))
+
+            # 4方向の隣接ピクセルをチェック
+            for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < width and 0 <= ny < height and (nx, ny) not in visited:
+                    visited.add((nx, ny))
+                    queue.append((nx, ny))
+
+    # 透過処理を適用
+    for x, y in to_remove:
+        r, g, b, a = pixels[x, y]
+        pixels[x, y] = (r, g, b, 0)
+
+    return img
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+背景透過の一括処理ロジック
+フォルダ内の画像をプロセスプールで並列に透過し、入力ファイル名_transparent.png に保存する
+"""
+
+import glob
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import BG_REMOVAL_MAX_WORKERS, BG_REMOVAL_OUTPUT_SUFFIX
+from logic.bg_removal import remove_color_background
+
+
+# 入力として扱う画像の拡張子
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+
+def get_output_path(input_path: str) -> str:
+    """入力画像に対応する透過画像のパス（入力ファイル名_transparent.png）"""
+    base, _ = os.path.splitext(input_path)
+    return f"{base}{BG_REMOVAL_OUTPUT_SUFFIX}.png"
+
+
+def collect_image_files(folder: str, recursive: bool = False) -> list:
+    """
+    フォルダ内の入力画像を収集（過去に出力した透過画像は除く）
+
+    Args:
+        folder: 画像フォルダ
+        recursive: サブフォルダも検索するか
+
+    Returns:
+        画像ファイルパスのリスト（名前順）
+    """
+    pattern = os.path.join(folder, "**", "*") if recursive else os.path.join(folder, "*")
+    paths = []
+    for path in sorted(glob.glob(pattern, recursive=recursive)):
+        if not os.path.isfile(path) or not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stem, _ = os.path.splitext(os.path.basename(path))
+        if stem.endswith(BG_REMOVAL_OUTPUT_SUFFIX):
+            continue
+        paths.append(path)
+    return paths
+
+
+def plan_bg_removal(image_paths: list, force: bool = False) -> list:
+    """
+    一括処理の実行計画を作成
+
+    Args:
+        image_paths: 入力画像のパスのリスト
+        force: 入力より新しい出力があっても処理し直すか
+
+    Returns:
+        タスク辞書のリスト: {'input_path', 'output_path', 'skip': bool}
+    """
+    tasks = []
+    for path in image_paths:
+        output_path = get_output_path(path)
+        skip = (
+            not force
+            and os.path.exists(output_path)
+            and os.path.getmtime(output_path) >= os.path.getmtime(path)
+        )
+        tasks.append({'input_path': path, 'output_path': output_path, 'skip': skip})
+    return tasks
+
+
+def remove_background_file(
+    input_path: str,
+    output_path: str,
+    target_color: tuple,
+    tolerance: int,
+    feather: int = 0
+) -> dict:
+    """
+    画像ファイル1件の背景を透過して保存（プロセスプールのワーカーで実行）
+
+    出力は一時ファイルに書いてから置き換えるため、中断しても
+    不完全な画像が「処理済み」と扱われることはない。
+
+    Returns:
+        {'success': bool, 'image': None, 'error': str or None}
+    """
+    temp_path = output_path + ".tmp"
+    try:
+        with Image.open(input_path) as img:
+            result = remove_color_background(img, target_color, tolerance, feather=feather, in_place=True)
+            result.save(temp_path, "PNG")
+        os.replace(temp_path, output_path)
+        return {'success': True, 'image': None, 'error': None}
+    except Exception as e:
+        return {'success': False, 'image': None, 'error': str(e)}
+    finally:
+        # 保存・置き換えに失敗した一時ファイルは残さない
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError as e:
+                print(f"Warning: Could not remove {temp_path}: {e}")
+
+
+def run_bg_removal(
+    tasks: list,
+    target_color: tuple,
+    tolerance: int,
+    feather: int = 0,
+    max_workers: int = BG_REMOVAL_MAX_WORKERS,
+    cancel_event: Optional[threading.Event] = None
+):
+    """
+    一括処理を実行し、完了したものから順に結果を返すジェネレーター
+
+    Args:
+        tasks: plan_bg_removalで作成したタスクのリスト
+        target_color: 除去する色 (R, G, B)
+        tolerance: 許容値
+        feather: 輪郭を半透明にする幅（0なら2値）
+        max_workers: 並列プロセス数（0ならCPUコア数）
+        cancel_event: セットされたら未開始のファイルを取り消して終了
+
+    Yields:
+        (task, result) 完了した順
+        スキップするタスクは最初にまとめて返す
+    """
+    for task in tasks:
+        if task['skip']:
+            yield task, {'success': True, 'image': None, 'error': None, 'skipped': True}
+
+    runnable = [t for t in tasks if not t['skip']]
+    if not runnable:
+        return
+
+    workers = max_workers if max_workers > 0 else (os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(runnable)))
+    try:
+        futures = {
+            executor.submit(
+                remove_background_file,
+                task['input_path'], task['output_path'], target_color, tolerance, feather
+            ): task
+            for task in runnable
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # ワーカープロセスの異常終了など
+                result = {'success': False, 'image': None, 'error': str(e)}
+            yield futures[future], result
+            if cancel_event is not None and cancel_event.is_set():
+                break
+    finally:
+        # 途中で終了した場合は未開始のファイルを取り消す
+        executor.shutdown(wait=True, cancel_futures=True)
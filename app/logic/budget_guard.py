@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+API予算ガードモジュール
+生成ジョブを実行する直前に、使用済みの概算料金と実行中のジョブの料金を合わせて
+予算を超えないかを確認し、超える場合は警告する、または実行を止める
+"""
+
+import os
+import sys
+import threading
+from datetime import date
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import API_BUDGET_ACTION
+
+from .api_client import is_result_cached
+
+
+# 予算を超える場合の動作
+BUDGET_WARN = "warn"    # 警告して続行
+BUDGET_BLOCK = "block"  # 生成しない
+
+
+class BudgetGuard:
+    """
+    GenerationEngineのdispatch_checkとして使う予算確認
+
+    ジョブのkwargs（generate_image_with_apiの引数）のモード・解像度から料金を見積もる。
+    実行中のジョブの料金も使用済みに加えて判定するため、並列実行でも予算を大きく超えない。
+    結果キャッシュから返せるジョブはAPIを呼ばないため料金0とする。
+    """
+
+    def __init__(self, tracker, action: str = API_BUDGET_ACTION,
+                 on_warning: Optional[Callable] = None,
+                 is_cached: Optional[Callable] = None):
+        """
+        Args:
+            tracker: 料金と予算を持つUsageTracker
+            action: 予算を超える場合の動作 ("warn" / "block")
+            on_warning: 警告時のコールバック (message)。ワーカースレッドから1日1回呼ばれる
+            is_cached: ジョブのkwargsの結果がキャッシュにあるか (kwargs) -> bool
+                       （省略時はis_result_cached。テスト用に差し替え可能）
+        """
+        self.tracker = tracker
+        self.action = action
+        self.on_warning = on_warning
+        self.is_cached = is_cached or (lambda kwargs: is_result_cached(**kwargs))
+        self._warned_on = None  # 最後に警告を通知した日
+        self._lock = threading.Lock()
+
+    def estimate_job_cost(self, job) -> float:
+        """ジョブ1件の概算料金（解像度の指定がないジョブ・キャッシュから返せるジョブは0）"""
+        resolution = job.kwargs.get('resolution')
+        if resolution is None:
+            return 0.0
+        if job.kwargs.get('use_cache') and self.is_cached(job.kwargs):
+            return 0.0
+        return self.tracker.get_price(job.kwargs.get('mode', "normal"), resolution)
+
+    def __call__(self, job, running_jobs: list) -> Optional[str]:
+        """
+        ジョブを実行してよいか確認
+
+        Args:
+            job: これから実行するジョブ
+            running_jobs: 実行中のジョブ（打ち切ったが応答待ちのリクエストを含む）
+
+        Returns:
+            実行しない場合はその理由、実行してよい場合はNone
+        """
+        cost = self.estimate_job_cost(job)
+        if cost <= 0:
+            return None
+        committed = sum(self.estimate_job_cost(running) for running in running_jobs)
+        message = self.tracker.check_budget(committed + cost)
+        if message is None:
+            return None
+
+        if self.action == BUDGET_BLOCK:
+            return f"予算を超えるため生成を中止しました: {message}"
+
+        print(f"Warning: {message}")
+        with self._lock:
+            first_today = self._warned_on != date.today()
+            self._warned_on = date.today()
+        if first_today and self.on_warning:
+            self.on_warning(message)
+        return None
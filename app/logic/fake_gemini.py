@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+オフライン用のGeminiクライアント代替
+generate_contentのレスポンス形式（画像データ・テキストのみ・SAFETY/RECITATION・
+候補なし・HTTPエラー）を遅延と発生率を指定して再現し、
+API使用量を消費せずにスループット・再試行・キューの挙動を計測できるようにする
+"""
+
+import io
+import random
+import threading
+import time
+from typing import Optional
+
+from PIL import Image
+from google.genai import errors, types
+
+from .api_client import get_client_pool, get_payload_size, mark_first_byte
+
+
+# 応答の種類
+OUTCOME_IMAGE = "image"
+OUTCOME_TEXT_ONLY = "text_only"
+OUTCOME_SAFETY = "safety"
+OUTCOME_RECITATION = "recitation"
+OUTCOME_EMPTY = "empty"
+OUTCOME_RATE_LIMIT = "rate_limit"        # 429
+OUTCOME_UNAVAILABLE = "unavailable"      # 503
+OUTCOME_BAD_REQUEST = "bad_request"      # 400（再試行しないエラー）
+
+# 解像度ごとの長辺ピクセル数
+RESOLUTION_EDGES = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+
+class FakeGeminiConfig:
+    """代替クライアントの動作設定"""
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        jitter: float = 0.5,
+        rates: Optional[dict] = None,
+        image_scale: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            latency: 1回の応答にかかる平均秒数
+            jitter: 遅延のばらつき（±秒、一様分布）
+            rates: 応答の種類ごとの発生率 {OUTCOME_*: 0.0〜1.0}
+                   残りの確率は画像付きの正常応答になる
+            image_scale: 返す画像サイズの倍率（4Kのエンコードを避けたい場合に縮小）
+            seed: 乱数シード（再現性が必要な場合）
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rates = dict(rates or {})
+        self.image_scale = image_scale
+        self.random = random.Random(seed)
+
+    def choose_outcome(self) -> str:
+        """発生率に従って応答の種類を選ぶ"""
+        roll = self.random.random()
+        for outcome, rate in self.rates.items():
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return OUTCOME_IMAGE
+
+    def choose_latency(self) -> float:
+        """今回の応答にかける秒数"""
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+
+class FakeModels:
+    """client.models の代替"""
+
+    def __init__(self, client: "FakeGeminiClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents, config=None):
+        """
+        generate_contentの代替
+
+        Raises:
+            google.genai.errors.APIError: 429/503/400を再現する場合
+        """
+        return self._client._generate(model, contents, config)
+
+
+class FakeGeminiClient:
+    """genai.Client の代替（models.generate_content と close のみ）"""
+
+    def __init__(self, config: Optional[FakeGeminiConfig] = None):
+        """
+        Args:
+            config: 動作設定（省略時は既定値）
+        """
+        self.config = config or FakeGeminiConfig()
+        self.models = FakeModels(self)
+        self.closed = False
+        self._lock = threading.Lock()
+        self._images = {}  # {(幅, 高さ): PNGバイト列}
+        self.stats = {'calls': 0, 'in_flight': 0, 'max_in_flight': 0, 'request_bytes': 0}
+        self.outcome_counts = {}
+
+    def close(self):
+        self.closed = True
+
+    def _generate(self, model: str, contents, config):
+        """応答を1件作成（遅延を入れてから返す）"""
+        outcome = self.config.choose_outcome()
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+            self.stats['request_bytes'] += get_payload_size(contents)
+            self.outcome_counts[outcome] = self.outcome_counts.get(outcome, 0) + 1
+
+        try:
+            time.sleep(self.config.choose_latency())
+            # 本物のクライアントのresponseフックと同じく応答ヘッダーの受信時刻を記録
+            mark_first_byte()
+            return self._build_response(outcome, config)
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+    def _build_response(self, outcome: str, config):
+        """応答の種類に応じたレスポンス（またはエラー）を作成"""
+        if outcome == OUTCOME_RATE_LIMIT:
+            raise _api_error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (fake).")
+        if outcome == OUTCOME_UNAVAILABLE:
+            raise _api_error(503, "UNAVAILABLE", "The model is overloaded (fake).")
+        if outcome == OUTCOME_BAD_REQUEST:
+            raise _api_error(400, "INVALID_ARGUMENT", "Request contains an invalid argument (fake).")
+
+        if outcome == OUTCOME_EMPTY:
+            return types.GenerateContentResponse(
+                candidates=[],
+                prompt_feedback=types.GenerateContentResponsePromptFeedback(
+                    block_reason=types.BlockedReason.SAFETY
+                )
+            )
+        if outcome == OUTCOME_SAFETY:
+            return _response([], types.FinishReason.SAFETY)
+        if outcome == OUTCOME_RECITATION:
+            return _response([], types.FinishReason.RECITATION)
+        if outcome == OUTCOME_TEXT_ONLY:
+            return _response(
+                [types.Part(text="画像を生成できませんでした。プロンプトを具体的にしてください。(fake)")],
+                types.FinishReason.STOP
+            )
+
+        data = self._get_image_bytes(config)
+        return _response(
+            [
+                types.Part(text="Here is the generated image. (fake)"),
+                types.Part(inline_data=types.Blob(data=data, mime_type="image/png"))
+            ],
+            types.FinishReason.STOP
+        )
+
+    def _get_image_bytes(self, config) -> bytes:
+        """設定の解像度・アスペクト比に合わせたPNGを返す（サイズごとに使い回す）"""
+        image_config = getattr(config, 'image_config', None)
+        resolution = getattr(image_config, 'image_size', None) or "1K"
+        aspect_ratio = getattr(image_config, 'aspect_ratio', None) or "1:1"
+        size = _image_size(resolution, aspect_ratio, self.config.image_scale)
+
+        with self._lock:
+            data = self._images.get(size)
+        if data is None:
+            image = Image.linear_gradient("L").resize(size).convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[size] = data
+        return data
+
+
+def _response(parts: list, finish_reason) -> types.GenerateContentResponse:
+    """候補1件のレスポンスを作成"""
+    content = types.Content(role="model", parts=parts) if parts else None
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=content, finish_reason=finish_reason)]
+    )
+
+
+def _api_error(code: int, status: str, message: str) -> errors.APIError:
+    """SDKと同じ形式のAPIErrorを作成"""
+    details = []
+    if code == 429:
+        details.append({
+            '@type': 'type.googleapis.com/google.rpc.RetryInfo',
+            'retryDelay': '1s'
+        })
+    return errors.APIError(code, {
+        'error': {'code': code, 'message': message, 'status': status, 'details': details}
+    })
+
+
+def _image_size(resolution: str, aspect_ratio: str, scale: float) -> tuple:
+    """解像度とアスペクト比から画像サイズを計算"""
+    edge = RESOLUTION_EDGES.get(resolution, 1024) * scale
+    try:
+        w_ratio, h_ratio = (float(v) for v in aspect_ratio.split(":"))
+    except ValueError:
+        w_ratio, h_ratio = 1.0, 1.0
+    if w_ratio >= h_ratio:
+        size = (edge, edge * h_ratio / w_ratio)
+    else:
+        size = (edge * w_ratio / h_ratio, edge)
+    return max(1, int(size[0])), max(1, int(size[1]))
+
+
+def install_fake_client(config: Optional[FakeGeminiConfig] = None) -> FakeGeminiClient:
+    """
+    クライアントプールが代替クライアントを返すようにする
+
+    すべてのAPI Keyで同じ代替クライアントを共有するため、
+    戻り値のstatsで呼び出し回数や同時実行数を確認できる。
+
+    Returns:
+        インストールした代替クライアント
+    """
+    client = FakeGeminiClient(config)
+    get_client_pool().set_client_factory(lambda api_key: client)
+    return client
+
+
+def uninstall_fake_client():
+    """クライアントプールを本物のgenai.Clientに戻す"""
+    get_client_pool().set_client_factory(None)
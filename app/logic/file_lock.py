@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+プロセス間ファイルロックモジュール
+同じデータファイルを複数のアプリ・バッチ生成から更新するときに、
+ロック用ファイルに対するOSのロック（fcntl / msvcrt）で書き込みを直列化する
+"""
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# ロックを取り直すまでの待ち時間（秒）
+RETRY_INTERVAL = 0.05
+
+
+class FileLockTimeout(TimeoutError):
+    """制限時間内にロックを取得できなかった（呼び出し側で処理を見送るか後回しにする）"""
+
+
+class FileLock:
+    """
+    ロック用ファイルによるプロセス間の排他ロック
+
+    同じプロセス内のスレッド間の排他は行わないため、呼び出し側で
+    threading.Lockと組み合わせて使う。
+
+    使用例:
+        try:
+            with FileLock("api_usage.json.lock"):
+                ...
+        except FileLockTimeout:
+            ...  # 書き込みを見送る・後回しにする
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        """
+        Args:
+            path: ロック用ファイルのパス（なければ作成）
+            timeout: ロックを待つ最大秒数
+        """
+        self.path = path
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self) -> bool:
+        """
+        ロックを取得（他のプロセスが持っていれば解放されるまで待つ）
+
+        Returns:
+            取得できたかどうか（タイムアウト時はFalse）
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(RETRY_INTERVAL)
+
+    def release(self):
+        """ロックを解放"""
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        # ロックなしで書き込むと他のプロセスの記録を壊すため、取れなければ例外にする
+        if not self.acquire():
+            raise FileLockTimeout(
+                f"Could not lock {os.path.basename(self.path)} within {self.timeout:g}s"
+            )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
@@ -516,11 +516,15 @@ def add_title_to_image(
     font_color: tuple = (255, 255, 255),
     stroke_color: tuple = (0, 0, 0),
     stroke_width: int = 2,
-    margin: int = 20
+    margin: int = 20,
+    in_place: bool = False
 ) -> Image.Image:
     """
     画像にタイトルテキストを合成する
 
+    文字がかかる範囲だけを切り出して描画し、元の位置に貼り戻す。
+    in_placeを指定すると画像全体のコピーも作らない（大きな画像向け）。
+
     Args:
         image: 元の画像（PILのImageオブジェクト）
         title: 表示するタイトル文字列
@@ -530,16 +534,15 @@ def add_title_to_image(
         stroke_color: 縁取り色 (R, G, B)
         stroke_width: 縁取りの太さ
         margin: 画像端からの余白
+        in_place: 元の画像に直接描画するか
 
     Returns:
-        タイトルが合成された新しい画像
+        タイトルが合成された画像（in_placeならimageそのもの、それ以外は新しい画像）
     """
     if not title:
         return image
 
-    # 画像をコピーして編集
-    result = image.copy()
-    draw = ImageDraw.Draw(result)
+    result = image if in_place else image.copy()
 
     # フォントサイズを自動計算（画像の高さの約5%）
     if font_size is None:
@@ -549,7 +552,7 @@ def add_title_to_image(
     font = _get_japanese_font(font_size)
 
     # テキストのバウンディングボックスを取得
-    bbox = draw.textbbox((0, 0), title, font=font)
+    bbox = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), title, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
 
@@ -560,15 +563,24 @@ def add_title_to_image(
         position, margin
     )
 
-    # 縁取り付きでテキストを描画
-    draw.text(
-        (x, y),
+    # 文字（縁取りを含む）がかかる範囲だけを切り出して描画
+    left = max(0, x + bbox[0] - stroke_width)
+    top = max(0, y + bbox[1] - stroke_width)
+    right = min(image.width, x + bbox[2] + stroke_width + 1)
+    bottom = min(image.height, y + bbox[3] + stroke_width + 1)
+    if left >= right or top >= bottom:
+        return result
+
+    region = result.crop((left, top, right, bottom))
+    ImageDraw.Draw(region).text(
+        (x - left, y - top),
         title,
         font=font,
         fill=font_color,
         stroke_width=stroke_width,
         stroke_fill=stroke_color
     )
+    result.paste(region, (left, top))
 
     return result
 
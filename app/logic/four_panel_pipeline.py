@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+4コマ漫画のコマ別生成パイプライン
+4コマを1枚の画像として生成する代わりに、コマごとに独立したリクエストを
+並列に投げ、失敗したコマだけを再生成できるようにする
+"""
+
+import json
+import os
+import sys
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import COLOR_MODES, OUTPUT_STYLES, FOUR_PANEL_MAX_RETRIES
+from .reference_collector import number_character_references
+
+
+# 各コマのアスペクト比（漫画ページコンポーザーの4コマテンプレートと合わせる）
+PANEL_ASPECT_RATIO = "16:9"
+
+# 合成に使うコンポーザーのテンプレート名
+COMPOSER_TEMPLATE = "4コマ（16:9縦並び）"
+
+# コマの役割（起承転結）
+PANEL_LABELS = ["起", "承", "転", "結"]
+
+
+def _panel_label(index: int) -> str:
+    """コマ番号（0から）に対応する役割ラベル"""
+    return PANEL_LABELS[index] if index < len(PANEL_LABELS) else str(index + 1)
+
+
+def _quote(value) -> str:
+    """
+    ユーザーが入力した文字列をYAMLのダブルクォート文字列にする
+
+    JSONの文字列はYAMLのダブルクォート文字列としても正しいため、
+    引用符・改行・バックスラッシュを含むセリフでもYAMLが崩れない。
+    """
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def build_panel_prompt(settings: dict, panel_index: int, color_mode: str,
+                       output_style: str, title: str = "", author: str = "") -> str:
+    """
+    1コマ分の生成プロンプトを作成
+
+    キャラクター設定と全体の流れは全コマで共通にし、
+    担当するコマの内容だけを詳しく指示する。
+
+    Args:
+        settings: FourPanelWindowの設定データ（characters, panels）
+        panel_index: コマ番号（0から）
+        color_mode: カラーモード（COLOR_MODESのキー）
+        output_style: 出力スタイル（OUTPUT_STYLESのキー）
+        title: 作品タイトル
+        author: 作者名
+
+    Returns:
+        プロンプト文字列
+    """
+    characters = settings.get('characters', [])
+    panels = settings.get('panels', [])
+    panel = panels[panel_index]
+    label = _panel_label(panel_index)
+
+    # キャラクターセクション（添付画像の番号は、実際に添付した画像の順に振る）
+    char_yaml = ""
+    for i, (char, number) in enumerate(zip(characters, number_character_references(characters))):
+        reference = f"添付画像{number}を参照してください" if number else "参照画像なし（説明に従ってください）"
+        char_yaml += f"""
+  - name: {_quote(char.get('name', f'キャラ{i+1}'))}
+    reference: "{reference}"
+    description: {_quote(char.get('description', ''))}"""
+
+    # 話の流れ（他のコマとの一貫性のため）
+    story_yaml = ""
+    for i, other in enumerate(panels):
+        marker = "  # ← このコマを生成" if i == panel_index else ""
+        story_yaml += f"""
+  - {_quote(f"{i+1}コマ目（{_panel_label(i)}）: {other.get('prompt', '')}")}{marker}"""
+
+    # セリフ
+    speeches_yaml = ""
+    for speech in panel.get('speeches', []):
+        speeches_yaml += f"""
+    - character: {_quote(speech.get('character', ''))}
+      content: {_quote(speech.get('content', ''))}
+      position: {_quote(speech.get('position', 'left'))}"""
+
+    narration = panel.get('narration', '')
+    narration_line = f'\n  narration: {_quote(narration)}' if narration else ""
+
+    return f"""【画像生成指示 / Image Generation Instructions】
+以下のYAML指示に従って、4コマ漫画の{panel_index+1}コマ目（{label}）だけを1枚の画像として生成してください。
+添付したキャラクター設定画を参考に、キャラクターの外見を一貫させてください。
+
+Generate ONLY panel {panel_index+1} of a 4-panel manga as a single image following the YAML instructions below.
+Use the attached character reference sheets to maintain consistent character appearances.
+
+---
+
+# 4コマ漫画 コマ別生成 (four_panel_manga.yaml準拠)
+title: {_quote(title)}
+author: {_quote(author)}
+color_mode: "{COLOR_MODES.get(color_mode, ('fullcolor', ''))[0]}"
+output_style: "{OUTPUT_STYLES.get(output_style, 'manga')}"
+
+# 登場人物
+characters:{char_yaml}
+
+# 4コマ全体の流れ（参考）
+story:{story_yaml}
+
+# このコマの内容
+panel:
+  panel_number: {panel_index+1}
+  role: "{label}"
+  prompt: {_quote(panel.get('prompt', ''))}
+  speeches:{speeches_yaml}{narration_line}
+
+# レイアウト指示
+layout_instruction: |
+  このコマ1つ分の場面だけを、横長（16:9）の画像全体に描いてください。
+  コマ枠・余白・他のコマ・タイトルは描かないでください（後でページに合成します）。
+  各キャラクターの外見は添付画像と説明を忠実に再現してください。
+  セリフは吹き出しで表示し、指定された位置に配置してください。
+  ナレーションがある場合は、画像の上部または下部にテキストボックスで表示してください。
+"""
+
+
+class FourPanelPipeline:
+    """
+    4コマをコマごとに並列生成するパイプライン
+
+    生成ジョブの投入は submit に任せる（使用量記録や経過時間表示は呼び出し側で行う）。
+    失敗したコマは max_retries 回まで自動で再投入し、それでも失敗したコマは
+    retry_failed() で個別に再生成できる。
+    """
+
+    def __init__(
+        self,
+        prompts: list,
+        base_request: dict,
+        submit: Callable,
+        max_retries: int = FOUR_PANEL_MAX_RETRIES,
+        on_update: Optional[Callable] = None,
+        on_finished: Optional[Callable] = None
+    ):
+        """
+        Args:
+            prompts: コマごとのプロンプト
+            base_request: 全コマ共通のgenerate_image_with_api引数（yaml_prompt以外）
+            submit: ジョブ投入関数 (request, on_success, on_error) -> bool
+            max_retries: コマごとの自動再試行回数
+            on_update: コマの状態が変わったときのコールバック (pipeline)
+            on_finished: すべてのコマが終わったときのコールバック (pipeline)
+        """
+        self.prompts = prompts
+        self.base_request = base_request
+        self.submit = submit
+        self.max_retries = max_retries
+        self.on_update = on_update
+        self.on_finished = on_finished
+
+        self.images = {}  # {panel_index: PIL.Image}
+        self.errors = {}  # {panel_index: str}
+        self.attempts = {i: 0 for i in range(len(prompts))}
+        self.cancelled = False
+        self._pending = set()
+        self._submitting = False
+
+    @property
+    def panel_count(self) -> int:
+        return len(self.prompts)
+
+    def start(self) -> bool:
+        """全コマの生成を投入"""
+        return self._submit_panels(range(self.panel_count))
+
+    def retry_failed(self) -> bool:
+        """失敗したコマだけを再生成"""
+        failed = sorted(self.errors.keys())
+        for index in failed:
+            self.attempts[index] = 0
+        return self._submit_panels(failed)
+
+    def cancel(self):
+        """以降の自動再試行を行わない（実行中のジョブのキャンセルは呼び出し側で行う）"""
+        self.cancelled = True
+
+    def is_running(self) -> bool:
+        """生成中のコマがあるかどうか"""
+        return bool(self._pending)
+
+    def get_failed_panels(self) -> list:
+        """失敗したコマ番号（0から）のリスト"""
+        return sorted(self.errors.keys())
+
+    def _submit_panels(self, indices) -> bool:
+        """指定したコマの生成を投入（投入し終わるまで完了通知は保留）"""
+        self._submitting = True
+        try:
+            ok = all([self._submit_panel(index) for index in indices])
+        finally:
+            self._submitting = False
+        self._notify()
+        return ok
+
+    def _submit_panel(self, index: int) -> bool:
+        """1コマ分の生成を投入"""
+        request = dict(self.base_request, yaml_prompt=self.prompts[index])
+        self.errors.pop(index, None)
+        self.attempts[index] += 1
+        self._pending.add(index)
+        submitted = self.submit(
+            request,
+            lambda image, i=index: self._on_panel_success(i, image),
+            lambda error_msg, i=index: self._on_panel_error(i, error_msg)
+        )
+        if not submitted:
+            self._pending.discard(index)
+            self.errors[index] = "生成キューが満杯のため投入できませんでした"
+        return submitted
+
+    def _on_panel_success(self, index: int, image):
+        """コマの生成成功"""
+        self._pending.discard(index)
+        self.images[index] = image
+        self._notify()
+
+    def _on_panel_error(self, index: int, error_msg: str):
+        """コマの生成失敗（再試行回数が残っていれば再投入）"""
+        self._pending.discard(index)
+        if self.attempts[index] <= self.max_retries and not self.cancelled:
+            print(f"Warning: Panel {index + 1} failed (attempt {self.attempts[index]}), retrying: {error_msg}")
+            self._submit_panel(index)
+        else:
+            self.errors[index] = error_msg
+        self._notify()
+
+    def _notify(self):
+        """状態変化を通知し、すべて終わっていれば完了を通知"""
+        if self.on_update:
+            self.on_update(self)
+        if not self._pending and not self._submitting and self.on_finished:
+            self.on_finished(self)
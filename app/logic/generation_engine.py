@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+画像生成エンジン
+生成ジョブをキューに積み、ワーカースレッドで並列実行する
+"""
+
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import GENERATION_ABORT_GRACE_SEC
+
+
+class GenerationJob:
+    """生成ジョブ1件分の情報"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+
+    def __init__(
+        self,
+        job_id: int,
+        func: Callable,
+        kwargs: dict,
+        label: str = "",
+        meta: Optional[dict] = None,
+        on_start: Optional[Callable] = None,
+        on_complete: Optional[Callable] = None,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+        on_late_result: Optional[Callable] = None
+    ):
+        """
+        Args:
+            job_id: ジョブID（エンジン内で一意）
+            func: 実行する関数（戻り値は結果辞書）
+            kwargs: funcに渡すキーワード引数
+            label: 表示用ラベル
+            meta: 呼び出し側が自由に使える付加情報（モード・解像度など）
+            on_start: 実行開始時のコールバック (job)
+            on_complete: 完了時のコールバック (job, result)
+            timeout: 実行開始からの制限時間（秒）。Noneは無制限
+            cancel_event: キャンセル時にセットするEvent（funcと共有すると途中で中断できる）
+            on_late_result: 中断後に打ち切ったfuncが後から戻ったときのコールバック (job, result)
+        """
+        self.job_id = job_id
+        self.func = func
+        self.kwargs = kwargs
+        self.label = label
+        self.meta = meta or {}
+        self.on_start = on_start
+        self.on_complete = on_complete
+        self.on_late_result = on_late_result
+        self.timeout = timeout
+        self.cancel_event = cancel_event or threading.Event()
+        self.status = self.QUEUED
+        self.result = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._wake = threading.Event()  # 完了またはキャンセルでセット
+
+    def cancel(self):
+        """
+        ジョブをキャンセル
+
+        待機中なら実行しない。実行中なら関数に中断を伝え（cancel_event）、
+        キャンセル扱いで完了する。
+        """
+        self.cancel_event.set()
+        self._wake.set()
+
+    def is_cancelled(self) -> bool:
+        """キャンセルされたかどうか"""
+        return self.cancel_event.is_set()
+
+
+class GenerationEngine:
+    """
+    有界キュー＋ワーカープールで生成ジョブを実行するエンジン
+
+    コールバックはすべてdispatch経由で呼び出すため、
+    Tkアプリでは dispatch=lambda fn: app.after(0, fn) を渡すと
+    UIスレッド上で結果を受け取れる。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_queue: int = 0,
+        dispatch: Optional[Callable] = None,
+        default_timeout: Optional[float] = None,
+        dispatch_check: Optional[Callable] = None,
+        abort_grace: float = GENERATION_ABORT_GRACE_SEC
+    ):
+        """
+        Args:
+            max_workers: 同時に実行するジョブ数の上限
+            max_queue: 待機キューの上限（0は無制限）
+            dispatch: コールバックを実行スレッドへ受け渡す関数（Noneは直接呼び出し）
+            default_timeout: ジョブの制限時間の既定値（秒）。Noneは無制限
+            dispatch_check: 実行直前の確認 (job, running_jobs) -> 実行しない理由 or None
+                            （予算ガードなど。理由を返したジョブは実行せずに失敗扱いにする）
+                            running_jobs には実行中のジョブに加え、中断後にまだ関数が戻って
+                            いないジョブ（送信済みのリクエスト）も含める
+            abort_grace: キャンセル・タイムアウト後に関数が戻るのを待つ秒数
+                         （過ぎたら関数を打ち切ってワーカーの枠を空ける）
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.default_timeout = default_timeout
+        self.dispatch_check = dispatch_check
+        self.abort_grace = abort_grace
+        self._admission_lock = threading.Lock()  # 確認から実行開始までを直列化
+        self._dispatch = dispatch or (lambda fn: fn())
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._workers = []
+        self._running = {}  # {job_id: GenerationJob}
+        self._queued = {}  # {job_id: GenerationJob}
+        self._abandoned = {}  # {job_id: GenerationJob} 打ち切ったが関数がまだ戻っていないジョブ
+        self._listeners = []
+        self._shutdown = False
+
+    # === ジョブ投入 ===
+
+    def submit(
+        self,
+        func: Callable,
+        kwargs: Optional[dict] = None,
+        label: str = "",
+        meta: Optional[dict] = None,
+        on_start: Optional[Callable] = None,
+        on_complete: Optional[Callable] = None,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+        on_late_result: Optional[Callable] = None
+    ) -> Optional[GenerationJob]:
+        """
+        ジョブをキューに追加
+
+        Args:
+            func: 実行する関数
+            kwargs: funcに渡すキーワード引数
+            label: 表示用ラベル
+            meta: 付加情報
+            on_start: 実行開始時のコールバック (job)
+            on_complete: 完了時のコールバック (job, result)
+            timeout: 制限時間（秒）。省略時はdefault_timeout
+            cancel_event: funcと共有するキャンセル用Event
+            on_late_result: 打ち切ったfuncが後から戻ったときのコールバック (job, result)
+                            （結果の'abandoned'がTrueだったジョブのみ。送信済みのリクエストの記録用）
+
+        Returns:
+            投入したジョブ。キューが満杯、または停止済みの場合はNone
+        """
+        if self._shutdown:
+            return None
+
+        job = GenerationJob(
+            next(self._ids), func, kwargs or {}, label, meta, on_start, on_complete,
+            timeout=timeout if timeout is not None else self.default_timeout,
+            cancel_event=cancel_event,
+            on_late_result=on_late_result
+        )
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            return None
+        with self._lock:
+            self._queued[job.job_id] = job
+
+        self._ensure_workers()
+        self._notify_listeners()
+        return job
+
+    # === 状態取得 ===
+
+    def get_queue_depth(self) -> int:
+        """待機中のジョブ数を取得（キャンセル済みは除く）"""
+        with self._lock:
+            return sum(1 for job in self._queued.values() if not job.is_cancelled())
+
+    def get_active_count(self) -> int:
+        """実行中のジョブ数を取得"""
+        with self._lock:
+            return len(self._running)
+
+    def get_running_jobs(self) -> list:
+        """実行中のジョブ一覧を取得"""
+        with self._lock:
+            return list(self._running.values())
+
+    def get_abandoned_jobs(self) -> list:
+        """キャンセル・タイムアウトで打ち切ったが、関数がまだ戻っていないジョブ一覧を取得"""
+        with self._lock:
+            return list(self._abandoned.values())
+
+    def is_idle(self) -> bool:
+        """待機中・実行中のジョブがないかどうか"""
+        return self.get_queue_depth() == 0 and self.get_active_count() == 0
+
+    def add_listener(self, listener: Callable):
+        """
+        キュー状態の変化を通知するリスナーを登録
+
+        Args:
+            listener: (queued: int, running: int) を受け取る関数
+        """
+        self._listeners.append(listener)
+
+    # === キャンセル ===
+
+    def cancel(self, job: GenerationJob):
+        """
+        ジョブをキャンセル
+
+        待機中のジョブは実行されずに完了扱いになる。実行中のジョブは関数に中断を伝え
+        （cancel_event）、すぐにキャンセル扱いで完了してワーカーの枠を空ける。
+        """
+        job.cancel()
+        self._notify_listeners()
+
+    def cancel_all(self) -> int:
+        """
+        待機中・実行中のすべてのジョブをキャンセル
+
+        Returns:
+            キャンセルしたジョブ数
+        """
+        with self._lock:
+            jobs = list(self._queued.values()) + list(self._running.values())
+        jobs = [job for job in jobs if not job.is_cancelled()]
+        for job in jobs:
+            job.cancel()
+        self._notify_listeners()
+        return len(jobs)
+
+    # === 設定 ===
+
+    def set_max_workers(self, max_workers: int):
+        """
+        同時実行数の上限を変更
+
+        増やした場合はすぐにワーカーを追加し、
+        減らした場合は実行中のジョブが終わった時点でワーカーが退出する。
+        """
+        with self._lock:
+            self.max_workers = max(1, int(max_workers))
+        self._ensure_workers()
+
+    def shutdown(self):
+        """新規ジョブの受付を停止し、待機中のジョブを破棄、実行中のジョブをキャンセル"""
+        self._shutdown = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._queued.clear()
+            running = list(self._running.values())
+        for job in running:
+            job.cancel()
+        for _ in self._workers:
+            # ワーカーを起こして終了させる
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    # === 内部処理 ===
+
+    def _ensure_workers(self):
+        """同時実行数の上限までワーカースレッドを起動"""
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker_loop, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _worker_loop(self):
+        """ワーカースレッド本体"""
+        while not self._shutdown:
+            with self._lock:
+                if len(self._workers) > self.max_workers:
+                    # 上限が下げられた場合は余剰ワーカーを退出させる
+                    self._workers.remove(threading.current_thread())
+                    return
+
+            job = self._queue.get()
+            if job is None:
+                return
+            self._run_job(job)
+
+    def _run_job(self, job: GenerationJob):
+        """ジョブを1件実行"""
+        with self._lock:
+            self._queued.pop(job.job_id, None)
+
+        if job.is_cancelled():
+            # 待機中にキャンセルされたジョブは実行しない
+            result = _cancelled_result()
+        else:
+            rejection = self._admit(job)
+            if rejection is not None:
+                # 実行前の確認（予算など）で止められたジョブ
+                result = {
+                    'success': False,
+                    'image': None,
+                    'error': rejection,
+                    'rejected': True
+                }
+            else:
+                if job.on_start:
+                    self._dispatch(lambda job=job: job.on_start(job))
+                self._notify_listeners()
+                result = self._call_with_timeout(job)
+
+        job.result = result
+        job.status = GenerationJob.DONE
+        job.finished_at = time.time()
+        with self._lock:
+            self._running.pop(job.job_id, None)
+        if job.on_complete:
+            self._dispatch(lambda job=job, result=result: job.on_complete(job, result))
+        self._notify_listeners()
+
+    def _admit(self, job: GenerationJob) -> Optional[str]:
+        """
+        dispatch_checkで確認し、問題なければ実行中に登録
+
+        同時に確認したジョブ同士がお互いを見落とさないよう、
+        確認と実行中への登録をまとめて直列化する。
+
+        Returns:
+            実行しない理由（実行中に登録した場合はNone）
+        """
+        with self._admission_lock:
+            if self.dispatch_check is not None:
+                try:
+                    in_flight = self.get_running_jobs() + self.get_abandoned_jobs()
+                    rejection = self.dispatch_check(job, in_flight)
+                except Exception as e:
+                    print(f"Warning: Dispatch check failed, running job anyway: {e}")
+                    rejection = None
+                if rejection is not None:
+                    return rejection
+            job.status = GenerationJob.RUNNING
+            job.started_at = time.time()
+            with self._lock:
+                self._running[job.job_id] = job
+        return None
+
+    def _call_with_timeout(self, job: GenerationJob) -> dict:
+        """
+        ジョブの関数を補助スレッドで実行し、完了・キャンセル・タイムアウトのいずれかまで待つ
+
+        キャンセル・タイムアウトでは関数に中断を伝え（cancel_event）、abort_grace秒だけ戻るのを待つ。
+        API呼び出しは送信中の通信も打ち切ってすぐに戻るため、通常はここで結果（計測値・課金の有無）
+        がそろう。戻らない関数は打ち切ってワーカーの枠を空け、結果に'abandoned'を付ける。
+        打ち切ったジョブは関数が戻るまでdispatch_check（予算の確認）に含め、戻ったら
+        on_late_resultに結果を渡す。
+        """
+        box = {}
+        finished = threading.Event()
+
+        def target():
+            try:
+                box['result'] = job.func(**job.kwargs)
+            except Exception as e:
+                box['result'] = {
+                    'success': False,
+                    'image': None,
+                    'error': str(e)
+                }
+            finally:
+                with self._lock:
+                    finished.set()
+                    abandoned = self._abandoned.pop(job.job_id, None) is not None
+                job._wake.set()
+                if abandoned:
+                    self._on_abandoned_return(job, _interrupted_result(box['interrupted'], box['result']))
+
+        threading.Thread(target=target, daemon=True).start()
+        job._wake.wait(job.timeout)
+        if finished.is_set():
+            return box['result']
+
+        if job.is_cancelled():
+            interrupted = _cancelled_result()
+        else:
+            # 制限時間切れ: 関数側にも中断を伝える
+            job.cancel_event.set()
+            interrupted = {
+                'success': False,
+                'image': None,
+                'error': f"タイムアウトしました（{job.timeout:g}秒）",
+                'timed_out': True
+            }
+
+        # 中断を伝えた関数が戻るのを少しだけ待つ（戻らなければ打ち切る）
+        finished.wait(self.abort_grace)
+        with self._lock:
+            if not finished.is_set():
+                box['interrupted'] = interrupted
+                self._abandoned[job.job_id] = job
+                return dict(interrupted, abandoned=True)
+        return _interrupted_result(interrupted, box['result'])
+
+    def _on_abandoned_return(self, job: GenerationJob, result: dict):
+        """打ち切ったジョブの関数が後から戻ったとき"""
+        if job.on_late_result:
+            self._dispatch(lambda job=job, result=result: job.on_late_result(job, result))
+
+    def _notify_listeners(self):
+        """リスナーへキュー状態を通知"""
+        if not self._listeners:
+            return
+        queued = self.get_queue_depth()
+        running = self.get_active_count()
+        for listener in self._listeners:
+            self._dispatch(
+                lambda listener=listener: listener(queued, running)
+            )
+
+
+def _cancelled_result() -> dict:
+    """キャンセルされたジョブの結果辞書"""
+    return {
+        'success': False,
+        'image': None,
+        'error': "キャンセルされました",
+        'cancelled': True
+    }
+
+
+def _interrupted_result(interrupted: dict, late: dict) -> dict:
+    """
+    キャンセル・タイムアウトしたジョブの結果に、中断後に戻った関数の結果を反映
+
+    中断を伝える前に送信済みだったリクエストが画像を返した場合は、
+    画像は使わないが生成（課金）されたものとして'billed'をTrueにする。
+
+    Args:
+        interrupted: キャンセル・タイムアウトの結果辞書
+        late: 中断後に関数が返した結果辞書
+
+    Returns:
+        キャンセル・タイムアウトの結果辞書（'billed'と、あれば計測値'metrics'を追加）
+    """
+    result = dict(interrupted)
+    result['billed'] = bool(late.get('success') and not late.get('cached'))
+    if 'metrics' in late:
+        result['metrics'] = late['metrics']
+    return result
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+参照画像の前処理モジュール
+API送信前に参照画像を縮小・再エンコードし、結果をメモリにキャッシュする
+"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import REFERENCE_MAX_EDGE, REFERENCE_JPEG_QUALITY, REFERENCE_CACHE_MAX_MB
+
+
+class PreparedImage:
+    """送信用にエンコード済みの参照画像"""
+
+    def __init__(self, data: bytes, mime_type: str, size: tuple, source_path: str):
+        """
+        Args:
+            data: エンコード済みの画像データ
+            mime_type: MIMEタイプ（"image/jpeg" または "image/png"）
+            size: 縮小後の (幅, 高さ)
+            source_path: 元画像のパス
+        """
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.source_path = source_path
+
+
+def encode_reference_image(image: Image.Image, max_edge: int = REFERENCE_MAX_EDGE,
+                           jpeg_quality: int = REFERENCE_JPEG_QUALITY) -> tuple:
+    """
+    画像を送信用に縮小・再エンコード
+
+    - EXIFの回転情報を反映してから長辺をmax_edge以下に縮小
+    - 透過のある画像はPNG、それ以外はJPEGでエンコード
+    - EXIF・ICCなどのメタデータは付けない
+
+    Args:
+        image: 元画像
+        max_edge: 長辺の最大ピクセル数
+        jpeg_quality: JPEGの品質
+
+    Returns:
+        (data: bytes, mime_type: str, size: tuple)
+    """
+    if max(image.size) > max_edge:
+        # draftが効く形式（JPEG）はデコード時点で縮小しておく（正方形の枠なので回転前でよい）
+        image.draft("RGB", (max_edge, max_edge))
+
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    )
+    if has_alpha:
+        image = image.convert("RGBA")
+        # 完全に不透明ならJPEGで十分
+        if image.getchannel("A").getextrema()[0] == 255:
+            has_alpha = False
+
+    buffer = io.BytesIO()
+    if has_alpha:
+        image.save(buffer, format="PNG")
+        mime_type = "image/png"
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        mime_type = "image/jpeg"
+
+    return buffer.getvalue(), mime_type, image.size
+
+
+class ReferenceImageCache:
+    """
+    エンコード済み参照画像のメモリキャッシュ
+
+    キーは (絶対パス, 更新時刻, ファイルサイズ, 最大辺)。
+    ファイルが書き換えられればキーが変わるため古い結果は使われない。
+    同じ画像を複数スレッドが同時に要求した場合、エンコードは1回だけ行い結果を共有する。
+    """
+
+    def __init__(self, max_bytes: int = REFERENCE_CACHE_MAX_MB * 1024 * 1024):
+        """
+        Args:
+            max_bytes: キャッシュ全体の上限サイズ（バイト）
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: PreparedImage}
+        self._inflight = {}  # {key: threading.Event} エンコード中のキー
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, path: str, max_edge: int = REFERENCE_MAX_EDGE) -> PreparedImage:
+        """
+        参照画像を送信用に準備（キャッシュがあれば再利用）
+
+        Args:
+            path: 画像ファイルのパス
+            max_edge: 長辺の最大ピクセル数
+
+        Returns:
+            PreparedImage
+
+        Raises:
+            OSError: 画像を読み込めない場合
+        """
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+        key = (abs_path, stat.st_mtime_ns, stat.st_size, max_edge)
+
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = threading.Event()
+                self.misses += 1
+
+        if pending is not None:
+            # 他のスレッドがエンコード中なら完了を待って結果を使う
+            pending.wait()
+            with self._lock:
+                prepared = self._entries.get(key)
+                if prepared is not None:
+                    self.hits += 1
+                    return prepared
+            # 先行スレッドが失敗した場合は自分で読み込む（例外はそのまま呼び出し元へ）
+            with Image.open(abs_path) as image:
+                data, mime_type, size = encode_reference_image(image, max_edge)
+            return PreparedImage(data, mime_type, size, abs_path)
+
+        try:
+            with Image.open(abs_path) as image:
+                data, mime_type, size = encode_reference_image(image, max_edge)
+            prepared = PreparedImage(data, mime_type, size, abs_path)
+
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = prepared
+                    self._total_bytes += len(data)
+                    while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._total_bytes -= len(evicted.data)
+            return prepared
+        finally:
+            with self._lock:
+                event = self._inflight.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def clear(self):
+        """キャッシュをすべて削除"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self) -> dict:
+        """キャッシュの統計情報を取得"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size_bytes': self._total_bytes
+            }
+
+
+# シングルトンインスタンス
+_reference_cache_instance = None
+_reference_cache_lock = threading.Lock()
+
+
+def get_reference_cache() -> ReferenceImageCache:
+    """参照画像キャッシュのシングルトンインスタンスを取得"""
+    global _reference_cache_instance
+    with _reference_cache_lock:
+        if _reference_cache_instance is None:
+            _reference_cache_instance = ReferenceImageCache()
+        return _reference_cache_instance
+
+
+def prepare_reference_image(path: str, max_edge: int = REFERENCE_MAX_EDGE) -> PreparedImage:
+    """参照画像を送信用に準備（共有キャッシュを使用）"""
+    return get_reference_cache().prepare(path, max_edge)
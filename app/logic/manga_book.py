@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+漫画ブック出力モジュール
+複数ページをワーカープロセス（またはスレッド）で並列に描画し、描き終わったページから順に
+PDFまたはCBZ（画像のZIP）に書き込む（全ページを同時にメモリに持たない）
+ページはワーカーでPNGにエンコードし、PDFにはPNGの圧縮データをそのまま（可逆圧縮のまま）格納する
+"""
+
+import functools
+import io
+import os
+import struct
+import sys
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import MANGA_BOOK_MAX_WORKERS, MANGA_BOOK_PDF_DPI, MANGA_BOOK_USE_PROCESSES
+
+
+# 出力形式
+BOOK_FORMAT_PDF = "pdf"
+BOOK_FORMAT_CBZ = "cbz"
+
+
+def get_book_format(output_path: str) -> Optional[str]:
+    """出力ファイルの拡張子から形式を判定（対応していなければNone）"""
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext == ".pdf":
+        return BOOK_FORMAT_PDF
+    if ext == ".cbz":
+        return BOOK_FORMAT_CBZ
+    return None
+
+
+def _render_png_page(render_page: Callable, page) -> bytes:
+    """1ページを描画してPNGにエンコード（エンコードもワーカーで行う）"""
+    image = render_page(page)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class _PdfBookWriter:
+    """
+    ページを1枚ずつ書き足していくPDFライター（既に書いたページは読み直さない）
+
+    画像はPNGの圧縮データ（IDAT）をFlateDecode + PNG予測子のストリームとしてそのまま格納するため、
+    再圧縮せず可逆のまま保存できる。ページツリー・相互参照表は最後に1回だけ書く。
+    """
+
+    def __init__(self, fp, dpi: float):
+        """
+        Args:
+            fp: 書き込み先（バイナリモードで開いたファイル）
+            dpi: 解像度（ページの物理サイズに使う）
+        """
+        self.fp = fp
+        self.dpi = dpi
+        self.offsets = {}  # {オブジェクト番号: ファイル内の位置}
+        self.page_ids = []
+        self.next_id = 3   # 1: カタログ, 2: ページツリー
+        fp.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id: int, body: bytes, stream: Optional[bytes] = None):
+        """間接オブジェクトを1つ書く"""
+        self.offsets[obj_id] = self.fp.tell()
+        self.fp.write(b"%d 0 obj\n" % obj_id)
+        self.fp.write(body)
+        if stream is not None:
+            self.fp.write(b"\nstream\n")
+            self.fp.write(stream)
+            self.fp.write(b"\nendstream")
+        self.fp.write(b"\nendobj\n")
+
+    def add_page(self, png_data: bytes):
+        """8bit RGBのPNG 1枚を1ページとして書く"""
+        width, height, idat = _read_png(png_data)
+        image_id, contents_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+
+        self._write_object(image_id, (
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+            b"/DecodeParms << /Predictor 15 /Colors 3 /BitsPerComponent 8 /Columns %d >> "
+            b"/Length %d >>"
+        ) % (width, height, width, len(idat)), idat)
+
+        page_w = width * 72.0 / self.dpi
+        page_h = height * 72.0 / self.dpi
+        contents = b"q %.4f 0 0 %.4f 0 0 cm /image Do Q" % (page_w, page_h)
+        self._write_object(contents_id, b"<< /Length %d >>" % len(contents), contents)
+
+        self._write_object(page_id, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] "
+            b"/Resources << /XObject << /image %d 0 R >> >> /Contents %d 0 R >>"
+        ) % (page_w, page_h, image_id, contents_id))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """ページツリー・カタログ・相互参照表を書いて完成させる"""
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        self._write_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)))
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self.fp.tell()
+        self.fp.write(b"xref\n0 %d\n" % self.next_id)
+        self.fp.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self.next_id):
+            self.fp.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self.fp.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_offset)
+        )
+
+
+def _read_png(data: bytes) -> tuple:
+    """
+    PNGの大きさと、IDATチャンクをつなげた圧縮データを取り出す
+
+    Returns:
+        (幅, 高さ, 圧縮データ)
+    """
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("PNGではありません")
+    position = 8
+    idat = []
+    width = height = None
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunk)
+            if bit_depth != 8 or color_type != 2 or interlace != 0:
+                raise ValueError("8bit RGB（インターレースなし）のPNGだけ格納できます")
+        elif chunk_type == b"IDAT":
+            idat.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+        position += 12 + length
+    if width is None or not idat:
+        raise ValueError("PNGの画像データがありません")
+    return width, height, b"".join(idat)
+
+
+def render_pages(
+    pages: list,
+    render_page: Callable,
+    max_workers: int = MANGA_BOOK_MAX_WORKERS,
+    use_processes: bool = MANGA_BOOK_USE_PROCESSES,
+    cancel_event: Optional[threading.Event] = None
+):
+    """
+    ページを並列に描画し、ページ順に結果を返すジェネレーター
+
+    描画中・受け取り待ちのページは最大でワーカー数の2倍に抑える。
+    ワーカーが1つなら呼び出し元のスレッドで順に描画する。
+
+    Args:
+        pages: ページのリスト（render_pageに渡す）
+        render_page: ページを描画する関数 (page) -> 結果
+                     （プロセスで描画する場合はモジュールの関数で、ページ・結果ともpickleできること）
+        max_workers: 並列に描画するページ数（0ならCPUコア数）
+        use_processes: ワーカープロセスで描画するか（Falseならワーカースレッド）
+        cancel_event: セットされたら残りのページを取り消して終了
+
+    Yields:
+        render_pageの結果（ページ順）
+    """
+    workers = max_workers if max_workers > 0 else (os.cpu_count() or 1)
+    workers = min(workers, len(pages))
+    if workers <= 1:
+        for page in pages:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            yield render_page(page)
+        return
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    executor = executor_class(max_workers=workers)
+    try:
+        pending = deque()  # 投入済みのページ（ページ順）
+        next_page = 0
+        while pending or next_page < len(pages):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+
+            # 先読みはワーカー数の2倍まで
+            while next_page < len(pages) and len(pending) < workers * 2:
+                pending.append(executor.submit(render_page, pages[next_page]))
+                next_page += 1
+
+            yield pending.popleft().result()
+    finally:
+        # 途中で終了した場合は未開始のページを取り消す
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def write_book(
+    pages: list,
+    output_path: str,
+    render_page: Callable,
+    max_workers: int = MANGA_BOOK_MAX_WORKERS,
+    use_processes: bool = MANGA_BOOK_USE_PROCESSES,
+    progress_callback: Optional[Callable] = None,
+    cancel_event: Optional[threading.Event] = None
+) -> dict:
+    """
+    ページを並列で描画し、ページ順にPDF/CBZへ書き込む
+
+    描画とPNGへのエンコードはrender_pagesで行い、描画中・書き込み待ちのページはワーカー数の2倍までに抑える。
+    PDFは1パスで書き（書いたページを読み直さない）、ページの画像は可逆圧縮で格納する。
+    一時ファイルに書き込んでから置き換えるため、失敗・中止しても既存のファイルは壊れない。
+
+    Args:
+        pages: ページのリスト（render_pageに渡す）
+        output_path: 出力先（拡張子 .pdf / .cbz で形式を決める）
+        render_page: ページを描画する関数 (page) -> PIL.Image（ワーカーから呼ばれる）
+        max_workers: 並列に描画するページ数（0ならCPUコア数）
+        use_processes: ワーカープロセスで描画するか（Falseならワーカースレッド）
+        progress_callback: 1ページ書き込むごとのコールバック (done, total)
+        cancel_event: セットされたら残りのページを取り消して終了
+
+    Returns:
+        {'success': bool, 'pages': 書き込んだページ数, 'error': str or None, 'cancelled': bool}
+    """
+    book_format = get_book_format(output_path)
+    if book_format is None:
+        return {'success': False, 'pages': 0, 'error': "対応していない形式です（.pdf / .cbz）", 'cancelled': False}
+    if not pages:
+        return {'success': False, 'pages': 0, 'error': "ページがありません", 'cancelled': False}
+
+    task = functools.partial(_render_png_page, render_page)
+    tmp_path = output_path + ".tmp"
+    archive = None
+    pdf_file = None
+    written = 0
+    rendered = render_pages(pages, task, max_workers, use_processes, cancel_event)
+    try:
+        if book_format == BOOK_FORMAT_CBZ:
+            # PNGは圧縮済みのため無圧縮で格納する
+            archive = zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED)
+        else:
+            pdf_file = open(tmp_path, "wb")
+            pdf_writer = _PdfBookWriter(pdf_file, MANGA_BOOK_PDF_DPI)
+        digits = max(3, len(str(len(pages))))
+
+        for png_data in rendered:
+            if archive is not None:
+                archive.writestr(f"page_{written + 1:0{digits}d}.png", png_data)
+            else:
+                pdf_writer.add_page(png_data)
+            del png_data
+            written += 1
+            if progress_callback:
+                progress_callback(written, len(pages))
+
+        if written < len(pages):
+            return {'success': False, 'pages': written, 'error': None, 'cancelled': True}
+
+        if archive is not None:
+            archive.close()
+            archive = None
+        else:
+            pdf_writer.close()
+            pdf_file.close()
+            pdf_file = None
+        os.replace(tmp_path, output_path)
+        return {'success': True, 'pages': written, 'error': None, 'cancelled': False}
+
+    except Exception as e:
+        return {'success': False, 'pages': written, 'error': str(e), 'cancelled': False}
+
+    finally:
+        rendered.close()
+        if archive is not None:
+            archive.close()
+        if pdf_file is not None:
+            pdf_file.close()
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError as e:
+                print(f"Warning: Could not remove {tmp_path}: {e}")
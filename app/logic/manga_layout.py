@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+漫画ページのレイアウトモジュール
+テンプレートに沿ってコマ画像・吹き出し・枠を描き、漫画ページを合成する（UIに依存しない）
+
+PageComposerはコマごとの描画をキャッシュし、変更のあったコマだけを描き直す（コンポーザーのプレビュー用）。
+compose_pageはキャッシュを使わずに1ページを描くため、ワーカースレッド・ワーカープロセスから呼べる。
+"""
+
+from typing import Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+# テンプレート定義
+TEMPLATES = {
+    "4コマ（16:9縦並び）": {
+        "cols": 1,
+        "rows": 4,
+        "panel_ratio": (16, 9),  # 各コマのアスペクト比
+        "description": "各コマ16:9を縦に4枚並べ"
+    },
+    "8コマ（4:3 2列）": {
+        "cols": 2,
+        "rows": 4,
+        "panel_ratio": (4, 3),  # 各コマのアスペクト比
+        "description": "4:3を縦4枚×2列"
+    }
+}
+
+# 出力サイズ（Web向け）
+OUTPUT_WIDTHS = {
+    "標準（720px）": 720,
+    "高解像度（1080px）": 1080,
+    "大（1440px）": 1440
+}
+
+# プレビューの幅（この幅で直接描画する）
+PREVIEW_WIDTH = 500
+
+
+def reduce_for_panel(img: Image.Image, panel_w: int, panel_h: int) -> Image.Image:
+    """
+    コマに中央クロップしてもコマサイズ以上が残る範囲で、画像を整数分の1に縮小
+
+    読み込み前のJPEGはデコード時に縮小し（draft）、残りはreduce（平均による縮小）で縮める。
+    最後のコマサイズへの縮小は合成時に行うため、画質はほとんど変わらない。
+
+    Args:
+        img: 元の画像（変更しない。未読み込みのJPEGはdraftの設定だけ変わる）
+        panel_w: コマの幅
+        panel_h: コマの高さ
+
+    Returns:
+        縮小したRGB画像
+    """
+    def shrink_factor(width, height):
+        # 中央クロップで残る範囲（fit_image_to_panelと同じ比率）
+        crop_w = min(width, height * panel_w / panel_h)
+        crop_h = min(height, width * panel_h / panel_w)
+        return min(crop_w / panel_w, crop_h / panel_h)
+
+    factor = shrink_factor(*img.size)
+    if factor >= 2 and getattr(img, "format", None) == "JPEG":
+        img.draft("RGB", (int(img.width / factor) + 1, int(img.height / factor) + 1))
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    factor = int(shrink_factor(*img.size))
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+def get_panel_size(template_name: str, output_width: int) -> tuple:
+    """テンプレートの出力幅に対する1コマの大きさ (幅, 高さ)"""
+    template = TEMPLATES[template_name]
+    panel_ratio = template["panel_ratio"]
+    panel_w = output_width // template["cols"]
+    panel_h = int(panel_w * panel_ratio[1] / panel_ratio[0])
+    return panel_w, panel_h
+
+
+def reduce_for_template(img: Image.Image, template_name: str,
+                        output_width: int = max(OUTPUT_WIDTHS.values())) -> Image.Image:
+    """テンプレートのコマに、出力幅（省略時は最大の出力幅）で必要な大きさまで縮小"""
+    return reduce_for_panel(img, *get_panel_size(template_name, output_width))
+
+
+def fit_image_to_panel(img: Image.Image, panel_w: int, panel_h: int,
+                       resample=Image.Resampling.LANCZOS, reducing_gap: Optional[float] = None) -> Image.Image:
+    """画像をコマサイズにフィット（アスペクト比維持、中央クロップ）"""
+    img_w, img_h = img.size
+    img_ratio = img_w / img_h
+    panel_ratio = panel_w / panel_h
+
+    if img_ratio > panel_ratio:
+        # 画像が横長 → 上下に合わせて左右をクロップ
+        new_h = img_h
+        new_w = int(img_h * panel_ratio)
+        left = (img_w - new_w) // 2
+        img = img.crop((left, 0, left + new_w, new_h))
+    else:
+        # 画像が縦長 → 左右に合わせて上下をクロップ
+        new_w = img_w
+        new_h = int(img_w / panel_ratio)
+        top = (img_h - new_h) // 2
+        img = img.crop((0, top, new_w, top + new_h))
+
+    # リサイズ
+    img = img.resize((panel_w, panel_h), resample, reducing_gap=reducing_gap)
+    return img
+
+
+def draw_bubble(canvas: Image.Image, panel_x: int, panel_y: int,
+                panel_w: int, panel_h: int, bubble: dict, scale: float = 1.0):
+    """吹き出しを描画（scaleはプレビュー時の縮尺。文字・余白・線を同じ比率で小さくする）"""
+    draw = ImageDraw.Draw(canvas)
+    text = bubble['text']
+    style = bubble['style']
+    pos = bubble['position']
+
+    def scaled(value):
+        return max(1, round(value * scale))
+
+    # フォント
+    try:
+        font = ImageFont.truetype("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", scaled(16))
+    except:
+        try:
+            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", scaled(16))
+        except:
+            font = ImageFont.load_default()
+
+    # テキストサイズを計算
+    bbox = draw.textbbox((0, 0), text, font=font)
+    text_w = bbox[2] - bbox[0]
+    text_h = bbox[3] - bbox[1]
+
+    # 吹き出しのサイズとパディング
+    padding = scaled(10)
+    bubble_w = text_w + padding * 2
+    bubble_h = text_h + padding * 2
+
+    # 位置を計算（コマ内の相対位置）
+    bubble_x = panel_x + int(pos[0] * panel_w) - bubble_w // 2
+    bubble_y = panel_y + int(pos[1] * panel_h) - bubble_h // 2
+
+    # コマ内に収まるように調整
+    inset = scaled(5)
+    bubble_x = max(panel_x + inset, min(bubble_x, panel_x + panel_w - bubble_w - inset))
+    bubble_y = max(panel_y + inset, min(bubble_y, panel_y + panel_h - bubble_h - inset))
+
+    # 吹き出し形状を描画
+    if style == "oval":
+        draw.ellipse(
+            [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
+            fill="white",
+            outline="black",
+            width=scaled(2)
+        )
+    elif style == "rounded_rect":
+        # 角丸四角形
+        draw.rounded_rectangle(
+            [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
+            radius=scaled(10),
+            fill="white",
+            outline="black",
+            width=scaled(2)
+        )
+    elif style == "burst":
+        # ギザギザ（簡易版）
+        draw.ellipse(
+            [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
+            fill="white",
+            outline="black",
+            width=scaled(3)
+        )
+    else:  # cloud
+        draw.ellipse(
+            [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
+            fill="white",
+            outline="black",
+            width=scaled(2)
+        )
+
+    # テキストを描画
+    draw.text(
+        (bubble_x + padding, bubble_y + padding),
+        text,
+        fill="black",
+        font=font
+    )
+
+
+def draw_panel(fitted: Optional[Image.Image], panel_index: int, panel_w: int, panel_h: int,
+               bubbles: list, scale: float = 1.0) -> Image.Image:
+    """
+    1コマ分（画像・吹き出し・枠）を描画
+
+    Args:
+        fitted: コマサイズに合わせた画像（Noneなら空のコマ）
+        panel_index: コマ番号（空のコマに表示する）
+        panel_w: コマの幅
+        panel_h: コマの高さ
+        bubbles: 吹き出しのリスト（空のコマでは描かない）
+        scale: 出力幅に対する縮尺（吹き出し・枠の大きさに使う）
+
+    Returns:
+        コマサイズのRGB画像
+    """
+    line_width = max(1, round(2 * scale))
+    panel = Image.new("RGB", (panel_w, panel_h), "white")
+    if fitted is not None:
+        panel.paste(fitted, (0, 0))
+
+        # 吹き出しを描画
+        for bubble in bubbles:
+            draw_bubble(panel, 0, 0, panel_w, panel_h, bubble, scale)
+    else:
+        # 空のコマ（グレー）
+        draw = ImageDraw.Draw(panel)
+        draw.rectangle(
+            [0, 0, panel_w - 1, panel_h - 1], fill="#EEEEEE", outline="#CCCCCC", width=line_width
+        )
+        # コマ番号を表示
+        try:
+            font = ImageFont.truetype("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", max(1, round(24 * scale)))
+        except:
+            font = ImageFont.load_default()
+        text = f"コマ{panel_index + 1}"
+        bbox = draw.textbbox((0, 0), text, font=font)
+        text_w = bbox[2] - bbox[0]
+        text_h = bbox[3] - bbox[1]
+        draw.text(
+            (panel_w // 2 - text_w // 2, panel_h // 2 - text_h // 2),
+            text,
+            fill="#999999",
+            font=font
+        )
+
+    # コマ枠を描画
+    ImageDraw.Draw(panel).rectangle([0, 0, panel_w - 1, panel_h - 1], outline="black", width=line_width)
+    return panel
+
+
+def compose_page(page: dict) -> Image.Image:
+    """
+    1ページを出力幅・LANCZOSで合成（キャッシュを使わないため、ワーカースレッド・プロセスから呼べる）
+
+    Args:
+        page: {'template': テンプレート名, 'output_width': 出力幅,
+               'images': {panel_index: PIL.Image またはファイルパス},
+               'bubbles': {panel_index: [吹き出し]}}
+
+    Returns:
+        ページのRGB画像
+    """
+    template = TEMPLATES[page['template']]
+    cols = template["cols"]
+    rows = template["rows"]
+    panel_w, panel_h = get_panel_size(page['template'], page['output_width'])
+    canvas = Image.new("RGB", (page['output_width'], panel_h * rows), "white")
+
+    for i in range(cols * rows):
+        fitted = None
+        source = page['images'].get(i)
+        if isinstance(source, str):
+            # コマコンポーザーで読み込んだ場合と同じ大きさまで縮小してから合わせる
+            with Image.open(source) as src:
+                source = reduce_for_template(src, page['template'])
+                source.load()
+        if source is not None:
+            fitted = fit_image_to_panel(source, panel_w, panel_h)
+        panel = draw_panel(fitted, i, panel_w, panel_h, page['bubbles'].get(i, []))
+        canvas.paste(panel, ((i % cols) * panel_w, (i // cols) * panel_h))
+    return canvas
+
+
+class PageComposer:
+    """
+    1ページ分のコマ画像・吹き出しを持ち、変更のあったコマだけ描き直して合成する
+
+    コマごとに「コマサイズに合わせた画像」と「吹き出し・枠を描いたコマ」をキャッシュし、
+    前回のキャンバスには描き直したコマだけを貼り付ける。
+    吹き出しと枠はコマの内側に収まるため、コマごとに別々に描いても結果は同じになる。
+    コマ画像は設定時に「最大の出力幅で必要な大きさ」と「プレビューで必要な大きさ」の
+    2段階に縮小して持ち、元の解像度の画像は保持しない。
+    """
+
+    def __init__(self, template_name: str):
+        """
+        Args:
+            template_name: テンプレート名（TEMPLATESのキー）
+        """
+        self.template_name = template_name
+        self.images = {}    # {panel_index: PIL.Image}（最大の出力幅に必要な大きさまで縮小済み）
+        self.previews = {}  # {panel_index: PIL.Image}（プレビューに必要な大きさまで縮小済み）
+        self.bubbles = {}   # {panel_index: [{'text': str, 'position': (x,y), 'style': str}]}
+
+        # 描画キャッシュ（コマ・画質（プレビュー/出力）ごとに最新の1件だけ持つ）
+        self._versions = {}       # {panel_index: 画像を差し替えた回数}
+        self._fitted_cache = {}   # {(panel_index, draft): (キー, コマサイズに合わせた画像)}
+        self._panel_cache = {}    # {(panel_index, draft): (キー, 吹き出し・枠まで描いたコマ)}
+        self._canvas_cache = {}   # {draft: (キャンバスのキー, キャンバス, {panel_index: 貼り付け済みのコマのキー})}
+
+    def set_template(self, template_name: str):
+        """テンプレートを変更（コマ画像・吹き出し・キャッシュはすべてクリア）"""
+        self.template_name = template_name
+        self.images = {}
+        self.previews = {}
+        self.bubbles = {}
+        self._fitted_cache = {}
+        self._panel_cache = {}
+        self._canvas_cache = {}
+
+    def set_image(self, panel_index: int, img: Optional[Image.Image]):
+        """
+        コマ画像を設定（Noneなら削除）し、そのコマの描画キャッシュを無効にする
+
+        Args:
+            panel_index: コマ番号（0始まり）
+            img: コマ画像（元の画像は変更しない）
+        """
+        if img is None:
+            self.images.pop(panel_index, None)
+            self.previews.pop(panel_index, None)
+        else:
+            source = reduce_for_template(img, self.template_name)
+            self.images[panel_index] = source
+            self.previews[panel_index] = reduce_for_template(source, self.template_name, PREVIEW_WIDTH)
+        self._versions[panel_index] = self._versions.get(panel_index, 0) + 1
+        for draft in (True, False):
+            self._fitted_cache.pop((panel_index, draft), None)
+            self._panel_cache.pop((panel_index, draft), None)
+
+    def to_page(self, output_width: int) -> dict:
+        """compose_pageに渡すページ（コマ画像は共有し、吹き出しはコピーする）"""
+        return {
+            'template': self.template_name,
+            'output_width': output_width,
+            'images': dict(self.images),
+            'bubbles': {i: [dict(b) for b in bubbles] for i, bubbles in self.bubbles.items()}
+        }
+
+    def compose(self, output_width: int, draft: bool = False) -> Image.Image:
+        """
+        ページを合成（変更のあったコマだけ描き直して前回のキャンバスに貼り付ける）
+
+        返すキャンバスは次の合成で書き換わるため、保持する場合はコピーする。
+
+        Args:
+            output_width: 出力幅
+            draft: プレビュー用にプレビュー幅で高速に描画するか（Falseなら出力幅・LANCZOS）
+        """
+        template = TEMPLATES[self.template_name]
+        cols = template["cols"]
+        rows = template["rows"]
+
+        # プレビューは出力幅に対する縮尺で、吹き出し・枠も同じ比率で小さく描く
+        scale = 1.0
+        if draft and output_width > PREVIEW_WIDTH:
+            scale = PREVIEW_WIDTH / output_width
+            output_width = PREVIEW_WIDTH
+
+        # 各コマのサイズを計算
+        panel_w, panel_h = get_panel_size(self.template_name, output_width)
+
+        # キャンバスサイズ
+        canvas_w = output_width
+        canvas_h = panel_h * rows
+
+        # テンプレート・出力幅が変わったら白背景のキャンバスから作り直す
+        canvas_key = (self.template_name, canvas_w, canvas_h, scale)
+        cached = self._canvas_cache.get(draft)
+        if cached is None or cached[0] != canvas_key:
+            cached = (canvas_key, Image.new("RGB", (canvas_w, canvas_h), "white"), {})
+            self._canvas_cache[draft] = cached
+        _, canvas, pasted = cached
+
+        # 各コマを配置
+        num_panels = cols * rows
+        for i in range(num_panels):
+            col = i % cols
+            row = i // cols
+            x = col * panel_w
+            y = row * panel_h
+
+            key, panel = self._render_panel(i, panel_w, panel_h, draft, scale)
+            if pasted.get(i) != key:
+                canvas.paste(panel, (x, y))
+                pasted[i] = key
+
+        return canvas
+
+    def _render_panel(self, panel_index: int, panel_w: int, panel_h: int,
+                      draft: bool = False, scale: float = 1.0) -> tuple:
+        """
+        1コマ分（画像・吹き出し・枠）を描画（キャッシュがあれば再利用）
+
+        Returns:
+            (キャッシュのキー, コマサイズのRGB画像)
+        """
+        bubbles = self.bubbles.get(panel_index, []) if panel_index in self.images else []
+        key = (
+            self._versions.get(panel_index, 0),
+            panel_index in self.images,
+            panel_w, panel_h, scale,
+            tuple((b['text'], b['style'], tuple(b['position'])) for b in bubbles)
+        )
+        cached = self._panel_cache.get((panel_index, draft))
+        if cached is not None and cached[0] == key:
+            return cached
+
+        fitted = None
+        if panel_index in self.images:
+            fitted = self._get_fitted_image(panel_index, panel_w, panel_h, draft)
+        panel = draw_panel(fitted, panel_index, panel_w, panel_h, bubbles, scale)
+
+        self._panel_cache[(panel_index, draft)] = (key, panel)
+        return key, panel
+
+    def _get_fitted_image(self, panel_index: int, panel_w: int, panel_h: int, draft: bool = False) -> Image.Image:
+        """コマサイズに合わせた画像（吹き出しの変更では作り直さない）"""
+        key = (self._versions.get(panel_index, 0), panel_w, panel_h)
+        cached = self._fitted_cache.get((panel_index, draft))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        # コマサイズにフィット（アスペクト比を維持してクロップ）
+        if draft:
+            img = fit_image_to_panel(
+                self.previews[panel_index], panel_w, panel_h,
+                Image.Resampling.BILINEAR, reducing_gap=2.0
+            )
+        else:
+            img = fit_image_to_panel(self.images[panel_index], panel_w, panel_h)
+        self._fitted_cache[(panel_index, draft)] = (key, img)
+        return img
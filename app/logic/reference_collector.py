@@ -7,6 +7,31 @@ API画像生成時に使用する参照画像のパスを収集
 import os
 
 
+def number_character_references(characters: list) -> list:
+    """
+    4コマの登場人物ごとに「添付画像N」の番号を決める
+
+    添付するのは画像が存在するキャラクターだけなので、番号も添付した画像の順に振る
+    （画像のないキャラクターを飛ばしても番号がずれない）。
+
+    Args:
+        characters: 登場人物の設定リスト（image_pathを含む）
+
+    Returns:
+        キャラクターごとの添付画像番号（1から）のリスト。画像がなければNone
+    """
+    numbers = []
+    attached = 0
+    for char in characters:
+        img_path = char.get('image_path', '')
+        if img_path and os.path.exists(img_path):
+            attached += 1
+            numbers.append(attached)
+        else:
+            numbers.append(None)
+    return numbers
+
+
 def collect_reference_image_paths(settings: dict) -> list:
     """
     設定データから参照画像のパスを収集
@@ -67,4 +92,11 @@ def collect_reference_image_paths(settings: dict) -> list:
         if bonus_path and os.path.exists(bonus_path):
             paths.append(bonus_path)
 
+    # 4コマ漫画 - 登場人物の画像を参照（YAMLの「添付画像N」と順番を合わせる）
+    elif 'characters' in settings and 'panels' in settings:
+        characters = settings.get('characters', [])
+        for char, number in zip(characters, number_character_references(characters)):
+            if number is not None:
+                paths.append(char['image_path'])
+
     return paths
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+生成結果キャッシュモジュール
+同じ条件（モード・プロンプト・参照画像・解像度・アスペクト比・モデル）の
+生成結果をディスクに保存し、API呼び出しを省略する
+"""
+
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import RESULT_CACHE_MAX_MB
+
+
+# デフォルトのキャッシュ上限（バイト）
+DEFAULT_MAX_BYTES = RESULT_CACHE_MAX_MB * 1024 * 1024
+
+# キャッシュファイルの拡張子
+CACHE_EXTENSION = ".img"
+
+
+class ResultCache:
+    """
+    内容アドレス方式の生成結果キャッシュ
+
+    キーは生成条件のSHA-256。エントリはファイルの更新時刻を
+    最終アクセス時刻として扱い、容量を超えたら古い順に削除する（LRU）。
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir: キャッシュの保存ディレクトリ
+            max_bytes: キャッシュ全体の上限サイズ（バイト）
+        """
+        if cache_dir is None:
+            # デフォルトはappディレクトリ内
+            app_dir = os.path.dirname(os.path.dirname(__file__))
+            cache_dir = os.path.join(app_dir, "result_cache")
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: size} 古い順
+        self._total_bytes = 0
+        self._scan()
+
+    # === キー生成 ===
+
+    @staticmethod
+    def make_key(
+        mode: str,
+        prompt: str,
+        image_paths: list,
+        resolution: str,
+        aspect_ratio: str,
+        model: str
+    ) -> str:
+        """
+        生成条件からキャッシュキーを作成
+
+        Args:
+            mode: 生成モード
+            prompt: プロンプト文字列
+            image_paths: 添付する画像のパス（順序も含めてキーになる）
+            resolution: 解像度
+            aspect_ratio: アスペクト比
+            model: モデル名
+
+        Returns:
+            16進数のSHA-256文字列
+        """
+        digest = hashlib.sha256()
+        for part in (mode, resolution, aspect_ratio, model, prompt):
+            data = (part or "").encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big'))
+            digest.update(data)
+
+        for path in image_paths:
+            # 画像はパスではなく中身でキーを作る（同じ画像を別名で保存しても一致する）
+            file_digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_digest.update(chunk)
+            digest.update(file_digest.digest())
+
+        return digest.hexdigest()
+
+    # === 読み書き ===
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        """
+        キャッシュから画像を取得
+
+        Args:
+            key: make_keyで作成したキー
+
+        Returns:
+            画像（見つからない場合はNone）
+        """
+        path = self._path_for(key)
+        with self._lock:
+            if key not in self._entries and not self._adopt_locked(key, path):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 最終アクセス時刻を更新
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read cache entry {key}: {e}")
+            self._discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def contains(self, key: str) -> bool:
+        """
+        キャッシュにエントリがあるか（ヒット・ミスの回数と最終アクセス時刻は変えない）
+
+        Args:
+            key: make_keyで作成したキー
+        """
+        with self._lock:
+            return key in self._entries or self._adopt_locked(key, self._path_for(key))
+
+    def put(self, key: str, data: bytes):
+        """
+        画像データをキャッシュに保存
+
+        APIから受信したバイト列をそのまま保存する（再エンコードしないため、JPEGの画質も変わらない）。
+
+        Args:
+            key: make_keyで作成したキー
+            data: 保存する画像データ（エンコード済みのバイト列）
+        """
+        path = self._path_for(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            old_size = self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data) - old_size
+            self._evict_locked()
+
+    def clear(self):
+        """キャッシュをすべて削除"""
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self._discard(key)
+
+    def get_stats(self) -> dict:
+        """キャッシュの統計情報を取得"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    # === 内部処理 ===
+
+    def _path_for(self, key: str) -> str:
+        """キーに対応するファイルパス"""
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_EXTENSION)
+
+    def _scan(self):
+        """既存のキャッシュファイルを読み込み、アクセス順に並べる"""
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(CACHE_EXTENSION):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-len(CACHE_EXTENSION)], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict_locked()
+
+    def _adopt_locked(self, key: str, path: str) -> bool:
+        """
+        索引にないが別のプロセスが書き込んだエントリを索引に加える（ロック取得済み）
+
+        Returns:
+            ファイルが見つかって索引に加えたかどうか
+        """
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return False
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict_locked()
+        return key in self._entries
+
+    def _evict_locked(self):
+        """上限を超えた分を古い順に削除（ロック取得済み）"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                pass
+
+    def _discard(self, key: str):
+        """エントリを1件削除"""
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+        try:
+            os.remove(self._path_for(key))
+        except OSError:
+            pass
+
+
+# シングルトンインスタンス
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """キャッシュのシングルトンインスタンスを取得"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResultCache()
+        return _cache_instance
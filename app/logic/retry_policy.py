@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+API呼び出しのリトライ・レート制限モジュール
+一時的なエラー（429/503など）を指数バックオフで再試行し、
+API Keyごとのトークンバケットで呼び出し頻度を抑える
+"""
+
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import (
+    API_RETRY_MAX_ATTEMPTS,
+    API_RETRY_BASE_DELAY,
+    API_RETRY_MAX_DELAY,
+    API_RATE_LIMIT_PER_MIN,
+    API_RATE_LIMIT_BURST
+)
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+except ImportError:
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+
+
+# 再試行の対象とするHTTPステータスコード
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class RequestCancelled(Exception):
+    """再試行やレート制限の待機中にキャンセルされた"""
+
+
+def get_status_code(exc: Exception) -> Optional[int]:
+    """例外からHTTPステータスコードを取得（取得できない場合はNone）"""
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def get_retry_after(exc: Exception) -> Optional[float]:
+    """
+    例外に含まれる再試行までの待ち時間ヒントを取得
+
+    HTTPのRetry-Afterヘッダー、またはエラー詳細のretryDelay（"30s"形式）を見る。
+
+    Returns:
+        待ち時間（秒）。ヒントがない場合はNone
+    """
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        try:
+            value = headers.get('retry-after')
+            if value is not None:
+                return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+    # google.genai.errors.APIError の details（レスポンスJSON）から探す
+    details = getattr(exc, 'details', None)
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(details or exc))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """
+    指数バックオフ＋ジッターによる再試行ポリシー
+
+    待ち時間は base_delay * 2^(試行回数-1) を上限 max_delay で抑え、
+    その範囲でランダムに選ぶ（フルジッター）。サーバーから待ち時間の
+    ヒントがあればそちらを優先する。
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = API_RETRY_MAX_ATTEMPTS,
+        base_delay: float = API_RETRY_BASE_DELAY,
+        max_delay: float = API_RETRY_MAX_DELAY,
+        sleep: Callable = time.sleep
+    ):
+        """
+        Args:
+            max_attempts: 最大試行回数（1なら再試行しない）
+            base_delay: 最初の再試行までの基準待ち時間（秒）
+            max_delay: 待ち時間の上限（秒）
+            sleep: 待機に使う関数（テスト用に差し替え可能）
+        """
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+
+    def is_retryable(self, exc: Exception) -> bool:
+        """再試行すべき一時的なエラーかどうか"""
+        if isinstance(exc, _TRANSPORT_ERRORS):
+            return True
+        return get_status_code(exc) in RETRYABLE_STATUS_CODES
+
+    def get_delay(self, attempt: int, exc: Optional[Exception] = None) -> float:
+        """
+        attempt回目の失敗後に待つ秒数
+
+        Args:
+            attempt: 失敗した試行の回数（1から）
+            exc: 発生した例外（待ち時間ヒントの取得用）
+        """
+        if exc is not None:
+            hint = get_retry_after(exc)
+            if hint is not None:
+                return min(hint, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def call(self, func: Callable, on_retry: Optional[Callable] = None,
+             cancel_event: Optional[threading.Event] = None):
+        """
+        funcを呼び出し、一時的なエラーなら再試行
+
+        Args:
+            func: 引数なしで呼び出す関数
+            on_retry: 再試行前のコールバック (attempt, delay, exc)
+            cancel_event: セットされたら以降の試行を行わない
+
+        Returns:
+            funcの戻り値
+
+        Raises:
+            RequestCancelled: キャンセルされた場合
+            最後の試行で発生した例外、または再試行対象外の例外
+        """
+        attempt = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            attempt += 1
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+                delay = self.get_delay(attempt, e)
+                if on_retry:
+                    on_retry(attempt, delay, e)
+                if cancel_event is not None:
+                    # キャンセルされたら待機を打ち切る
+                    if cancel_event.wait(delay):
+                        raise RequestCancelled()
+                else:
+                    self._sleep(delay)
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッター
+
+    rate_per_sec の速さでトークンが補充され、最大 capacity 個まで貯まる。
+    1回の呼び出しでトークンを1つ消費し、なければ補充されるまで待つ。
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: int,
+                 clock: Callable = time.monotonic, sleep: Callable = time.sleep):
+        """
+        Args:
+            rate_per_sec: 1秒あたりのトークン補充数
+            capacity: バケットの容量（連続で呼び出せる回数）
+            clock: 現在時刻（秒）を返す関数（テスト用に差し替え可能）
+            sleep: 待機に使う関数（テスト用に差し替え可能）
+        """
+        self.rate_per_sec = rate_per_sec
+        self.capacity = max(1, int(capacity))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None,
+                cancel_event: Optional[threading.Event] = None) -> bool:
+        """
+        トークンを1つ取得（なければ待つ）
+
+        Args:
+            timeout: 最大待ち時間（秒）。Noneは無制限
+            cancel_event: セットされたら待機を打ち切る
+
+        Returns:
+            取得できたかどうか（タイムアウト・キャンセル時はFalse）
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._refill_locked()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate_per_sec
+
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if cancel_event is not None:
+                if cancel_event.wait(wait):
+                    return False
+            else:
+                self._sleep(wait)
+
+    def _refill_locked(self):
+        """経過時間に応じてトークンを補充（ロック取得済み）"""
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+        self._updated = now
+
+
+# シングルトンインスタンス
+_retry_policy_instance = None
+_rate_limiters = {}  # {api_key: TokenBucket}
+_instance_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """再試行ポリシーのシングルトンインスタンスを取得"""
+    global _retry_policy_instance
+    with _instance_lock:
+        if _retry_policy_instance is None:
+            _retry_policy_instance = RetryPolicy()
+        return _retry_policy_instance
+
+
+def set_rate_limit(api_key: str, per_minute: float, burst: int) -> TokenBucket:
+    """
+    API Keyのレート制限を変更（ベンチマークや上限の異なるプラン用）
+
+    Returns:
+        新しく設定したレートリミッター
+    """
+    limiter = TokenBucket(per_minute / 60.0, burst)
+    with _instance_lock:
+        _rate_limiters[api_key] = limiter
+    return limiter
+
+
+def get_rate_limiter(api_key: str) -> TokenBucket:
+    """
+    API Keyごとのレートリミッターを取得
+
+    同じAPI Keyを使う生成（UI・バッチ・並列ジョブ）はすべて同じバケットを共有する。
+    """
+    with _instance_lock:
+        limiter = _rate_limiters.get(api_key)
+        if limiter is None:
+            limiter = TokenBucket(API_RATE_LIMIT_PER_MIN / 60.0, API_RATE_LIMIT_BURST)
+            _rate_limiters[api_key] = limiter
+        return limiter
@@ -1,32 +1,169 @@
 # -*- coding: utf-8 -*-
 """
 API使用量トラッキングモジュール
+
+使用記録の保存先は2種類から選べる:
+- JSON（デフォルト）: 追記専用のイベントログ（JSON Lines）に1行ずつ書き足し、
+  一定件数たまったら集計済みのスナップショット（api_usage.json）にまとめる
+- SQLite: 1件1行のイベントテーブル（api_usage.db）。日付・モードの索引で
+  月別・期間別の集計が履歴の量によらず速く、複数プロセスから同時に記録できる
 """
 
 import json
+import math
 import os
-from datetime import datetime, date
-from typing import Dict, Any, Optional
+import sqlite3
+import sys
+import threading
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, Optional, Tuple
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class UsageTracker:
-    """API使用量を記録・管理するクラス"""
+from constants import (
+    USAGE_LOG_COMPACT_EVENTS,
+    USAGE_STORE_BACKEND,
+    USAGE_METRICS_WINDOW_DAYS,
+    API_PRICE_TABLE,
+    API_DAILY_BUDGET,
+    API_MONTHLY_BUDGET
+)
+
+from .file_lock import FileLock, FileLockTimeout
+
+
+# 保存先の種類
+BACKEND_JSON = "json"
+BACKEND_SQLITE = "sqlite"
+
+# 集計に表示するモード・解像度
+MODE_KEYS = ("normal", "redraw", "simple", "refine")
+RESOLUTION_KEYS = ("1K", "2K", "4K")
+
+# 生成結果の種類
+OUTCOME_SUCCESS = "success"
+OUTCOME_FAILED = "failed"
+OUTCOME_CANCELLED = "cancelled"
+OUTCOME_TIMEOUT = "timeout"
+
+# イベントに任意で付く計測値
+EVENT_METRIC_KEYS = (
+    "latency", "ttfb", "decode_time", "prompt_chars", "request_bytes", "response_bytes"
+)
+
+# SQLiteの計測値の列の型（古いデータベースに列を追加するときに使う）
+METRIC_COLUMN_TYPES = {
+    "latency": "REAL",
+    "ttfb": "REAL",
+    "decode_time": "REAL",
+    "prompt_chars": "INTEGER",
+    "request_bytes": "INTEGER",
+    "response_bytes": "INTEGER"
+}
+
+# SQLiteのイベントテーブルの列（id以外）
+EVENT_COLUMNS = ("date", "time", "mode", "resolution", "success", "outcome") + EVENT_METRIC_KEYS
+
+
+def percentile(values: list, ratio: float) -> float:
+    """値リスト（ソート不要）のパーセンタイル（最近傍法: 順位 = ceil(ratio * 件数)）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(ratio * len(ordered)) - 1))
+    return ordered[index]
+
+
+def get_usage_outcome(result: dict) -> Optional[Tuple[bool, str]]:
+    """
+    生成結果がAPIを呼んだものなら、使用量に記録する内容を返す
 
-    def __init__(self, storage_path: str = None):
+    送信したリクエストにはgenerate_image_with_apiが計測値（'metrics'）を付けるため、
+    それを「APIを呼んだ」目印にする。キャッシュから返した結果・予算による中止・
+    送信前のキャンセル・読込エラーは記録しない。打ち切ったジョブ（'abandoned'）は
+    関数が後から返す結果で記録する。
+
+    Args:
+        result: 生成ジョブの結果辞書
+
+    Returns:
+        (料金に含めるか, 結果の種類) または記録しない場合はNone
+        キャンセル・タイムアウトでも、送信済みのリクエストが画像を返していれば料金に含める
+    """
+    if 'metrics' not in result or result.get('cached') or result.get('abandoned'):
+        return None
+    success = bool(result.get('success'))
+    if success:
+        outcome = OUTCOME_SUCCESS
+    elif result.get('cancelled'):
+        outcome = OUTCOME_CANCELLED
+    elif result.get('timed_out'):
+        outcome = OUTCOME_TIMEOUT
+    else:
+        outcome = OUTCOME_FAILED
+    return success or bool(result.get('billed')), outcome
+
+
+def _empty_outcome_counts() -> Dict[str, int]:
+    """結果別カウントの初期値"""
+    return {
+        OUTCOME_SUCCESS: 0,
+        OUTCOME_FAILED: 0,
+        OUTCOME_CANCELLED: 0,
+        OUTCOME_TIMEOUT: 0
+    }
+
+
+class JsonUsageStore:
+    """
+    JSONファイルに使用記録を保存するストア
+
+    - api_usage.json: 集計済みのスナップショット（last_seqまでのイベントを反映済み）
+    - api_usage.log.jsonl: スナップショット以降のイベント（1行1件、追記のみ）
+
+    起動時はスナップショットを読み、last_seqより新しいイベントだけを再適用する。
+    スナップショットは一時ファイルに書いてから置き換えるため、途中で落ちても
+    古いスナップショットとログから同じ状態を復元できる。
+
+    書き込みはロック用ファイル（api_usage.json.lock）で他のプロセスと直列化し、
+    書き込む前に他のプロセスが追記したイベントを取り込む（seqの重複や記録の消失を防ぐ）。
+    他のプロセスがスナップショットにまとめた場合は、スナップショットから読み直す。
+    ロックを取れなかったイベントはメモリに保留し、次にロックを取れたときに書き込む。
+    """
+
+    def __init__(self, storage_path: str,
+                 compact_threshold: int = USAGE_LOG_COMPACT_EVENTS):
         """
         Args:
-            storage_path: 使用量データの保存パス
+            storage_path: 使用量データ（スナップショット）の保存パス
+            compact_threshold: ログがこの件数に達したらスナップショットにまとめる
         """
-        if storage_path is None:
-            # デフォルトはappディレクトリ内
-            app_dir = os.path.dirname(os.path.dirname(__file__))
-            storage_path = os.path.join(app_dir, "api_usage.json")
-
         self.storage_path = storage_path
-        self.data = self._load_data()
+        self.log_path = os.path.splitext(storage_path)[0] + ".log.jsonl"
+        self.compact_threshold = compact_threshold
+        # ファイルの読み書きは_io_lock→ファイルロック→_lockの順に取る
+        # （ロック待ちの間も_lockは空いているため、集計の読み出しは待たされない）
+        self._io_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(storage_path + ".lock")
+        self._log_events = 0  # ログに残っているイベント数
+        self._log_offset = 0  # ログを読み込み済みのバイト位置
+        self._snapshot_stamp = None  # 読み込んだスナップショットの (更新時刻, サイズ)
+        self._pending = []  # ロックを取れずに書き込みを保留したイベント
+        try:
+            with self._io_lock, self._file_lock, self._lock:
+                self._reload_locked()
+                # 前回の終了時にまとめきれなかったログは起動時にまとめる
+                self._compact_locked()
+        except FileLockTimeout as e:
+            # 読むだけならロックなしでよい（スナップショットは置き換え、ログは追記のみ）
+            # まとめるのは次にロックを取れたときに行う
+            print(f"Warning: {e}, loading usage data without compacting")
+            with self._lock:
+                self._reload_locked()
 
     def _load_data(self) -> Dict[str, Any]:
-        """保存されたデータを読み込む"""
+        """保存されたスナップショットを読み込む"""
         if os.path.exists(self.storage_path):
             try:
                 with open(self.storage_path, 'r', encoding='utf-8') as f:
@@ -36,60 +173,147 @@ class UsageTracker:
 
         # 初期データ構造
         return {
+            "last_seq": 0,
             "total_count": 0,
             "daily_records": {},
-            "mode_counts": {
-                "normal": 0,
-                "redraw": 0,
-                "simple": 0,
-                "refine": 0
-            },
-            "resolution_counts": {
-                "1K": 0,
-                "2K": 0,
-                "4K": 0
-            }
+            "mode_counts": {key: 0 for key in MODE_KEYS},
+            "resolution_counts": {key: 0 for key in RESOLUTION_KEYS},
+            "outcome_counts": _empty_outcome_counts()
         }
 
     def _save_data(self):
-        """データを保存"""
+        """スナップショットを保存（一時ファイルに書いてから置き換える）"""
+        temp_path = self.storage_path + ".tmp"
         try:
-            with open(self.storage_path, 'w', encoding='utf-8') as f:
+            with open(temp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.storage_path)
         except IOError as e:
             print(f"Error saving usage data: {e}")
+            return False
+        return True
+
+    def _stat_snapshot(self) -> Optional[tuple]:
+        """スナップショットの (更新時刻, サイズ)。ファイルがなければNone"""
+        try:
+            stat = os.stat(self.storage_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload_locked(self):
+        """スナップショットとログをすべて読み直す（ロック取得済み）"""
+        self._snapshot_stamp = self._stat_snapshot()
+        self.data = self._load_data()
+        self._log_events = 0
+        self._log_offset = 0
+        self._read_log_locked()
 
-    def record_usage(self, mode: str, resolution: str, success: bool):
+    def _read_log_locked(self):
+        """前回読んだ位置以降のログを読み、新しいイベントを反映（ロック取得済み）"""
+        if not os.path.exists(self.log_path):
+            return
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._log_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 書き込み途中で落ちた最後の行は読み飛ばす
+                        break
+                    self._log_offset += len(line)
+                    try:
+                        event = json.loads(line.decode('utf-8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        continue
+                    self._log_events += 1
+                    if event.get("seq", 0) > self.data.get("last_seq", 0):
+                        self._apply_event(event)
+        except IOError as e:
+            print(f"Warning: Could not read usage log: {e}")
+
+    def _sync_locked(self) -> bool:
         """
-        API使用を記録
+        他のプロセスの書き込みを取り込む（ロック取得済み）
 
-        Args:
-            mode: 生成モード ("normal", "redraw", "simple", "refine")
-            resolution: 解像度 ("1K", "2K", "4K")
-            success: 成功したかどうか
+        Returns:
+            記録が変わったかどうか
         """
-        today = date.today().isoformat()
-        now = datetime.now().strftime("%H:%M:%S")
+        before = (self.data.get("last_seq", 0), self.data["total_count"])
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except OSError:
+            log_size = 0
+        if self._stat_snapshot() != self._snapshot_stamp or log_size < self._log_offset:
+            # 他のプロセスがスナップショットにまとめた
+            self._reload_locked()
+        elif log_size > self._log_offset:
+            self._read_log_locked()
+        return (self.data.get("last_seq", 0), self.data["total_count"]) != before
+
+    def refresh(self) -> bool:
+        """
+        他のプロセス（別ウィンドウ・バッチ生成）が記録した使用量を取り込む
+
+        Returns:
+            記録が変わったかどうか
+        """
+        try:
+            with self._io_lock, self._file_lock, self._lock:
+                changed = self._sync_locked()
+                return self._flush_pending_locked() or changed
+        except FileLockTimeout as e:
+            print(f"Warning: {e}, usage data not refreshed")
+            return False
+
+    def _append_event(self, event: Dict[str, Any]):
+        """イベントをログに1行追記（ロック取得済み）"""
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8')
+        try:
+            with open(self.log_path, 'ab') as f:
+                if f.tell() > self._log_offset:
+                    # 途中で切れた行の後ろに続けて書かないよう改行を入れる
+                    line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                self._log_offset = f.tell()
+            self._log_events += 1
+        except IOError as e:
+            print(f"Error saving usage data: {e}")
+
+    def _apply_event(self, event: Dict[str, Any]):
+        """イベント1件を集計データに反映"""
+        day = event["date"]
+        mode = event["mode"]
+        resolution = event["resolution"]
+        success = event["success"]
+        outcome = event.get("outcome") or (OUTCOME_SUCCESS if success else OUTCOME_FAILED)
 
         # 日別レコードの初期化
-        if today not in self.data["daily_records"]:
-            self.data["daily_records"][today] = {
+        if day not in self.data["daily_records"]:
+            self.data["daily_records"][day] = {
                 "count": 0,
                 "success_count": 0,
                 "details": []
             }
 
-        # 記録を追加
+        # 記録を追加（計測値は記録されている場合のみ保存）
         record = {
-            "time": now,
+            "time": event["time"],
             "mode": mode,
             "resolution": resolution,
-            "success": success
+            "success": success,
+            "outcome": outcome
         }
-        self.data["daily_records"][today]["details"].append(record)
-        self.data["daily_records"][today]["count"] += 1
+        for key in EVENT_METRIC_KEYS:
+            if event.get(key) is not None:
+                record[key] = event[key]
+        self.data["daily_records"][day]["details"].append(record)
+        self.data["daily_records"][day]["count"] += 1
         if success:
-            self.data["daily_records"][today]["success_count"] += 1
+            self.data["daily_records"][day]["success_count"] += 1
 
         # 累計カウント
         self.data["total_count"] += 1
@@ -102,44 +326,550 @@ class UsageTracker:
         if resolution in self.data["resolution_counts"]:
             self.data["resolution_counts"][resolution] += 1
 
-        # 保存
-        self._save_data()
+        # 結果別カウント（古いデータには項目がないので補う）
+        outcome_counts = self.data.setdefault("outcome_counts", _empty_outcome_counts())
+        outcome_counts[outcome] = outcome_counts.get(outcome, 0) + 1
+
+        self.data["last_seq"] = max(self.data.get("last_seq", 0), event.get("seq", 0))
+
+    def append(self, event: Dict[str, Any]):
+        """
+        イベントを1件記録
+
+        ロックを取れなかった場合は保留し、次のappend・refresh・compactでまとめて書き込む
+        （保留中のイベントは集計にまだ含まれない）。
+        """
+        with self._lock:
+            self._pending.append(dict(event))
+        try:
+            with self._io_lock, self._file_lock, self._lock:
+                # 他のプロセスの記録を取り込んでから番号を振る
+                self._sync_locked()
+                self._flush_pending_locked()
+        except FileLockTimeout as e:
+            print(f"Warning: {e}, usage event deferred ({len(self._pending)} pending)")
+
+    def _flush_pending_locked(self) -> bool:
+        """
+        保留中のイベントに番号を振ってログに書き、集計に反映（ロック取得済み・同期済み）
+
+        Returns:
+            書き込んだイベントがあったかどうか
+        """
+        if not self._pending:
+            return False
+        pending, self._pending = self._pending, []
+        for event in pending:
+            event = dict(event, seq=self.data.get("last_seq", 0) + 1)
+            self._append_event(event)
+            self._apply_event(event)
+
+        # ログが一定件数を超えたらスナップショットにまとめる
+        if self._log_events >= self.compact_threshold:
+            self._compact_locked()
+        return True
+
+    def compact(self):
+        """ログのイベントをスナップショットにまとめ、ログを空にする（保留中のイベントも書き込む）"""
+        try:
+            with self._io_lock, self._file_lock, self._lock:
+                self._sync_locked()
+                self._flush_pending_locked()
+                self._compact_locked()
+        except FileLockTimeout as e:
+            print(f"Warning: {e}, usage log not compacted")
+
+    def _compact_locked(self):
+        """compactの本体（ロック取得済み）"""
+        if self._log_events == 0:
+            return
+        # スナップショットの置き換えが完了してからログを消す
+        # （間で落ちてもlast_seqで二重計上を防ぐ）
+        if not self._save_data():
+            return
+        self._snapshot_stamp = self._stat_snapshot()
+        try:
+            os.remove(self.log_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not truncate usage log: {e}")
+            return
+        self._log_events = 0
+        self._log_offset = 0
+
+    def close(self):
+        """終了時の後処理（保留中のイベントを書き込み、ログをまとめる）"""
+        self.compact()
+        if self._pending:
+            print(f"Warning: {len(self._pending)} usage events could not be saved (usage data is locked)")
+
+    def count(self, start: str = None, end: str = None, mode: str = None,
+              success: bool = None) -> int:
+        """
+        期間内の使用回数を取得
+
+        Args:
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            end: 終了日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            mode: 指定した場合はこのモードのみ
+            success: 指定した場合は成否が一致するもののみ
+        """
+        with self._lock:
+            total = 0
+            for day, record in self.data["daily_records"].items():
+                if (start and day < start) or (end and day > end):
+                    continue
+                if mode is None and success is None:
+                    total += record["count"]
+                elif mode is None:
+                    total += record["success_count"] if success else record["count"] - record["success_count"]
+                else:
+                    total += sum(
+                        1 for detail in record["details"]
+                        if detail["mode"] == mode and (success is None or detail["success"] == success)
+                    )
+            return total
+
+    def total_count(self) -> int:
+        """累計使用回数"""
+        return self.data["total_count"]
+
+    def group_counts(self, field: str) -> Dict[str, int]:
+        """
+        項目別の累計回数
+
+        Args:
+            field: "mode" / "resolution" / "outcome"
+        """
+        with self._lock:
+            return dict(self.data.get(f"{field}_counts", {}))
+
+    def recent(self, limit: int) -> list:
+        """新しい順に最大limit件の記録（dateを含む）"""
+        with self._lock:
+            records = []
+            for day in sorted(self.data["daily_records"], reverse=True):
+                for detail in reversed(self.data["daily_records"][day]["details"]):
+                    records.append(dict(detail, date=day))
+                    if len(records) >= limit:
+                        return records
+            return records
+
+    def success_counts(self, start: str = None, end: str = None) -> Dict[tuple, int]:
+        """
+        期間内に成功した生成のモード・解像度別の回数
+
+        Returns:
+            {(mode, resolution): 回数}
+        """
+        with self._lock:
+            counts = {}
+            for day, record in self.data["daily_records"].items():
+                if (start and day < start) or (end and day > end) or record["success_count"] == 0:
+                    continue
+                for detail in record["details"]:
+                    if detail["success"]:
+                        key = (detail["mode"], detail["resolution"])
+                        counts[key] = counts.get(key, 0) + 1
+            return counts
+
+    def metric_values(self, metric: str, start: str = None) -> list:
+        """
+        成功した記録の計測値を取得
+
+        Args:
+            metric: 計測値の名前（EVENT_METRIC_KEYSのいずれか）
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+
+        Returns:
+            [(mode, resolution, 値)]（計測値のない記録は除く）
+        """
+        with self._lock:
+            values = []
+            for day, record in self.data["daily_records"].items():
+                if start and day < start:
+                    continue
+                for detail in record["details"]:
+                    value = detail.get(metric)
+                    if detail["success"] and value is not None:
+                        values.append((detail["mode"], detail["resolution"], value))
+            return values
+
+    def iter_events(self):
+        """すべての記録を古い順に返す（他のストアへの移行用）"""
+        with self._lock:
+            events = []
+            for day in sorted(self.data["daily_records"]):
+                for detail in self.data["daily_records"][day]["details"]:
+                    events.append(dict(detail, date=day))
+        return events
+
+
+class SqliteUsageStore:
+    """
+    SQLiteに使用記録を保存するストア
+
+    1回の生成を1行として保存し、日付とモードの索引で集計する。
+    WALモードで開くため、UIとバッチ生成など複数プロセスから同時に記録できる。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            latency REAL,
+            ttfb REAL,
+            decode_time REAL,
+            prompt_chars INTEGER,
+            request_bytes INTEGER,
+            response_bytes INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_usage_date ON usage_events (date);
+        CREATE INDEX IF NOT EXISTS idx_usage_mode_date ON usage_events (mode, date);
+    """
+
+    def __init__(self, db_path: str, import_from: Optional[JsonUsageStore] = None):
+        """
+        Args:
+            db_path: データベースファイルのパス
+            import_from: データベースを新規作成したときに取り込むJSONストア
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(db_path)
+        # 他プロセスが書き込み中の場合は最大10秒待つ
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._add_missing_columns()
+        if is_new and import_from is not None:
+            self._import_events(import_from.iter_events())
+
+    def _add_missing_columns(self):
+        """以前のバージョンで作成したテーブルに、後から増えた計測値の列を追加"""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(usage_events)")}
+        with self._conn:
+            for column, column_type in METRIC_COLUMN_TYPES.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE usage_events ADD COLUMN {column} {column_type}")
+
+    def _import_events(self, events: list):
+        """既存の記録を取り込む（JSONからの移行）"""
+        with self._lock, self._conn:
+            self._conn.executemany(self._insert_sql(), [self._row(event) for event in events])
+        if events:
+            print(f"Imported {len(events)} usage records into {os.path.basename(self.db_path)}")
+
+    @staticmethod
+    def _insert_sql() -> str:
+        columns = ", ".join(EVENT_COLUMNS)
+        placeholders = ", ".join("?" for _ in EVENT_COLUMNS)
+        return f"INSERT INTO usage_events ({columns}) VALUES ({placeholders})"
+
+    @staticmethod
+    def _row(event: Dict[str, Any]) -> tuple:
+        """イベントをテーブルの行に変換"""
+        success = bool(event["success"])
+        event = dict(
+            event,
+            success=int(success),
+            outcome=event.get("outcome") or (OUTCOME_SUCCESS if success else OUTCOME_FAILED)
+        )
+        return tuple(event.get(column) for column in EVENT_COLUMNS)
+
+    def append(self, event: Dict[str, Any]):
+        """イベントを1件記録"""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(self._insert_sql(), self._row(event))
+        except sqlite3.Error as e:
+            print(f"Error saving usage data: {e}")
+
+    def refresh(self) -> bool:
+        """他のプロセスの記録を取り込む（集計は毎回データベースを参照するため常にTrue）"""
+        return True
+
+    def compact(self):
+        """WALの内容をデータベース本体に書き戻す"""
+        try:
+            with self._lock:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"Warning: Could not checkpoint usage database: {e}")
+
+    def close(self):
+        """接続を閉じる"""
+        self.compact()
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def count(self, start: str = None, end: str = None, mode: str = None,
+              success: bool = None) -> int:
+        """
+        期間内の使用回数を取得
+
+        Args:
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            end: 終了日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            mode: 指定した場合はこのモードのみ
+            success: 指定した場合は成否が一致するもののみ
+        """
+        conditions = []
+        params = []
+        if mode is not None:
+            conditions.append("mode = ?")
+            params.append(mode)
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(end)
+        if success is not None:
+            conditions.append("success = ?")
+            params.append(int(success))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._query(f"SELECT COUNT(*) FROM usage_events{where}", tuple(params))[0][0]
+
+    def total_count(self) -> int:
+        """累計使用回数"""
+        return self.count()
+
+    def group_counts(self, field: str) -> Dict[str, int]:
+        """
+        項目別の累計回数
+
+        Args:
+            field: "mode" / "resolution" / "outcome"
+        """
+        if field not in ("mode", "resolution", "outcome"):
+            raise ValueError(f"Unknown field: {field}")
+        rows = self._query(f"SELECT {field}, COUNT(*) FROM usage_events GROUP BY {field}")
+        return dict(rows)
+
+    def success_counts(self, start: str = None, end: str = None) -> Dict[tuple, int]:
+        """
+        期間内に成功した生成のモード・解像度別の回数
+
+        Returns:
+            {(mode, resolution): 回数}
+        """
+        sql = "SELECT mode, resolution, COUNT(*) FROM usage_events WHERE success = 1"
+        params = []
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(end)
+        rows = self._query(sql + " GROUP BY mode, resolution", tuple(params))
+        return {(mode, resolution): count for mode, resolution, count in rows}
+
+    def metric_values(self, metric: str, start: str = None) -> list:
+        """
+        成功した記録の計測値を取得
+
+        Args:
+            metric: 計測値の名前（EVENT_METRIC_KEYSのいずれか）
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+
+        Returns:
+            [(mode, resolution, 値)]（計測値のない記録は除く）
+        """
+        if metric not in EVENT_METRIC_KEYS:
+            raise ValueError(f"Unknown metric: {metric}")
+        sql = (
+            f"SELECT mode, resolution, {metric} FROM usage_events"
+            f" WHERE success = 1 AND {metric} IS NOT NULL"
+        )
+        if start is not None:
+            return self._query(sql + " AND date >= ?", (start,))
+        return self._query(sql)
+
+    def recent(self, limit: int) -> list:
+        """新しい順に最大limit件の記録（dateを含む）"""
+        rows = self._query(
+            f"SELECT {', '.join(EVENT_COLUMNS)} FROM usage_events ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+        records = []
+        for row in rows:
+            record = {
+                key: value for key, value in zip(EVENT_COLUMNS, row)
+                if value is not None or key not in EVENT_METRIC_KEYS
+            }
+            record["success"] = bool(record["success"])
+            records.append(record)
+        return records
+
+
+class UsageTracker:
+    """
+    API使用量を記録・管理するクラス
+
+    記録と集計は保存先のストア（JsonUsageStore / SqliteUsageStore）に任せ、
+    画面表示用の集計（本日・今月・モード別など）と、料金表による概算料金・
+    予算の確認をまとめて提供する。
+    """
+
+    def __init__(self, storage_path: str = None, backend: str = USAGE_STORE_BACKEND,
+                 compact_threshold: int = USAGE_LOG_COMPACT_EVENTS,
+                 price_table: Optional[dict] = None,
+                 daily_budget: float = API_DAILY_BUDGET,
+                 monthly_budget: float = API_MONTHLY_BUDGET):
+        """
+        Args:
+            storage_path: 使用量データ（JSONスナップショット）の保存パス
+                          SQLiteの場合は同じ場所の拡張子 .db のファイルを使う
+            backend: 保存先の種類 ("json" / "sqlite")
+            compact_threshold: JSONのログがこの件数に達したらスナップショットにまとめる
+            price_table: 料金表 {mode: {resolution: 1回あたりの料金}}（省略時はAPI_PRICE_TABLE）
+            daily_budget: 1日の予算（0は無制限）
+            monthly_budget: 1か月の予算（0は無制限）
+        """
+        if storage_path is None:
+            # デフォルトはappディレクトリ内
+            app_dir = os.path.dirname(os.path.dirname(__file__))
+            storage_path = os.path.join(app_dir, "api_usage.json")
+
+        self.storage_path = storage_path
+        self.backend = backend
+        self.price_table = price_table if price_table is not None else API_PRICE_TABLE
+        self.daily_budget = daily_budget
+        self.monthly_budget = monthly_budget
+        self.store = self._open_store(backend, compact_threshold)
+
+    def _open_store(self, backend: str, compact_threshold: int):
+        """保存先のストアを開く（SQLiteが使えない場合はJSONに戻す）"""
+        if backend == BACKEND_SQLITE:
+            db_path = os.path.splitext(self.storage_path)[0] + ".db"
+            import_from = None
+            if not os.path.exists(db_path) and os.path.exists(self.storage_path):
+                # 初回はこれまでのJSONの記録を取り込む
+                import_from = JsonUsageStore(self.storage_path, compact_threshold)
+            try:
+                return SqliteUsageStore(db_path, import_from=import_from)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open usage database, falling back to JSON: {e}")
+                self.backend = BACKEND_JSON
+        elif backend != BACKEND_JSON:
+            print(f"Warning: Unknown usage store backend '{backend}', using JSON")
+            self.backend = BACKEND_JSON
+        return JsonUsageStore(self.storage_path, compact_threshold)
+
+    def record_usage(self, mode: str, resolution: str, success: bool, outcome: str = None,
+                     latency: float = None, ttfb: float = None, decode_time: float = None,
+                     prompt_chars: int = None, request_bytes: int = None,
+                     response_bytes: int = None):
+        """
+        API使用を記録
+
+        Args:
+            mode: 生成モード ("normal", "redraw", "simple", "refine")
+            resolution: 解像度 ("1K", "2K", "4K")
+            success: 画像が生成されたかどうか（料金の計算に使う。キャンセル・タイムアウト後に
+                     送信済みのリクエストが画像を返した場合もTrue）
+            outcome: 結果の種類 ("success", "failed", "cancelled", "timeout")
+                     省略時はsuccessから決める
+            latency: 生成にかかった秒数（再試行・レート制限待ちを含む）
+            ttfb: 送信から応答ヘッダー受信までの秒数
+            decode_time: 受信した画像のデコード秒数
+            prompt_chars: プロンプトの文字数
+            request_bytes: 送信したデータのバイト数（プロンプト＋参照画像）
+            response_bytes: 受信した画像データのバイト数
+        """
+        if outcome is None:
+            outcome = OUTCOME_SUCCESS if success else OUTCOME_FAILED
+        self.store.append({
+            "date": date.today().isoformat(),
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "mode": mode,
+            "resolution": resolution,
+            "success": success,
+            "outcome": outcome,
+            "latency": _round_seconds(latency),
+            "ttfb": _round_seconds(ttfb),
+            "decode_time": _round_seconds(decode_time),
+            "prompt_chars": prompt_chars,
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes
+        })
+
+    def refresh(self) -> bool:
+        """
+        他のプロセス（別ウィンドウ・バッチ生成）が記録した使用量を取り込む
+
+        Returns:
+            記録が変わった可能性があるかどうか
+        """
+        return self.store.refresh()
+
+    def compact(self):
+        """保存先の整理（JSONはログをスナップショットにまとめる）"""
+        self.store.compact()
+
+    def close(self):
+        """アプリ終了時の後処理"""
+        self.store.close()
+
+    def get_count(self, start: str = None, end: str = None, mode: str = None) -> int:
+        """
+        期間・モードを指定して使用回数を取得
+
+        Args:
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            end: 終了日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            mode: 指定した場合はこのモードのみ
+        """
+        return self.store.count(start, end, mode)
 
     def get_today_count(self) -> int:
         """本日の使用回数を取得"""
         today = date.today().isoformat()
-        if today in self.data["daily_records"]:
-            return self.data["daily_records"][today]["count"]
-        return 0
+        return self.store.count(today, today)
 
     def get_month_count(self) -> int:
         """今月の使用回数を取得"""
         current_month = date.today().strftime("%Y-%m")
-        count = 0
-        for day, record in self.data["daily_records"].items():
-            if day.startswith(current_month):
-                count += record["count"]
-        return count
+        return self.store.count(f"{current_month}-01", f"{current_month}-31")
 
     def get_total_count(self) -> int:
         """累計使用回数を取得"""
-        return self.data["total_count"]
+        return self.store.total_count()
+
+    def _get_group_counts(self, field: str, keys) -> Dict[str, int]:
+        """項目別の回数（表示する項目だけ、ない項目は0）"""
+        counts = self.store.group_counts(field)
+        return {key: counts.get(key, 0) for key in keys}
 
     def get_mode_counts(self) -> Dict[str, int]:
         """モード別使用回数を取得"""
-        return self.data["mode_counts"].copy()
+        return self._get_group_counts("mode", MODE_KEYS)
 
     def get_resolution_counts(self) -> Dict[str, int]:
         """解像度別使用回数を取得"""
-        return self.data["resolution_counts"].copy()
+        return self._get_group_counts("resolution", RESOLUTION_KEYS)
+
+    def get_outcome_counts(self) -> Dict[str, int]:
+        """結果別（成功・失敗・キャンセル・タイムアウト）の回数を取得"""
+        return self._get_group_counts("outcome", _empty_outcome_counts())
 
     def get_today_success_rate(self) -> Optional[float]:
         """本日の成功率を取得"""
         today = date.today().isoformat()
-        if today in self.data["daily_records"]:
-            record = self.data["daily_records"][today]
-            if record["count"] > 0:
-                return record["success_count"] / record["count"] * 100
+        count = self.store.count(today, today)
+        if count > 0:
+            return self.store.count(today, today, success=True) / count * 100
         return None
 
     def get_statistics(self) -> Dict[str, Any]:
@@ -151,25 +881,128 @@ class UsageTracker:
             "total": self.get_total_count(),
             "mode_counts": self.get_mode_counts(),
             "resolution_counts": self.get_resolution_counts(),
-            "today_success_rate": today_rate
+            "outcome_counts": self.get_outcome_counts(),
+            "today_success_rate": today_rate,
+            "today_cost": self.get_today_cost(),
+            "month_cost": self.get_month_cost()
         }
 
-    def get_recent_records(self, limit: int = 10) -> list:
-        """最近の記録を取得"""
+    # === 料金・予算 ===
+
+    def get_price(self, mode: str, resolution: str) -> float:
+        """1回の生成の概算料金（料金表にないモードは通常モードの料金）"""
+        prices = self.price_table.get(mode) or self.price_table.get("normal", {})
+        return prices.get(resolution, 0.0)
+
+    def get_cost(self, start: str = None, end: str = None) -> float:
+        """
+        期間内の概算料金（成功した生成の回数×料金表）
+
+        Args:
+            start: 開始日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+            end: 終了日（"YYYY-MM-DD"、この日を含む）。Noneは制限なし
+        """
+        return sum(
+            self.get_price(mode, resolution) * count
+            for (mode, resolution), count in self.store.success_counts(start, end).items()
+        )
+
+    def get_today_cost(self) -> float:
+        """本日の概算料金"""
         today = date.today().isoformat()
-        if today in self.data["daily_records"]:
-            details = self.data["daily_records"][today]["details"]
-            return details[-limit:][::-1]  # 新しい順
-        return []
+        return self.get_cost(today, today)
+
+    def get_month_cost(self) -> float:
+        """今月の概算料金"""
+        current_month = date.today().strftime("%Y-%m")
+        return self.get_cost(f"{current_month}-01", f"{current_month}-31")
+
+    def set_budget(self, daily: Optional[float] = None, monthly: Optional[float] = None):
+        """
+        予算を変更（Noneの項目は変更しない、0は無制限）
+
+        Args:
+            daily: 1日の予算
+            monthly: 1か月の予算
+        """
+        if daily is not None:
+            self.daily_budget = daily
+        if monthly is not None:
+            self.monthly_budget = monthly
+
+    def check_budget(self, additional_cost: float = 0.0) -> Optional[str]:
+        """
+        これから使う料金を加えても予算内かどうかを確認
+
+        Args:
+            additional_cost: これから使う料金（実行中・実行予定の生成の合計）
+
+        Returns:
+            予算を超える場合はその説明、予算内ならNone
+        """
+        if self.daily_budget > 0:
+            spent = self.get_today_cost()
+            if spent + additional_cost > self.daily_budget:
+                return (
+                    f"本日の予算 ${self.daily_budget:.2f} を超えます"
+                    f"（使用済み ${spent:.2f} + 今回 ${additional_cost:.2f}）"
+                )
+        if self.monthly_budget > 0:
+            spent = self.get_month_cost()
+            if spent + additional_cost > self.monthly_budget:
+                return (
+                    f"今月の予算 ${self.monthly_budget:.2f} を超えます"
+                    f"（使用済み ${spent:.2f} + 今回 ${additional_cost:.2f}）"
+                )
+        return None
+
+    def get_metric_percentiles(self, metric: str = "latency",
+                               days: int = USAGE_METRICS_WINDOW_DAYS) -> Dict[tuple, Dict[str, float]]:
+        """
+        モード・解像度別の計測値のパーセンタイルを取得（成功した生成のみ）
+
+        Args:
+            metric: 計測値の名前（"latency", "ttfb", "decode_time", "request_bytes" など）
+            days: 直近何日分を集計するか（Noneは全期間）
+
+        Returns:
+            {(mode, resolution): {'count': 件数, 'p50': 値, 'p95': 値, 'p99': 値}}
+        """
+        start = None
+        if days is not None:
+            start = (date.today() - timedelta(days=days - 1)).isoformat()
+        groups = {}
+        for mode, resolution, value in self.store.metric_values(metric, start):
+            groups.setdefault((mode, resolution), []).append(value)
+        return {
+            key: {
+                'count': len(values),
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99)
+            }
+            for key, values in groups.items()
+        }
+
+    def get_recent_records(self, limit: int = 10) -> list:
+        """最近の記録を新しい順に取得（日付をまたいで遡る、各記録にdateを含む）"""
+        return self.store.recent(limit)
+
+
+def _round_seconds(value: Optional[float]) -> Optional[float]:
+    """秒数をミリ秒単位に丸める（Noneはそのまま）"""
+    return round(value, 3) if value is not None else None
 
 
 # シングルトンインスタンス
 _tracker_instance = None
+_tracker_lock = threading.Lock()
 
 
 def get_tracker() -> UsageTracker:
     """トラッカーのシングルトンインスタンスを取得"""
     global _tracker_instance
-    if _tracker_instance is None:
-        _tracker_instance = UsageTracker()
-    return _tracker_instance
+    with _tracker_lock:
+        if _tracker_instance is None:
+            _tracker_instance = UsageTracker()
+        return _tracker_instance
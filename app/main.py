@@ -4,11 +4,14 @@ AI創作工房
 メインUIモジュール（簡素化版）
 """
 
+import multiprocessing
 import os
 import re
 import threading
 import time
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
 from PIL import Image, ImageTk
@@ -16,7 +19,9 @@ from PIL import Image, ImageTk
 # Import constants
 from constants import (
     COLOR_MODES, DUOTONE_COLORS, OUTPUT_TYPES, OUTPUT_STYLES, ASPECT_RATIOS,
-    AGE_EXPRESSION_CONVERSIONS
+    AGE_EXPRESSION_CONVERSIONS, GENERATION_MAX_WORKERS, GENERATION_QUEUE_SIZE,
+    GENERATION_TIMEOUT_SEC, VARIANT_COUNT_OPTIONS, USAGE_METRICS_WINDOW_DAYS,
+    USAGE_REFRESH_INTERVAL_MS
 )
 
 
@@ -31,14 +36,22 @@ def convert_age_expressions(text: str) -> str:
     return result
 
 # Import logic modules
-from logic.api_client import generate_image_with_api
+from logic.api_client import generate_image_with_api, close_all_clients
 from logic.file_manager import (
     load_template, load_recent_files, save_recent_files,
     add_to_recent_files, save_yaml_file, load_yaml_file,
     update_yaml_metadata, add_title_to_image
 )
-from logic.usage_tracker import get_tracker
-from logic.reference_collector import collect_reference_image_paths
+from logic.usage_tracker import (
+    get_tracker, get_usage_outcome, OUTCOME_FAILED, OUTCOME_CANCELLED, OUTCOME_TIMEOUT
+)
+from logic.result_cache import get_result_cache
+from logic.generation_engine import GenerationEngine
+from logic.budget_guard import BudgetGuard
+from logic.reference_collector import collect_reference_image_paths, number_character_references
+from logic.four_panel_pipeline import (
+    FourPanelPipeline, build_panel_prompt, PANEL_ASPECT_RATIO, COMPOSER_TEMPLATE
+)
 
 # Import UI windows
 from ui.scene_builder_window import SceneBuilderWindow
@@ -53,6 +66,7 @@ from ui.manga_composer_window import MangaComposerWindow
 from ui.style_transform_window import StyleTransformWindow
 from ui.bg_remover_window import BgRemoverWindow
 from ui.infographic_window import InfographicWindow
+from ui.variant_grid_window import VariantGridWindow
 
 # Set appearance mode and default color theme
 ctk.set_appearance_mode("System")
@@ -86,6 +100,23 @@ class MangaGeneratorApp(ctk.CTk):
         # Current settings data (from settings windows)
         self.current_settings = {}
 
+        # 4コマのコマ別生成パイプライン（実行中のもの）
+        self._four_panel_pipeline = None
+
+        # API画像生成エンジン（結果はafter経由でUIスレッドに戻す）
+        # 実行直前に予算を確認し、超える場合は設定に応じて警告または中止する
+        self.budget_guard = BudgetGuard(
+            get_tracker(),
+            on_warning=lambda message: self.after(0, lambda: self._on_budget_warning(message))
+        )
+        self.generation_engine = GenerationEngine(
+            max_workers=GENERATION_MAX_WORKERS,
+            max_queue=GENERATION_QUEUE_SIZE,
+            dispatch=lambda fn: self.after(0, fn),
+            default_timeout=GENERATION_TIMEOUT_SEC,
+            dispatch_check=self.budget_guard
+        )
+
         # Build UI
         self._build_left_column()
         self._build_middle_column()
@@ -94,6 +125,16 @@ class MangaGeneratorApp(ctk.CTk):
         # Initial update
         self._on_output_type_change(None)
 
+        # 使用量の記録・取り込みはファイルロックを待つことがあるため、専用のスレッドで順に行う
+        self._usage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="usage")
+        self._usage_refresh = None  # 実行中の取り込み（Future）
+
+        # 他のウィンドウ・バッチ生成が記録した使用量を定期的に取り込む
+        self.after(USAGE_REFRESH_INTERVAL_MS, self._poll_usage_status)
+
+        # 終了時にAPIクライアントの接続を閉じる
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
     def _build_left_column(self):
         """左列を構築（基本設定）"""
         self.left_column = ctk.CTkFrame(self)
@@ -471,6 +512,27 @@ class MangaGeneratorApp(ctk.CTk):
         )
         self.resolution_4k_radio.pack(side="left")
 
+        # 強制再生成（結果キャッシュを使わない）
+        self.force_regenerate_var = tk.BooleanVar(value=False)
+        self.force_regenerate_checkbox = ctk.CTkCheckBox(
+            resolution_frame,
+            text="強制再生成",
+            variable=self.force_regenerate_var,
+            state="disabled"
+        )
+        self.force_regenerate_checkbox.pack(side="left", padx=(15, 0))
+
+        # 候補数（2以上で同じプロンプトを並列生成して選択）
+        ctk.CTkLabel(resolution_frame, text="候補数:").pack(side="left", padx=(15, 5))
+        self.variant_count_menu = ctk.CTkOptionMenu(
+            resolution_frame,
+            values=VARIANT_COUNT_OPTIONS,
+            width=60,
+            state="disabled"
+        )
+        self.variant_count_menu.set(VARIANT_COUNT_OPTIONS[0])
+        self.variant_count_menu.pack(side="left")
+
         # 画像生成ボタン（API用）
         self.api_generate_button = ctk.CTkButton(
             api_frame,
@@ -525,6 +587,29 @@ class MangaGeneratorApp(ctk.CTk):
             text_color="gray"
         ).pack(pady=(0, 3))
 
+        # 生成キューの状況
+        self.queue_status_label = ctk.CTkLabel(
+            usage_frame,
+            text=self._get_queue_status_text(0, 0),
+            font=("Arial", 10),
+            text_color="gray"
+        )
+        self.queue_status_label.pack(pady=(0, 3))
+
+        # 生成キャンセルボタン（待機中・実行中のジョブがあるときだけ有効）
+        self.cancel_generation_button = ctk.CTkButton(
+            usage_frame,
+            text="生成をキャンセル",
+            width=140,
+            height=24,
+            fg_color="#8B0000",
+            hover_color="#5C0000",
+            state="disabled",
+            command=self._cancel_generation
+        )
+        self.cancel_generation_button.pack(pady=(0, 5))
+        self.generation_engine.add_listener(self._on_generation_queue_change)
+
     def _build_right_column(self):
         """右列を構築（YAML/画像プレビュー）"""
         self.right_column = ctk.CTkFrame(self)
@@ -634,10 +719,6 @@ class MangaGeneratorApp(ctk.CTk):
         self._generation_start_time = None
         self._progress_timer_id = None
 
-        # API使用量トラッキング用（現在の生成情報）
-        self._current_gen_mode = None
-        self._current_gen_resolution = None
-
         # 最後に保存したYAMLファイルのパス（メタデータ連携用）
         self.last_saved_yaml_path = None
 
@@ -672,6 +753,7 @@ class MangaGeneratorApp(ctk.CTk):
         self.ref_image_entry.delete(0, tk.END)
         self.ref_image_entry.configure(state="disabled")
         self.resolution_var.set("2K")
+        self.variant_count_menu.set(VARIANT_COUNT_OPTIONS[0])
         # 参考画像プレビューをクリア
         self.ref_preview_label.configure(text="画像未読込", image=None)
 
@@ -734,6 +816,8 @@ class MangaGeneratorApp(ctk.CTk):
             self.resolution_1k_radio.configure(state="normal")
             self.resolution_2k_radio.configure(state="normal")
             self.resolution_4k_radio.configure(state="normal")
+            self.force_regenerate_checkbox.configure(state="normal")
+            self.variant_count_menu.configure(state="normal")
             # 画像生成ボタンはYAML生成後に活性化（ここでは無効のまま）
             self.api_generate_button.configure(state="disabled")
             # APIサブモードに応じて詳細設定ボタンの状態を更新
@@ -750,6 +834,8 @@ class MangaGeneratorApp(ctk.CTk):
             self.resolution_1k_radio.configure(state="disabled")
             self.resolution_2k_radio.configure(state="disabled")
             self.resolution_4k_radio.configure(state="disabled")
+            self.force_regenerate_checkbox.configure(state="disabled")
+            self.variant_count_menu.configure(state="disabled")
             self.api_generate_button.configure(state="disabled")
             # YAML出力モードでは詳細設定ボタンを有効化
             self.settings_button.configure(state="normal")
@@ -2177,12 +2263,13 @@ title_overlay:
         characters = settings.get('characters', [])
         panels = settings.get('panels', [])
 
-        # キャラクターセクション生成
+        # キャラクターセクション生成（添付画像の番号は、実際に添付した画像の順に振る）
         char_yaml = ""
-        for i, char in enumerate(characters):
+        for i, (char, number) in enumerate(zip(characters, number_character_references(characters))):
+            reference = f"添付画像{number}を参照してください" if number else "参照画像なし（説明に従ってください）"
             char_yaml += f"""
   - name: "{char.get('name', f'キャラ{i+1}')}"
-    reference: "添付画像{i+1}を参照してください"
+    reference: "{reference}"
     description: "{char.get('description', '')}\""""
 
         # パネルセクション生成
@@ -2732,42 +2819,21 @@ additional_refinement_instructions: |
         if not messagebox.askyesno("生成確認", confirm_msg):
             return
 
-        # 生成中表示
-        self.api_generate_button.configure(state="disabled", text="生成中...")
-        self.preview_label.configure(text="高品質再描画中...\n経過時間: 0秒", image=None)
-
-        # 使用量トラッキング用に現在の生成情報を保存
-        self._current_gen_mode = "redraw"
-        self._current_gen_resolution = resolution
-
-        # 経過時間タイマー開始
-        self._generation_start_time = time.time()
-        self._start_progress_timer()
-
-        def generate():
-            try:
-                result = generate_image_with_api(
-                    api_key=api_key,
-                    yaml_prompt=yaml_content,
-                    char_image_paths=[],
-                    resolution=resolution,
-                    ref_image_path=ref_image_path,
-                    aspect_ratio=aspect_ratio,
-                    mode="redraw"
-                )
-
-                if result['success'] and result['image']:
-                    img = result['image']
-                    self.after(0, lambda img=img: self._on_image_generated(img))
-                else:
-                    error_msg = result.get('error', '不明なエラー')
-                    self.after(0, lambda msg=error_msg: self._on_image_error(msg))
-            except Exception as e:
-                error_str = str(e)
-                self.after(0, lambda msg=error_str: self._on_image_error(msg))
-
-        thread = threading.Thread(target=generate, daemon=True)
-        thread.start()
+        # 生成ジョブを投入
+        self._submit_generation(
+            mode="redraw",
+            resolution=resolution,
+            request=dict(
+                api_key=api_key,
+                yaml_prompt=yaml_content,
+                char_image_paths=[],
+                resolution=resolution,
+                ref_image_path=ref_image_path,
+                aspect_ratio=aspect_ratio,
+                mode="redraw",
+                use_cache=not self.force_regenerate_var.get()
+            )
+        )
 
     def _collect_reference_image_paths(self) -> list:
         """current_settingsから参照画像のパスを収集"""
@@ -2799,47 +2865,25 @@ additional_refinement_instructions: |
         if not messagebox.askyesno("生成確認", confirm_msg):
             return
 
-        # 生成中表示
-        self.api_generate_button.configure(state="disabled", text="生成中...")
-        self.preview_label.configure(text="画像生成中...\n経過時間: 0秒", image=None)
-
         # 解像度とアスペクト比を取得
         resolution = self.resolution_var.get()
         aspect_ratio = ASPECT_RATIOS.get(self.aspect_ratio_menu.get(), '1:1')
 
-        # 使用量トラッキング用に現在の生成情報を保存
-        self._current_gen_mode = "normal"
-        self._current_gen_resolution = resolution
-
-        # 経過時間タイマー開始
-        self._generation_start_time = time.time()
-        self._start_progress_timer()
-
-        def generate():
-            try:
-                # APIクライアントを呼び出し（戻り値はdict）
-                result = generate_image_with_api(
-                    api_key=api_key,
-                    yaml_prompt=yaml_content,
-                    char_image_paths=char_image_paths,
-                    resolution=resolution,
-                    ref_image_path=None,
-                    aspect_ratio=aspect_ratio,
-                    mode="normal"
-                )
-
-                if result['success'] and result['image']:
-                    img = result['image']
-                    self.after(0, lambda img=img: self._on_image_generated(img))
-                else:
-                    error_msg = result.get('error', '不明なエラー')
-                    self.after(0, lambda msg=error_msg: self._on_image_error(msg))
-            except Exception as e:
-                error_str = str(e)
-                self.after(0, lambda msg=error_str: self._on_image_error(msg))
-
-        thread = threading.Thread(target=generate, daemon=True)
-        thread.start()
+        # 生成ジョブを投入
+        self._submit_generation(
+            mode="normal",
+            resolution=resolution,
+            request=dict(
+                api_key=api_key,
+                yaml_prompt=yaml_content,
+                char_image_paths=char_image_paths,
+                resolution=resolution,
+                ref_image_path=None,
+                aspect_ratio=aspect_ratio,
+                mode="normal",
+                use_cache=not self.force_regenerate_var.get()
+            )
+        )
 
     def _generate_simple_image(self):
         """シンプルモード：画像+テキストプロンプトのみでAPI生成"""
@@ -2883,44 +2927,21 @@ additional_refinement_instructions: |
         if not messagebox.askyesno("生成確認", confirm_msg):
             return
 
-        # 生成中表示
-        self.api_generate_button.configure(state="disabled", text="生成中...")
-        self.preview_label.configure(text="シンプルモードで生成中...\n経過時間: 0秒", image=None)
-
-        # 使用量トラッキング用に現在の生成情報を保存
-        self._current_gen_mode = "simple"
-        self._current_gen_resolution = resolution
-
-        # 経過時間タイマー開始
-        self._generation_start_time = time.time()
-        self._start_progress_timer()
-
-        def generate():
-            try:
-                # APIクライアントを呼び出し
-                # シンプルモードではプロンプトをそのまま渡す
-                result = generate_image_with_api(
-                    api_key=api_key,
-                    yaml_prompt=prompt_text,
-                    char_image_paths=[],
-                    resolution=resolution,
-                    ref_image_path=ref_image_path if has_ref_image else None,
-                    aspect_ratio=aspect_ratio,
-                    mode="simple"
-                )
-
-                if result['success'] and result['image']:
-                    img = result['image']
-                    self.after(0, lambda img=img: self._on_image_generated(img))
-                else:
-                    error_msg = result.get('error', '不明なエラー')
-                    self.after(0, lambda msg=error_msg: self._on_image_error(msg))
-            except Exception as e:
-                error_str = str(e)
-                self.after(0, lambda msg=error_str: self._on_image_error(msg))
-
-        thread = threading.Thread(target=generate, daemon=True)
-        thread.start()
+        # 生成ジョブを投入（シンプルモードではプロンプトをそのまま渡す）
+        self._submit_generation(
+            mode="simple",
+            resolution=resolution,
+            request=dict(
+                api_key=api_key,
+                yaml_prompt=prompt_text,
+                char_image_paths=[],
+                resolution=resolution,
+                ref_image_path=ref_image_path if has_ref_image else None,
+                aspect_ratio=aspect_ratio,
+                mode="simple",
+                use_cache=not self.force_regenerate_var.get()
+            )
+        )
 
     def _api_generate_from_yaml(self):
         """YAMLテキストボックスの内容からAPI画像生成を実行"""
@@ -2941,10 +2962,131 @@ additional_refinement_instructions: |
         if submode == "redraw":
             # 清書モード
             self._generate_redraw_image()
+        elif (self.output_type_menu.get() == "4コマ漫画"
+              and self.current_settings.get('panels')):
+            # 4コマ漫画: コマ別に並列生成するか、1枚の画像として生成するかを選択
+            split = messagebox.askyesnocancel(
+                "4コマ生成方法",
+                "4コマをコマごとに並列生成しますか？\n\n"
+                "「はい」→ コマ別に生成してページを自動合成（失敗したコマだけ再生成可能）\n"
+                "「いいえ」→ 4コマを1枚の画像として生成\n"
+                "「キャンセル」→ 中止"
+            )
+            if split is None:
+                return
+            elif split:
+                self._generate_four_panel_pipeline()
+            else:
+                self._generate_image_with_api(yaml_content)
         else:
             # 通常モード
             self._generate_image_with_api(yaml_content)
 
+    def _generate_four_panel_pipeline(self):
+        """4コマ漫画をコマごとに並列生成し、コンポーザーでページに合成"""
+        api_key = self.api_key_entry.get().strip()
+        if not api_key:
+            messagebox.showwarning("警告", "API Keyを入力してください")
+            return
+
+        settings = self.current_settings
+        panels = settings.get('panels', [])
+        char_image_paths = self._collect_reference_image_paths()
+        resolution = self.resolution_var.get()
+
+        # 確認ダイアログ
+        ref_info = ""
+        if char_image_paths:
+            ref_info = f"参照画像: {len(char_image_paths)}枚（全コマ共通）\n"
+            for p in char_image_paths:
+                ref_info += f"  - {os.path.basename(p)}\n"
+        confirm_msg = (
+            "【4コマ コマ別生成】画像生成を実行します\n\n"
+            f"{ref_info}"
+            f"コマ数: {len(panels)}（各コマ {PANEL_ASPECT_RATIO}）\n"
+            f"解像度: {resolution}\n"
+            "\n⚠ 注意事項:\n"
+            f"・API呼び出しはコマ数分（{len(panels)}回）行われ、料金がかかります\n"
+            "・失敗したコマは自動で1回だけ再生成します\n\n"
+            "実行しますか？"
+        )
+        if not messagebox.askyesno("生成確認", confirm_msg):
+            return
+
+        title = self.title_entry.get().strip()
+        author = self.author_entry.get().strip() or "Unknown"
+        prompts = [
+            build_panel_prompt(
+                settings, i,
+                self.color_mode_menu.get(),
+                self.output_style_menu.get(),
+                title, author
+            )
+            for i in range(len(panels))
+        ]
+
+        self._four_panel_pipeline = FourPanelPipeline(
+            prompts,
+            base_request=dict(
+                api_key=api_key,
+                char_image_paths=char_image_paths,
+                resolution=resolution,
+                ref_image_path=None,
+                aspect_ratio=PANEL_ASPECT_RATIO,
+                mode="normal",
+                use_cache=not self.force_regenerate_var.get()
+            ),
+            submit=lambda request, on_success, on_error: self._submit_api_job(
+                mode="normal",
+                resolution=resolution,
+                request=request,
+                on_success=on_success,
+                on_error=on_error,
+                on_cancel=lambda: on_error("キャンセルされました")
+            ),
+            on_update=lambda pipeline: self._stop_progress_timer_if_idle(),
+            on_finished=self._on_four_panel_finished
+        )
+        self._four_panel_pipeline.start()
+
+    def _on_four_panel_finished(self, pipeline: FourPanelPipeline):
+        """4コマのコマ別生成がすべて終わったとき"""
+        self._stop_progress_timer_if_idle()
+        self._four_panel_pipeline = None
+
+        if pipeline.cancelled:
+            self.preview_label.configure(text="4コマの生成をキャンセルしました", image=None)
+            return
+
+        failed = pipeline.get_failed_panels()
+        if failed:
+            failed_names = "、".join(f"{i + 1}コマ目" for i in failed)
+            first_error = pipeline.errors[failed[0]]
+            if messagebox.askyesno(
+                "4コマ生成",
+                f"{failed_names}の生成に失敗しました。\n\n{first_error}\n\n"
+                "失敗したコマだけ再生成しますか？\n"
+                "（「いいえ」で生成できたコマだけを合成します）"
+            ):
+                self._four_panel_pipeline = pipeline
+                pipeline.retry_failed()
+                return
+
+        if not pipeline.images:
+            self.preview_label.configure(text="エラー: 4コマの生成に失敗しました", image=None)
+            return
+
+        self.preview_label.configure(
+            text="4コマを漫画ページコンポーザーで合成しました。\n"
+                 "吹き出しの追加・出力はコンポーザーで行ってください。",
+            image=None
+        )
+        MangaComposerWindow(
+            self,
+            template=COMPOSER_TEMPLATE,
+            initial_images=pipeline.images
+        )
+
     def _open_refine_dialog(self):
         """画像加工ダイアログを開く"""
         if self.generated_image is None:
@@ -3047,12 +3189,6 @@ additional_refinement_instructions: |
             messagebox.showwarning("警告", "API Keyを入力してください")
             return
 
-        # 現在の画像を一時ファイルに保存
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        temp_image_path = os.path.join(temp_dir, "refine_source.png")
-        self.generated_image.save(temp_image_path)
-
         # 解像度とアスペクト比を取得
         resolution = self.resolution_var.get()
         aspect_ratio = ASPECT_RATIOS.get(self.aspect_ratio_menu.get(), '1:1')
@@ -3089,51 +3225,43 @@ additional_refinement_instructions: |
         if not messagebox.askyesno("加工確認", confirm_msg):
             return
 
-        # 生成中表示
-        self.refine_image_button.configure(state="disabled", text="加工中...")
-        self.api_generate_button.configure(state="disabled")
-        self.preview_label.configure(text=f"{mode_text}中...\n経過時間: 0秒", image=None)
-
-        # 使用量トラッキング用に現在の生成情報を保存
-        self._current_gen_mode = "refine"
-        self._current_gen_resolution = resolution
-
-        # 経過時間タイマー開始
-        self._generation_start_time = time.time()
-        self._start_progress_timer()
+        # 現在の画像を一時ファイルに保存（複数ジョブで上書きしないよう個別に作成）
+        import tempfile
+        fd, temp_image_path = tempfile.mkstemp(prefix="refine_source_", suffix=".png")
+        os.close(fd)
+        self.generated_image.save(temp_image_path)
 
-        def generate():
+        def remove_temp_image():
+            """一時ファイルを後始末する（待機中のキャンセル・予算による中止でも呼ばれる）"""
             try:
-                result = generate_image_with_api(
-                    api_key=api_key,
-                    yaml_prompt=refine_prompt,
-                    char_image_paths=[],
-                    resolution=resolution,
-                    ref_image_path=temp_image_path,
-                    aspect_ratio=aspect_ratio,
-                    mode="refine"
-                )
-
-                if result['success'] and result['image']:
-                    img = result['image']
-                    self.after(0, lambda img=img: self._on_refine_completed(img))
-                else:
-                    error_msg = result.get('error', '不明なエラー')
-                    self.after(0, lambda msg=error_msg: self._on_refine_error(msg))
-            except Exception as e:
-                error_str = str(e)
-                self.after(0, lambda msg=error_str: self._on_refine_error(msg))
-
-        thread = threading.Thread(target=generate, daemon=True)
-        thread.start()
+                os.remove(temp_image_path)
+            except OSError:
+                pass
+
+        # 生成ジョブを投入
+        submitted = self._submit_api_job(
+            mode="refine",
+            resolution=resolution,
+            request=dict(
+                api_key=api_key,
+                yaml_prompt=refine_prompt,
+                char_image_paths=[],
+                resolution=resolution,
+                ref_image_path=temp_image_path,
+                aspect_ratio=aspect_ratio,
+                mode="refine",
+                use_cache=not self.force_regenerate_var.get()
+            ),
+            on_success=self._on_refine_completed,
+            on_error=self._on_refine_error,
+            on_finish=remove_temp_image
+        )
+        if not submitted:
+            remove_temp_image()
 
     def _on_refine_completed(self, image: Image.Image):
         """画像加工完了"""
-        self._stop_progress_timer()
-
-        # 使用量を記録（成功）
-        if self._current_gen_mode and self._current_gen_resolution:
-            self._record_api_usage(self._current_gen_mode, self._current_gen_resolution, True)
+        self._stop_progress_timer_if_idle()
 
         self.generated_image = image
         self._image_generated_by_api = True
@@ -3155,11 +3283,7 @@ additional_refinement_instructions: |
 
     def _on_refine_error(self, error_msg: str):
         """画像加工エラー"""
-        self._stop_progress_timer()
-
-        # 使用量を記録（失敗）
-        if self._current_gen_mode and self._current_gen_resolution:
-            self._record_api_usage(self._current_gen_mode, self._current_gen_resolution, False)
+        self._stop_progress_timer_if_idle()
 
         # ボタンをリセット
         self.refine_image_button.configure(state="normal", text="画像を加工")
@@ -3174,34 +3298,76 @@ additional_refinement_instructions: |
         tracker = get_tracker()
         today = tracker.get_today_count()
         month = tracker.get_month_count()
-        return f"API使用: 本日 {today}回 / 今月 {month}回"
+        month_cost = tracker.get_month_cost()
+        return f"API使用: 本日 {today}回 / 今月 {month}回（約${month_cost:.2f}）"
 
     def _update_usage_status(self):
         """ステータスバーを更新"""
         self.usage_status_label.configure(text=self._get_usage_status_text())
 
-    def _record_api_usage(self, mode: str, resolution: str, success: bool):
-        """API使用を記録してステータスを更新"""
-        tracker = get_tracker()
-        tracker.record_usage(mode, resolution, success)
-        self._update_usage_status()
+    def _poll_usage_status(self):
+        """他のプロセスの使用量記録を取り込む（前回の取り込みが終わっていなければ見送る）"""
+        if self._usage_refresh is None or self._usage_refresh.done():
+            self._usage_refresh = self._submit_usage_task(self._refresh_usage)
+        self.after(USAGE_REFRESH_INTERVAL_MS, self._poll_usage_status)
+
+    def _refresh_usage(self):
+        """使用量を取り込み、変わっていればステータスを更新（使用量スレッドで呼ばれる）"""
+        if get_tracker().refresh():
+            self.after(0, self._update_usage_status)
+
+    def _submit_usage_task(self, func):
+        """
+        使用量の記録・取り込みを使用量スレッドで実行（ロック待ちでUIを止めない）
+
+        Returns:
+            Future（終了処理の後はNone）
+        """
+        def run():
+            try:
+                func()
+            except Exception as e:
+                print(f"Warning: Could not update usage data: {e}")
+
+        try:
+            return self._usage_executor.submit(run)
+        except RuntimeError:
+            return None
+
+    def _on_budget_warning(self, message: str):
+        """予算超過の警告を表示（警告モードでは生成は続行する）"""
+        messagebox.showwarning(
+            "予算の警告",
+            f"{message}\n\n生成は続行します。止める場合は constants.py の "
+            f"API_BUDGET_ACTION を \"block\" にしてください。"
+        )
+
+    def _record_api_usage(self, mode: str, resolution: str, success: bool, outcome: str = None,
+                          **metrics):
+        """API使用を記録してステータスを更新（metricsは所要時間・通信量など）"""
+        def record():
+            get_tracker().record_usage(mode, resolution, success, outcome, **metrics)
+            self.after(0, self._update_usage_status)
+
+        self._submit_usage_task(record)
 
     def _show_usage_details(self):
         """API使用量の詳細ダイアログを表示"""
+        # 他のプロセスの記録は定期的な取り込みで反映済み（ここではロックを待たない）
         tracker = get_tracker()
         stats = tracker.get_statistics()
 
         # ダイアログウィンドウを作成
         dialog = ctk.CTkToplevel(self)
         dialog.title("API使用状況")
-        dialog.geometry("400x450")
+        dialog.geometry("400x790")
         dialog.transient(self)
         dialog.grab_set()
 
         # ダイアログを中央に配置
         dialog.update_idletasks()
         x = self.winfo_x() + (self.winfo_width() - 400) // 2
-        y = self.winfo_y() + (self.winfo_height() - 450) // 2
+        y = self.winfo_y() + (self.winfo_height() - 790) // 2
         dialog.geometry(f"+{x}+{y}")
 
         # メインフレーム
@@ -3240,6 +3406,22 @@ additional_refinement_instructions: |
             text_color="#88ccff"
         ).pack(pady=(2, 10))
 
+        # 概算料金と予算
+        cost_text = f"概算料金: 本日 ${stats['today_cost']:.2f} / 今月 ${stats['month_cost']:.2f}"
+        budgets = []
+        if tracker.daily_budget > 0:
+            budgets.append(f"日 ${tracker.daily_budget:.2f}")
+        if tracker.monthly_budget > 0:
+            budgets.append(f"月 ${tracker.monthly_budget:.2f}")
+        if budgets:
+            cost_text += f"\n予算: {' / '.join(budgets)}"
+        ctk.CTkLabel(
+            summary_frame,
+            text=cost_text,
+            font=("Arial", 11),
+            text_color="#88ccff"
+        ).pack(pady=(0, 2))
+
         # 成功率
         if stats['today_success_rate'] is not None:
             ctk.CTkLabel(
@@ -3247,7 +3429,18 @@ additional_refinement_instructions: |
                 text=f"本日成功率: {stats['today_success_rate']:.1f}%",
                 font=("Arial", 11),
                 text_color="gray"
-            ).pack(pady=(0, 10))
+            ).pack(pady=(0, 2))
+
+        # キャンセル・タイムアウト（失敗とは別に集計）
+        outcome_counts = stats['outcome_counts']
+        ctk.CTkLabel(
+            summary_frame,
+            text=f"失敗: {outcome_counts[OUTCOME_FAILED]}回 / "
+                 f"キャンセル: {outcome_counts[OUTCOME_CANCELLED]}回 / "
+                 f"タイムアウト: {outcome_counts[OUTCOME_TIMEOUT]}回",
+            font=("Arial", 11),
+            text_color="gray"
+        ).pack(pady=(0, 10))
 
         # モード別セクション
         mode_frame = ctk.CTkFrame(main_frame)
@@ -3293,24 +3486,43 @@ additional_refinement_instructions: |
                 font=("Arial", 11)
             ).pack(anchor="w", padx=20, pady=1)
 
+        # 所要時間（モード・解像度別のパーセンタイル）
+        timing_frame = ctk.CTkFrame(main_frame)
+        timing_frame.pack(fill="x", pady=(0, 10))
+
+        ctk.CTkLabel(
+            timing_frame,
+            text=f"所要時間（直近{USAGE_METRICS_WINDOW_DAYS}日・成功のみ）",
+            font=("Arial", 12, "bold")
+        ).pack(anchor="w", padx=10, pady=(10, 5))
+
+        timing_textbox = ctk.CTkTextbox(timing_frame, height=120, font=("Consolas", 10))
+        timing_textbox.pack(fill="x", padx=10, pady=(0, 10))
+        timing_textbox.insert("1.0", self._format_timing_table(tracker, mode_names))
+        timing_textbox.configure(state="disabled")
+
         # 最近の記録
         recent_frame = ctk.CTkFrame(main_frame)
         recent_frame.pack(fill="x", pady=(0, 10))
 
         ctk.CTkLabel(
             recent_frame,
-            text="本日の最近の記録",
+            text="最近の記録",
             font=("Arial", 12, "bold")
         ).pack(anchor="w", padx=10, pady=(10, 5))
 
         recent = tracker.get_recent_records(5)
         if recent:
+            outcome_marks = {OUTCOME_CANCELLED: "取消", OUTCOME_TIMEOUT: "時間切れ"}
+            today = date.today().isoformat()
             for record in recent:
-                status = "✓" if record['success'] else "✗"
+                status = "✓" if record['success'] else outcome_marks.get(record.get('outcome'), "✗")
                 mode_jp = mode_names.get(record['mode'], record['mode'])
+                # 本日以外の記録は日付も表示
+                day = "" if record['date'] == today else record['date'][5:].replace("-", "/") + " "
                 ctk.CTkLabel(
                     recent_frame,
-                    text=f"  {record['time']} {mode_jp} {record['resolution']} {status}",
+                    text=f"  {day}{record['time']} {mode_jp} {record['resolution']} {status}",
                     font=("Arial", 10)
                 ).pack(anchor="w", padx=20, pady=1)
         else:
@@ -3321,6 +3533,32 @@ additional_refinement_instructions: |
                 text_color="gray"
             ).pack(anchor="w", padx=20, pady=1)
 
+        # 結果キャッシュ
+        cache_frame = ctk.CTkFrame(main_frame)
+        cache_frame.pack(fill="x", pady=(0, 10))
+
+        ctk.CTkLabel(
+            cache_frame,
+            text="結果キャッシュ（今回の起動中）",
+            font=("Arial", 12, "bold")
+        ).pack(anchor="w", padx=10, pady=(10, 5))
+
+        cache_stats = get_result_cache().get_stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = f" ({cache_stats['hits'] / lookups * 100:.0f}%)" if lookups else ""
+        ctk.CTkLabel(
+            cache_frame,
+            text=f"  ヒット: {cache_stats['hits']}回{hit_rate} / ミス: {cache_stats['misses']}回",
+            font=("Arial", 11)
+        ).pack(anchor="w", padx=20, pady=1)
+        ctk.CTkLabel(
+            cache_frame,
+            text=f"  保存数: {cache_stats['entries']}件 / "
+                 f"{cache_stats['size_bytes'] / 1024 / 1024:.1f}MB"
+                 f"（上限 {cache_stats['max_bytes'] / 1024 / 1024:.0f}MB）",
+            font=("Arial", 11)
+        ).pack(anchor="w", padx=20, pady=(1, 10))
+
         # 閉じるボタン
         ctk.CTkButton(
             main_frame,
@@ -3335,7 +3573,13 @@ additional_refinement_instructions: |
     def _update_progress_display(self):
         """経過時間表示を更新"""
         if self._generation_start_time is not None:
-            elapsed = int(time.time() - self._generation_start_time)
+            # 実行中のジョブがあれば最も古いジョブの開始時刻を基準にする
+            running_jobs = self.generation_engine.get_running_jobs()
+            start_time = min(
+                (job.started_at for job in running_jobs),
+                default=self._generation_start_time
+            )
+            elapsed = int(time.time() - start_time)
             minutes = elapsed // 60
             seconds = elapsed % 60
             if minutes > 0:
@@ -3343,8 +3587,10 @@ additional_refinement_instructions: |
             else:
                 time_str = f"{seconds}秒"
 
+            queued = self.generation_engine.get_queue_depth()
             self.preview_label.configure(
-                text=f"画像生成中...\n経過時間: {time_str}",
+                text=f"画像生成中...\n経過時間: {time_str}\n"
+                     f"実行中 {len(running_jobs)}件 / 待機 {queued}件",
                 image=None
             )
             # 1秒後に再度更新
@@ -3357,20 +3603,231 @@ additional_refinement_instructions: |
             self._progress_timer_id = None
         self._generation_start_time = None
 
+    def _stop_progress_timer_if_idle(self):
+        """生成ジョブがすべて終わっていればタイマーを停止"""
+        if self.generation_engine.is_idle():
+            self._stop_progress_timer()
+
+    # === 生成ジョブ管理 ===
+
+    def _submit_api_job(self, mode: str, resolution: str, request: dict,
+                        on_success, on_error, on_cancel=None, on_finish=None) -> bool:
+        """
+        API生成ジョブをエンジンに投入
+
+        Args:
+            mode: 生成モード（使用量記録用）
+            resolution: 解像度（使用量記録用）
+            request: generate_image_with_apiに渡す引数
+            on_success: 成功時のコールバック (image)
+            on_error: 失敗時・タイムアウト時のコールバック (error_msg)
+            on_cancel: キャンセル時のコールバック ()（省略時はプレビューに表示のみ）
+            on_finish: 結果によらず完了時に最初に呼ぶコールバック ()（一時ファイルの後始末など）
+
+        Returns:
+            投入できたかどうか
+        """
+        # キャンセル用のEventをAPI呼び出しと共有し、再試行の待機中でも中断できるようにする
+        cancel_event = threading.Event()
+        job = self.generation_engine.submit(
+            generate_image_with_api,
+            kwargs=dict(request, cancel_event=cancel_event),
+            label=mode,
+            meta={'mode': mode, 'resolution': resolution},
+            on_complete=lambda job, result: self._on_api_job_complete(
+                job, result, on_success, on_error, on_cancel, on_finish
+            ),
+            cancel_event=cancel_event,
+            on_late_result=self._on_api_job_late_result
+        )
+        if job is None:
+            messagebox.showwarning(
+                "警告",
+                "生成キューが満杯です。\n実行中のジョブが終わってから再度お試しください。"
+            )
+            return False
+
+        # 経過時間タイマー開始（実行中のタイマーがなければ）
+        if self._generation_start_time is None:
+            self._generation_start_time = time.time()
+            self._start_progress_timer()
+        return True
+
+    def _submit_generation(self, mode: str, resolution: str, request: dict):
+        """
+        画像生成を投入（候補数が2以上なら並列に複数生成して選択ウィンドウを開く）
+
+        Args:
+            mode: 生成モード
+            resolution: 解像度
+            request: generate_image_with_apiに渡す引数
+        """
+        count = int(self.variant_count_menu.get())
+        if count <= 1:
+            self._submit_api_job(
+                mode=mode,
+                resolution=resolution,
+                request=request,
+                on_success=self._on_image_generated,
+                on_error=self._on_image_error
+            )
+            return
+
+        window = VariantGridWindow(
+            self,
+            count,
+            on_select=self._on_variant_selected,
+            title=self.title_entry.get().strip()
+        )
+        # 候補ごとに別の画像が欲しいので結果キャッシュは使わない
+        # （参照画像のエンコード結果は前処理キャッシュで共有される）
+        variant_request = dict(request, use_cache=False)
+        submitted_at = time.time()
+        for index in range(count):
+            submitted = self._submit_api_job(
+                mode=mode,
+                resolution=resolution,
+                request=variant_request,
+                on_success=lambda image, i=index: self._on_variant_generated(
+                    window, i, image, time.time() - submitted_at
+                ),
+                on_error=lambda error_msg, i=index: self._on_variant_error(window, i, error_msg),
+                on_cancel=lambda i=index: self._on_variant_error(window, i, "キャンセルされました")
+            )
+            if not submitted:
+                for rest in range(index, count):
+                    window.set_error(rest, "生成キューが満杯のため投入できませんでした")
+                break
+
+    def _on_variant_generated(self, window: VariantGridWindow, index: int,
+                              image: Image.Image, elapsed: float):
+        """候補画像1件の生成完了"""
+        self._stop_progress_timer_if_idle()
+        window.set_image(index, image, elapsed)
+        self._show_variant_hint(window)
+
+    def _on_variant_error(self, window: VariantGridWindow, index: int, error_msg: str):
+        """候補画像1件の生成失敗"""
+        self._stop_progress_timer_if_idle()
+        window.set_error(index, error_msg)
+        self._show_variant_hint(window)
+
+    def _show_variant_hint(self, window: VariantGridWindow):
+        """候補がすべて揃い、まだ採用していなければプレビューに案内を表示"""
+        if window.winfo_exists() and window.selected_index is None and self.generation_engine.is_idle():
+            self.preview_label.configure(
+                text="候補画像ウィンドウから\n採用する画像を選んでください",
+                image=None
+            )
+
+    def _on_variant_selected(self, image: Image.Image):
+        """候補画像を採用"""
+        # 候補ウィンドウの画像にタイトルが描かれないようにコピーを渡す（別の候補を選び直せるように）
+        self._on_image_generated(image.copy())
+
+    def _format_timing_table(self, tracker, mode_names: dict) -> str:
+        """所要時間の表（モード・解像度ごとのp50/p95/p99）を作成"""
+        latency = tracker.get_metric_percentiles("latency")
+        if not latency:
+            return "記録なし（計測値は今回のバージョンから記録されます）"
+        ttfb = tracker.get_metric_percentiles("ttfb")
+        decode = tracker.get_metric_percentiles("decode_time")
+        received = tracker.get_metric_percentiles("response_bytes")
+
+        lines = []
+        mode_order = list(mode_names)
+        for mode, resolution in sorted(
+            latency,
+            key=lambda key: (mode_order.index(key[0]) if key[0] in mode_order else len(mode_order), key[1])
+        ):
+            stats = latency[(mode, resolution)]
+            lines.append(
+                f"{mode_names.get(mode, mode)} {resolution} (n={stats['count']}): "
+                f"p50 {stats['p50']:.1f} / p95 {stats['p95']:.1f} / p99 {stats['p99']:.1f}秒"
+            )
+            details = []
+            if (mode, resolution) in ttfb:
+                details.append(f"応答開始 p50 {ttfb[(mode, resolution)]['p50']:.1f}秒")
+            if (mode, resolution) in decode:
+                details.append(f"デコード p50 {decode[(mode, resolution)]['p50'] * 1000:.0f}ms")
+            if (mode, resolution) in received:
+                details.append(f"受信 p50 {received[(mode, resolution)]['p50'] / 1024 / 1024:.1f}MB")
+            if details:
+                lines.append("  " + " / ".join(details))
+        return "\n".join(lines)
+
+    def _on_api_job_complete(self, job, result: dict, on_success, on_error, on_cancel=None,
+                             on_finish=None):
+        """生成ジョブ完了時（UIスレッドで呼ばれる。待機中のキャンセル・予算による中止を含む）"""
+        if on_finish:
+            on_finish()
+        self._record_job_usage(job, result)
+
+        if result.get('success') and result.get('image'):
+            on_success(result['image'])
+        elif result.get('cancelled'):
+            if on_cancel:
+                on_cancel()
+            else:
+                self._on_generation_cancelled()
+        else:
+            on_error(result.get('error') or '不明なエラー')
+
+    def _on_api_job_late_result(self, job, result: dict):
+        """打ち切った生成ジョブの呼び出しが後から戻ったとき（UIスレッドで呼ばれる）"""
+        self._record_job_usage(job, result)
+
+    def _record_job_usage(self, job, result: dict):
+        """APIを呼んだ生成ジョブの結果を使用量に記録（判定はバッチ生成と共通のget_usage_outcome）"""
+        usage = get_usage_outcome(result)
+        if usage is not None:
+            billed, outcome = usage
+            self._record_api_usage(job.meta['mode'], job.meta['resolution'], billed, outcome, **result['metrics'])
+
+    def _cancel_generation(self):
+        """待機中・実行中の生成ジョブをすべてキャンセル"""
+        if self.generation_engine.is_idle():
+            return
+        if not messagebox.askyesno(
+            "生成キャンセル",
+            "実行中・待機中の画像生成をすべてキャンセルしますか？\n\n"
+            "※ 送信済みのリクエストは料金がかかる場合があります"
+        ):
+            return
+        if self._four_panel_pipeline is not None:
+            self._four_panel_pipeline.cancel()
+        self.generation_engine.cancel_all()
+
+    def _on_generation_cancelled(self):
+        """生成ジョブがキャンセルされたとき"""
+        self._stop_progress_timer_if_idle()
+        self.generate_button.configure(state="normal", text="YAML生成")
+        self.api_generate_button.configure(state="normal", text="画像生成（API）")
+        if self.generation_engine.is_idle():
+            self.preview_label.configure(text="画像生成をキャンセルしました", image=None)
+
+    def _get_queue_status_text(self, queued: int, running: int) -> str:
+        """生成キュー表示用のテキストを生成"""
+        return f"生成キュー: 実行中 {running}件 / 待機 {queued}件（同時実行 {self.generation_engine.max_workers}件まで）"
+
+    def _on_generation_queue_change(self, queued: int, running: int):
+        """生成キューの状態が変わったとき"""
+        self.queue_status_label.configure(text=self._get_queue_status_text(queued, running))
+        self.cancel_generation_button.configure(
+            state="normal" if queued + running > 0 else "disabled"
+        )
+
     def _on_image_generated(self, image: Image.Image):
         """画像生成完了"""
-        # タイマー停止
-        self._stop_progress_timer()
-
-        # 使用量を記録（成功）
-        if self._current_gen_mode and self._current_gen_resolution:
-            self._record_api_usage(self._current_gen_mode, self._current_gen_resolution, True)
+        # タイマー停止（他のジョブが残っていれば継続）
+        self._stop_progress_timer_if_idle()
 
         # タイトル合成（チェックボックスがオンの場合）
         if self.include_title_var.get():
             title = self.title_entry.get().strip()
             if title:
-                image = add_title_to_image(image, title, position="top-left")
+                # 生成結果は他から参照されないので、4Kでもコピーせずに直接描画する
+                image = add_title_to_image(image, title, position="top-left", in_place=True)
 
         self.generated_image = image
         self._image_generated_by_api = True  # API生成フラグを設定
@@ -3391,12 +3848,8 @@ additional_refinement_instructions: |
 
     def _on_image_error(self, error_msg: str):
         """画像生成エラー"""
-        # タイマー停止
-        self._stop_progress_timer()
-
-        # 使用量を記録（失敗）
-        if self._current_gen_mode and self._current_gen_resolution:
-            self._record_api_usage(self._current_gen_mode, self._current_gen_resolution, False)
+        # タイマー停止（他のジョブが残っていれば継続）
+        self._stop_progress_timer_if_idle()
 
         # ボタンをリセット
         self.generate_button.configure(state="normal", text="YAML生成")
@@ -3528,6 +3981,17 @@ additional_refinement_instructions: |
         """背景透過ツールを開く"""
         BgRemoverWindow(self)
 
+    # === Application Lifecycle ===
+
+    def _on_close(self):
+        """アプリ終了時の後処理"""
+        self.generation_engine.shutdown()
+        close_all_clients()
+        # 記録待ちの使用量を書き終えてから閉じる
+        self._usage_executor.shutdown(wait=True)
+        get_tracker().close()
+        self.destroy()
+
 
 def main():
     app = MangaGeneratorApp()
@@ -3535,4 +3999,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # PyInstallerでアプリ化した場合に、背景透過の一括処理のワーカープロセスを起動できるようにする
+    multiprocessing.freeze_support()
     main()
@@ -1,19 +1,33 @@
 # -*- coding: utf-8 -*-
 """
 背景透過ユーティリティウィンドウ
-単色背景除去に対応
+単色背景除去に対応（1ファイル / フォルダ一括）
+
+透過処理はワーカースレッドで行い、設定の変更は縮小画像のプレビューで即座に確認できる。
+元の解像度での処理は「背景を透過」を押したときだけ行う。
 """
 
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 from typing import Optional
-from PIL import Image
+from PIL import Image, ImageTk
 import os
 import sys
+import threading
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from constants import (
+    BG_REMOVAL_COLORS, BG_REMOVAL_FEATHER, BG_REMOVAL_PREVIEW_DELAY_MS, BG_REMOVAL_PREVIEW_EDGE
+)
+from logic.bg_removal import (
+    load_preview_source, remove_color_background, render_on_checkerboard, scale_feather
+)
+from logic.bg_removal_batch import (
+    collect_image_files, get_output_path, plan_bg_removal, run_bg_removal
+)
+
 
 class BgRemoverWindow(ctk.CTkToplevel):
     """背景透過ユーティリティウィンドウ"""
@@ -21,13 +35,25 @@ class BgRemoverWindow(ctk.CTkToplevel):
     def __init__(self, parent):
         super().__init__(parent)
         self.title("背景透過ツール")
-        self.geometry("550x450")
+        self.geometry("940x600")
         self.resizable(False, False)
 
         # モーダル風に
         self.transient(parent)
         self.grab_set()
 
+        # フォルダ一括処理の中止フラグ（実行中のみ）
+        self._batch_cancel = None
+        # ウィンドウを閉じたらワーカーからの画面更新をしない
+        self._closed = False
+
+        # プレビューの状態
+        self._preview_path = None       # 縮小画像の元ファイル
+        self._preview_source = None     # (縮小したRGBA画像, 元の画像サイズ)
+        self._preview_after_id = None   # 更新待ちのafter ID（スライダー操作中は延長）
+        self._preview_seq = 0           # 最新のプレビュー要求の番号（古い結果は捨てる）
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
         self._build_ui()
         self._center_window()
 
@@ -40,8 +66,36 @@ class BgRemoverWindow(ctk.CTkToplevel):
 
     def _build_ui(self):
         """UIを構築"""
+        controls = ctk.CTkFrame(self, fg_color="transparent", width=550)
+        controls.pack(side="left", fill="y")
+
+        # === プレビュー ===
+        preview_frame = ctk.CTkFrame(self)
+        preview_frame.pack(side="right", fill="both", expand=True, padx=10, pady=10)
+
+        ctk.CTkLabel(
+            preview_frame,
+            text="プレビュー",
+            font=("Arial", 16, "bold")
+        ).pack(anchor="w", padx=10, pady=(10, 5))
+
+        self.preview_label = ctk.CTkLabel(
+            preview_frame,
+            text="画像未読込",
+            width=BG_REMOVAL_PREVIEW_EDGE,
+            height=BG_REMOVAL_PREVIEW_EDGE
+        )
+        self.preview_label.pack(padx=10, pady=5)
+
+        ctk.CTkLabel(
+            preview_frame,
+            text="縮小画像での確認です。保存時は元の解像度で処理します",
+            font=("Arial", 11),
+            text_color="gray"
+        ).pack(anchor="w", padx=10, pady=(0, 10))
+
         # === 入力ファイル ===
-        input_frame = ctk.CTkFrame(self)
+        input_frame = ctk.CTkFrame(controls)
         input_frame.pack(fill="x", padx=10, pady=10)
 
         ctk.CTkLabel(
@@ -55,12 +109,31 @@ class BgRemoverWindow(ctk.CTkToplevel):
         file_row.grid_columnconfigure(1, weight=1)
 
         ctk.CTkLabel(file_row, text="ファイル:").grid(row=0, column=0, padx=(0, 5), sticky="w")
-        self.input_entry = ctk.CTkEntry(file_row, placeholder_text="画像ファイルを選択")
+        self.input_entry = ctk.CTkEntry(file_row, placeholder_text="画像ファイル、またはフォルダを選択")
         self.input_entry.grid(row=0, column=1, sticky="ew", padx=(0, 5))
+        self.input_entry.bind("<Return>", lambda e: self._load_preview_source())
+        self.input_entry.bind("<FocusOut>", lambda e: self._load_preview_source())
         ctk.CTkButton(file_row, text="参照", width=60, command=self._browse_input).grid(row=0, column=2)
+        ctk.CTkButton(
+            file_row, text="フォルダ", width=70, command=self._browse_input_folder
+        ).grid(row=0, column=3, padx=(5, 0))
+
+        ctk.CTkLabel(
+            input_frame,
+            text="フォルダを選ぶと中の画像をまとめて処理します（入力より新しい透過画像があるファイルはスキップ）",
+            font=("Arial", 11),
+            text_color="gray"
+        ).pack(anchor="w", padx=10, pady=(0, 5))
+
+        self.force_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            input_frame,
+            text="処理済みのファイルも処理し直す",
+            variable=self.force_var
+        ).pack(anchor="w", padx=10, pady=(0, 10))
 
         # === 処理設定 ===
-        method_frame = ctk.CTkFrame(self)
+        method_frame = ctk.CTkFrame(controls)
         method_frame.pack(fill="x", padx=10, pady=10)
 
         ctk.CTkLabel(
@@ -83,19 +156,30 @@ class BgRemoverWindow(ctk.CTkToplevel):
         ctk.CTkLabel(color_options_frame, text="除去する色:").pack(side="left", padx=(0, 5))
         self.color_menu = ctk.CTkOptionMenu(
             color_options_frame,
-            values=["白", "黒", "緑（グリーンバック）", "青（ブルーバック）"],
-            width=160
+            values=list(BG_REMOVAL_COLORS.keys()),
+            width=160,
+            command=self._schedule_preview
         )
         self.color_menu.set("白")
         self.color_menu.pack(side="left", padx=(0, 15))
 
         ctk.CTkLabel(color_options_frame, text="許容値:").pack(side="left", padx=(0, 5))
-        self.tolerance_slider = ctk.CTkSlider(color_options_frame, from_=0, to=100, width=100)
+        self.tolerance_slider = ctk.CTkSlider(
+            color_options_frame, from_=0, to=100, width=100, command=self._schedule_preview
+        )
         self.tolerance_slider.set(30)
         self.tolerance_slider.pack(side="left")
 
+        self.feather_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            method_frame,
+            text="輪郭を滑らかにする（境界を半透明にして背景色の色かぶりを除去）",
+            variable=self.feather_var,
+            command=self._schedule_preview
+        ).pack(anchor="w", padx=10, pady=(5, 10))
+
         # === 出力設定 ===
-        output_frame = ctk.CTkFrame(self)
+        output_frame = ctk.CTkFrame(controls)
         output_frame.pack(fill="x", padx=10, pady=10)
 
         ctk.CTkLabel(
@@ -109,21 +193,22 @@ class BgRemoverWindow(ctk.CTkToplevel):
         output_row.grid_columnconfigure(1, weight=1)
 
         ctk.CTkLabel(output_row, text="保存先:").grid(row=0, column=0, padx=(0, 5), sticky="w")
-        self.output_entry = ctk.CTkEntry(output_row, placeholder_text="自動（入力ファイル名_transparent.png）")
+        self.output_entry = ctk.CTkEntry(output_row, placeholder_text="自動（入力ファイル名_transparent.png）※フォルダ処理では常に自動")
         self.output_entry.grid(row=0, column=1, sticky="ew", padx=(0, 5))
         ctk.CTkButton(output_row, text="参照", width=60, command=self._browse_output).grid(row=0, column=2)
 
         # === 実行ボタン ===
-        button_frame = ctk.CTkFrame(self, fg_color="transparent")
+        button_frame = ctk.CTkFrame(controls, fg_color="transparent")
         button_frame.pack(fill="x", padx=10, pady=20)
 
-        ctk.CTkButton(
+        self.execute_button = ctk.CTkButton(
             button_frame,
             text="背景を透過",
             width=200,
             height=40,
             command=self._execute
-        ).pack(side="left", padx=10)
+        )
+        self.execute_button.pack(side="left", padx=10)
 
         ctk.CTkButton(
             button_frame,
@@ -131,12 +216,17 @@ class BgRemoverWindow(ctk.CTkToplevel):
             width=100,
             height=40,
             fg_color="gray",
-            command=self.destroy
+            command=self._on_close
         ).pack(side="right", padx=10)
 
+        # 進捗表示（フォルダ一括処理）
+        self.progress_bar = ctk.CTkProgressBar(controls)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(fill="x", padx=20, pady=(0, 5))
+
         # ステータス表示
         self.status_label = ctk.CTkLabel(
-            self,
+            controls,
             text="",
             font=("Arial", 11),
             text_color="gray"
@@ -151,6 +241,15 @@ class BgRemoverWindow(ctk.CTkToplevel):
         if filename:
             self.input_entry.delete(0, tk.END)
             self.input_entry.insert(0, filename)
+            self._load_preview_source()
+
+    def _browse_input_folder(self):
+        """入力フォルダ選択（一括処理）"""
+        folder = filedialog.askdirectory()
+        if folder:
+            self.input_entry.delete(0, tk.END)
+            self.input_entry.insert(0, folder)
+            self._load_preview_source()
 
     def _browse_output(self):
         """出力ファイル選択"""
@@ -173,96 +272,231 @@ class BgRemoverWindow(ctk.CTkToplevel):
             messagebox.showerror("エラー", "入力ファイルが見つかりません。")
             return
 
+        if os.path.isdir(input_path):
+            self._execute_folder(input_path)
+            return
+
         # 出力パスを決定
         output_path = self.output_entry.get().strip()
         if not output_path:
-            base, _ = os.path.splitext(input_path)
-            output_path = f"{base}_transparent.png"
+            output_path = get_output_path(input_path)
 
+        self.execute_button.configure(state="disabled")
         self.status_label.configure(text="処理中...")
-        self.update()
 
+        settings = self._get_removal_settings()
+        thread = threading.Thread(
+            target=self._run_file_worker,
+            args=(input_path, output_path, settings),
+            daemon=True
+        )
+        thread.start()
+
+    def _run_file_worker(self, input_path: str, output_path: str, settings: tuple):
+        """1ファイルの透過処理のワーカースレッド"""
         try:
-            self._remove_color_background(input_path, output_path)
+            self._remove_color_background(input_path, output_path, settings)
+            self._post(lambda: self._on_file_complete(output_path, None))
+        except Exception as e:
+            error = str(e)
+            self._post(lambda: self._on_file_complete(output_path, error))
+
+    def _on_file_complete(self, output_path: str, error: Optional[str]):
+        """1ファイルの透過処理の完了"""
+        self.execute_button.configure(state="normal")
+        if error:
+            self.status_label.configure(text="エラー")
+            messagebox.showerror("エラー", f"処理中にエラーが発生しました。\n\n{error}")
+            return
+        self.status_label.configure(text=f"完了: {os.path.basename(output_path)}")
+        messagebox.showinfo("完了", f"背景透過が完了しました。\n\n保存先: {output_path}")
+
+    def _execute_folder(self, folder: str):
+        """フォルダ内の画像をまとめて透過（プロセスプールで並列処理）"""
+        if self._batch_cancel is not None:
+            return
 
-            self.status_label.configure(text=f"完了: {os.path.basename(output_path)}")
-            messagebox.showinfo("完了", f"背景透過が完了しました。\n\n保存先: {output_path}")
+        tasks = plan_bg_removal(collect_image_files(folder), force=self.force_var.get())
+        if not tasks:
+            messagebox.showerror("エラー", "フォルダに画像ファイルがありません。")
+            return
+
+        target_color, tolerance, feather = self._get_removal_settings()
+        self._batch_cancel = threading.Event()
+        self.execute_button.configure(state="disabled")
+        self.progress_bar.set(0)
+        self.status_label.configure(text=f"処理中... 0/{len(tasks)}")
 
+        thread = threading.Thread(
+            target=self._run_folder_worker,
+            args=(tasks, target_color, tolerance, feather, self._batch_cancel),
+            daemon=True
+        )
+        thread.start()
+
+    def _run_folder_worker(
+        self, tasks: list, target_color: tuple, tolerance: int, feather: int, cancel_event: threading.Event
+    ):
+        """一括処理のワーカースレッド（UIの更新はメインスレッドで行う）"""
+        counts = {'success': 0, 'failed': 0, 'skipped': 0}
+        errors = []
+        done = 0
+        try:
+            for task, result in run_bg_removal(
+                tasks, target_color, tolerance, feather=feather, cancel_event=cancel_event
+            ):
+                done += 1
+                if result.get('skipped'):
+                    counts['skipped'] += 1
+                elif result['success']:
+                    counts['success'] += 1
+                else:
+                    counts['failed'] += 1
+                    errors.append(f"{os.path.basename(task['input_path'])}: {result['error']}")
+                name = os.path.basename(task['input_path'])
+                self._post(lambda d=done, n=name: self._on_folder_progress(d, len(tasks), n))
         except Exception as e:
-            self.status_label.configure(text="エラー")
-            messagebox.showerror("エラー", f"処理中にエラーが発生しました。\n\n{str(e)}")
-
-    def _remove_color_background(self, input_path: str, output_path: str):
-        """単色背景を透過に変換（フラッドフィル方式：端から連続した領域のみ）"""
-        img = Image.open(input_path).convert("RGBA")
-        width, height = img.size
-        pixels = img.load()
-
-        # 除去する色を決定
-        color_name = self.color_menu.get()
-        if color_name == "白":
-            target_color = (255, 255, 255)
-        elif color_name == "黒":
-            target_color = (0, 0, 0)
-        elif color_name == "緑（グリーンバック）":
-            target_color = (0, 255, 0)
-        elif color_name == "青（ブルーバック）":
-            target_color = (0, 0, 255)
+            errors.append(str(e))
+        self._post(lambda: self._on_folder_complete(counts, errors))
+
+    def _on_folder_progress(self, done: int, total: int, name: str):
+        """1ファイル完了ごとの進捗表示"""
+        self.progress_bar.set(done / total)
+        self.status_label.configure(text=f"処理中... {done}/{total}  {name}")
+
+    def _on_folder_complete(self, counts: dict, errors: list):
+        """一括処理の完了"""
+        self._batch_cancel = None
+        self.execute_button.configure(state="normal")
+        summary = (
+            f"成功 {counts['success']}件 / 失敗 {counts['failed']}件 / "
+            f"スキップ {counts['skipped']}件"
+        )
+        self.status_label.configure(text=f"完了: {summary}")
+        if errors:
+            detail = "\n".join(errors[:10])
+            messagebox.showwarning("完了", f"一括処理が完了しました。\n\n{summary}\n\n{detail}")
         else:
-            target_color = (255, 255, 255)
+            messagebox.showinfo("完了", f"一括処理が完了しました。\n\n{summary}")
 
-        tolerance = int(self.tolerance_slider.get()) * 3  # RGB各チャンネル分
+    # === プレビュー ===
+
+    def _load_preview_source(self):
+        """入力画像（フォルダなら先頭の画像）の縮小画像をワーカースレッドで読み込む"""
+        path = self.input_entry.get().strip()
+        if os.path.isdir(path):
+            images = collect_image_files(path)
+            path = images[0] if images else None
+        if not path or not os.path.isfile(path):
+            return
+        if path == self._preview_path:
+            return
 
-        def is_target_color(pixel):
-            """指定色かどうかを判定"""
-            r, g, b = pixel[0], pixel[1], pixel[2]
-            distance = abs(r - target_color[0]) + abs(g - target_color[1]) + abs(b - target_color[2])
-            return distance <= tolerance
-
-        # フラッドフィル用のマスク（透過すべきピクセル）
-        to_remove = set()
-
-        # 4辺の端から開始点を収集
-        start_points = []
-        # 上端と下端
-        for x in range(width):
-            start_points.append((x, 0))
-            start_points.append((x, height - 1))
-        # 左端と右端
-        for y in range(height):
-            start_points.append((0, y))
-            start_points.append((width - 1, y))
-
-        # BFSでフラッドフィル
-        from collections import deque
-        visited = set()
-        queue = deque()
-
-        for point in start_points:
-            if point not in visited:
-                x, y = point
-                pixel = pixels[x, y]
-                if is_target_color(pixel):
-                    queue.append(point)
-                    visited.add(point)
-
-        while queue:
-            x, y = queue.popleft()
-            pixel = pixels[x, y]
-
-            if is_target_color(pixel):
-                to_remove.add((x, y))
-
-                # 4方向の隣接ピクセルをチェック
-                for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                    nx, ny = x + dx, y + dy
-                    if 0 <= nx < width and 0 <= ny < height and (nx, ny) not in visited:
-                        visited.add((nx, ny))
-                        queue.append((nx, ny))
-
-        # 透過処理を適用
-        for x, y in to_remove:
-            r, g, b, a = pixels[x, y]
-            pixels[x, y] = (r, g, b, 0)
-
-        img.save(output_path, "PNG")
+        self._preview_path = path
+        self._preview_source = None
+        self.preview_label.configure(text="読込中...", image=None)
+
+        def worker():
+            try:
+                source = load_preview_source(path)
+            except Exception as e:
+                print(f"Background removal preview error: {e}")
+                self._post(lambda: self._on_preview_source_loaded(path, None))
+                return
+            self._post(lambda: self._on_preview_source_loaded(path, source))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _on_preview_source_loaded(self, path: str, source: Optional[tuple]):
+        """縮小画像の読み込み完了"""
+        if path != self._preview_path:
+            return  # 読み込み中に別の画像が選ばれた
+        if source is None:
+            self._preview_path = None
+            self.preview_label.configure(text="読込エラー", image=None)
+            return
+        self._preview_source = source
+        self._start_preview()
+
+    def _schedule_preview(self, *args):
+        """設定の変更からプレビュー更新までを間引く（スライダー操作中は最後の値だけ処理）"""
+        if self._preview_after_id is not None:
+            self.after_cancel(self._preview_after_id)
+        self._preview_after_id = self.after(BG_REMOVAL_PREVIEW_DELAY_MS, self._start_preview)
+
+    def _start_preview(self):
+        """現在の設定で縮小画像を透過（ワーカースレッド）"""
+        self._preview_after_id = None
+        if self._preview_source is None:
+            return
+
+        self._preview_seq += 1
+        seq = self._preview_seq
+        small, full_size = self._preview_source
+        target_color, tolerance, feather = self._get_removal_settings()
+        feather = scale_feather(feather, small.size, full_size)
+
+        def worker():
+            try:
+                result = remove_color_background(small, target_color, tolerance, feather=feather)
+                preview = render_on_checkerboard(result)
+            except Exception as e:
+                print(f"Background removal preview error: {e}")
+                return
+            self._post(lambda: self._show_preview(seq, preview))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_preview(self, seq: int, preview: Image.Image):
+        """プレビューを表示（より新しい要求があれば捨てる）"""
+        if seq != self._preview_seq:
+            return
+        photo = ImageTk.PhotoImage(preview)
+        self.preview_label.configure(image=photo, text="")
+        self.preview_label.image = photo  # 参照を保持
+
+    # === 共通 ===
+
+    def _post(self, callback):
+        """ワーカースレッドからメインスレッドで画面を更新（閉じた後は何もしない）"""
+        if self._closed:
+            return
+        try:
+            self.after(0, callback)
+        except (RuntimeError, tk.TclError):
+            pass  # 閉じている最中
+
+    def _on_close(self):
+        """ウィンドウを閉じる（一括処理中なら未開始のファイルを取り消す）"""
+        self._closed = True
+        if self._batch_cancel is not None:
+            self._batch_cancel.set()
+        self.destroy()
+
+    def _get_removal_settings(self) -> tuple:
+        """
+        画面の設定から透過の条件を取得
+
+        Returns:
+            (除去する色 (R, G, B), 許容値, 輪郭を半透明にする幅)
+        """
+        target_color = BG_REMOVAL_COLORS.get(self.color_menu.get(), (255, 255, 255))
+        tolerance = int(self.tolerance_slider.get()) * 3  # RGB各チャンネル分
+        feather = BG_REMOVAL_FEATHER if self.feather_var.get() else 0
+        return target_color, tolerance, feather
+
+    def _remove_color_background(self, input_path: str, output_path: str, settings: tuple):
+        """
+        単色背景を透過に変換（フラッドフィル方式：端から連続した領域のみ）
+
+        Args:
+            input_path: 入力画像
+            output_path: 保存先
+            settings: _get_removal_settingsの戻り値（ワーカースレッドから呼ぶため事前に取得）
+        """
+        target_color, tolerance, feather = settings
+
+        with Image.open(input_path) as img:
+            # 読み込んだ画像は保存後に捨てるので、RGBAならコピーせずに書き込む
+            result = remove_color_background(img, target_color, tolerance, feather=feather, in_place=True)
+            result.save(output_path, "PNG")
@@ -2,38 +2,26 @@
 """
 漫画ページコンポーザーウィンドウ
 生成した画像を組み合わせて漫画ページを作成
+
+ページの合成はlogic/manga_layoutのPageComposerで行い（変更のあったコマだけ描き直す）、
+プレビューはプレビュー幅で高速に、「画像を出力」では出力幅・LANCZOSで描く。
+作ったページはブックに追加でき、まとめてPDF/CBZに出力できる（ページの描画はワーカープロセスで並列に行う）。
 """
 
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 from typing import Optional, Callable
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import Image, ImageTk
 import os
+import sys
+import threading
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# テンプレート定義
-TEMPLATES = {
-    "4コマ（16:9縦並び）": {
-        "cols": 1,
-        "rows": 4,
-        "panel_ratio": (16, 9),  # 各コマのアスペクト比
-        "description": "各コマ16:9を縦に4枚並べ"
-    },
-    "8コマ（4:3 2列）": {
-        "cols": 2,
-        "rows": 4,
-        "panel_ratio": (4, 3),  # 各コマのアスペクト比
-        "description": "4:3を縦4枚×2列"
-    }
-}
+from logic.manga_book import write_book
+from logic.manga_layout import TEMPLATES, OUTPUT_WIDTHS, PageComposer, compose_page
 
-# 出力サイズ（Web向け）
-OUTPUT_WIDTHS = {
-    "標準（720px）": 720,
-    "高解像度（1080px）": 1080,
-    "大（1440px）": 1440
-}
 
 # 吹き出しスタイル
 BUBBLE_STYLES = {
@@ -47,7 +35,15 @@ BUBBLE_STYLES = {
 class MangaComposerWindow(ctk.CTkToplevel):
     """漫画ページコンポーザーウィンドウ"""
 
-    def __init__(self, parent, callback: Optional[Callable] = None):
+    def __init__(self, parent, callback: Optional[Callable] = None,
+                 template: Optional[str] = None, initial_images: Optional[dict] = None):
+        """
+        Args:
+            parent: 親ウィンドウ
+            callback: 完了時のコールバック
+            template: 初期テンプレート名（省略時は4コマ）
+            initial_images: 最初から配置するコマ画像 {panel_index: PIL.Image}
+        """
         super().__init__(parent)
         self.parent = parent
         self.callback = callback
@@ -56,13 +52,18 @@ class MangaComposerWindow(ctk.CTkToplevel):
         self.title("漫画ページコンポーザー")
         self.geometry("1200x800")
         self.transient(parent)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         # データ
-        self.panel_images = {}  # {panel_index: PIL.Image}
-        self.panel_bubbles = {}  # {panel_index: [{'text': str, 'position': (x,y), 'style': str}]}
-        self.current_template = "4コマ（16:9縦並び）"
+        self.current_template = template if template in TEMPLATES else "4コマ（16:9縦並び）"
+        self.composer = PageComposer(self.current_template)  # コマ画像・吹き出しと描画キャッシュ
         self.composed_image = None
 
+        # ブック（compose_pageに渡すページのリスト）
+        self.book_pages = []
+        self._book_cancel = None  # ブック出力中の取り消し用イベント
+        self._closed = False
+
         # グリッド設定
         self.grid_columnconfigure(0, weight=1, minsize=400)
         self.grid_columnconfigure(1, weight=2, minsize=500)
@@ -72,6 +73,10 @@ class MangaComposerWindow(ctk.CTkToplevel):
         self._build_left_panel()
         self._build_right_panel()
 
+        # 生成済みのコマ画像を配置してプレビュー
+        if initial_images:
+            self._set_initial_images(initial_images)
+
         # フォーカス
         self.focus()
 
@@ -227,6 +232,56 @@ class MangaComposerWindow(ctk.CTkToplevel):
         )
         self.export_btn.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
 
+        # === ブック（複数ページ） ===
+        book_frame = ctk.CTkFrame(left_frame)
+        book_frame.grid(row=4, column=0, padx=5, pady=(0, 10), sticky="ew")
+        for col in range(3):
+            book_frame.grid_columnconfigure(col, weight=1)
+
+        self.book_label = ctk.CTkLabel(
+            book_frame,
+            text="ブック: 0ページ",
+            font=("Arial", 16, "bold")
+        )
+        self.book_label.grid(row=0, column=0, columnspan=3, padx=10, pady=(10, 5), sticky="w")
+
+        self.add_page_btn = ctk.CTkButton(
+            book_frame,
+            text="ページを追加",
+            command=self._add_book_page
+        )
+        self.add_page_btn.grid(row=1, column=0, padx=5, pady=5, sticky="ew")
+
+        self.clear_book_btn = ctk.CTkButton(
+            book_frame,
+            text="クリア",
+            fg_color="gray",
+            hover_color="darkgray",
+            command=self._clear_book
+        )
+        self.clear_book_btn.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+
+        self.export_book_btn = ctk.CTkButton(
+            book_frame,
+            text="ブックを出力",
+            command=self._export_book,
+            fg_color="green",
+            hover_color="darkgreen"
+        )
+        self.export_book_btn.grid(row=1, column=2, padx=5, pady=5, sticky="ew")
+
+        self.book_progress_bar = ctk.CTkProgressBar(book_frame)
+        self.book_progress_bar.set(0)
+        self.book_progress_bar.grid(row=2, column=0, columnspan=3, padx=10, pady=(5, 0), sticky="ew")
+
+        self.book_status_label = ctk.CTkLabel(
+            book_frame,
+            text="今のページを追加し、PDF（.pdf）またはCBZ（.cbz）に出力します",
+            font=("Arial", 11),
+            text_color="gray"
+        )
+        self.book_status_label.grid(row=3, column=0, columnspan=3, padx=10, pady=(0, 5), sticky="w")
+
     def _build_right_panel(self):
         """右パネル（プレビューエリア）を構築"""
         right_frame = ctk.CTkFrame(self)
@@ -315,8 +370,7 @@ class MangaComposerWindow(ctk.CTkToplevel):
         # コマ選択UIを再構築
         self._create_panel_selectors()
         # 画像とバブルをクリア
-        self.panel_images = {}
-        self.panel_bubbles = {}
+        self.composer.set_template(value)
         self._update_bubble_list()
         # プレビューをクリア
         self.preview_label.configure(
@@ -325,6 +379,17 @@ class MangaComposerWindow(ctk.CTkToplevel):
         )
         self.composed_image = None
 
+    def _set_initial_images(self, images: dict):
+        """生成済みのコマ画像を配置"""
+        for panel_index, img in images.items():
+            if panel_index >= len(self.panel_widgets):
+                continue
+            self.composer.set_image(panel_index, img)
+            entry = self.panel_widgets[panel_index]['entry']
+            entry.delete(0, tk.END)
+            entry.insert(0, f"（生成画像 コマ{panel_index + 1}）")
+        self._update_preview()
+
     def _browse_panel_image(self, panel_index: int, entry: ctk.CTkEntry):
         """コマ画像を参照"""
         filename = filedialog.askopenfilename(
@@ -336,15 +401,15 @@ class MangaComposerWindow(ctk.CTkToplevel):
             # 画像を読み込み
             try:
                 img = Image.open(filename)
-                self.panel_images[panel_index] = img
+                self.composer.set_image(panel_index, img)
             except Exception as e:
                 messagebox.showerror("エラー", f"画像の読み込みに失敗しました:\n{e}")
 
     def _clear_panel_image(self, panel_index: int, entry: ctk.CTkEntry):
         """コマ画像をクリア"""
         entry.delete(0, tk.END)
-        if panel_index in self.panel_images:
-            del self.panel_images[panel_index]
+        if panel_index in self.composer.images:
+            self.composer.set_image(panel_index, None)
 
     def _add_bubble(self):
         """吹き出しを追加"""
@@ -356,10 +421,10 @@ class MangaComposerWindow(ctk.CTkToplevel):
         panel_idx = int(self.bubble_panel_menu.get()) - 1
         style = BUBBLE_STYLES[self.bubble_style_menu.get()]
 
-        if panel_idx not in self.panel_bubbles:
-            self.panel_bubbles[panel_idx] = []
+        if panel_idx not in self.composer.bubbles:
+            self.composer.bubbles[panel_idx] = []
 
-        self.panel_bubbles[panel_idx].append({
+        self.composer.bubbles[panel_idx].append({
             'text': text,
             'style': style,
             'position': (0.5, 0.2)  # デフォルト位置（コマ中央上部）
@@ -376,7 +441,7 @@ class MangaComposerWindow(ctk.CTkToplevel):
         self.bubble_list.configure(state="normal")
         self.bubble_list.delete("1.0", tk.END)
 
-        for panel_idx, bubbles in sorted(self.panel_bubbles.items()):
+        for panel_idx, bubbles in sorted(self.composer.bubbles.items()):
             for bubble in bubbles:
                 self.bubble_list.insert(
                     tk.END,
@@ -387,210 +452,122 @@ class MangaComposerWindow(ctk.CTkToplevel):
 
         self.bubble_list.configure(state="disabled")
 
-    def _compose_image(self) -> Optional[Image.Image]:
-        """画像を合成"""
-        template = TEMPLATES[self.current_template]
-        cols = template["cols"]
-        rows = template["rows"]
-        panel_ratio = template["panel_ratio"]
-
-        output_width = OUTPUT_WIDTHS[self.output_width_menu.get()]
-
-        # 各コマのサイズを計算
-        panel_w = output_width // cols
-        panel_h = int(panel_w * panel_ratio[1] / panel_ratio[0])
-
-        # キャンバスサイズ
-        canvas_w = output_width
-        canvas_h = panel_h * rows
-
-        # 白背景のキャンバスを作成
-        canvas = Image.new("RGB", (canvas_w, canvas_h), "white")
-
-        # 各コマを配置
-        num_panels = cols * rows
-        for i in range(num_panels):
-            col = i % cols
-            row = i // cols
-            x = col * panel_w
-            y = row * panel_h
-
-            if i in self.panel_images:
-                img = self.panel_images[i].copy()
-                # コマサイズにフィット（アスペクト比を維持してクロップ）
-                img = self._fit_image_to_panel(img, panel_w, panel_h)
-                canvas.paste(img, (x, y))
-
-                # 吹き出しを描画
-                if i in self.panel_bubbles:
-                    for bubble in self.panel_bubbles[i]:
-                        self._draw_bubble(canvas, x, y, panel_w, panel_h, bubble)
-            else:
-                # 空のコマ（グレー）
-                draw = ImageDraw.Draw(canvas)
-                draw.rectangle([x, y, x + panel_w - 1, y + panel_h - 1], fill="#EEEEEE", outline="#CCCCCC", width=2)
-                # コマ番号を表示
-                try:
-                    font = ImageFont.truetype("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", 24)
-                except:
-                    font = ImageFont.load_default()
-                text = f"コマ{i + 1}"
-                bbox = draw.textbbox((0, 0), text, font=font)
-                text_w = bbox[2] - bbox[0]
-                text_h = bbox[3] - bbox[1]
-                draw.text(
-                    (x + panel_w // 2 - text_w // 2, y + panel_h // 2 - text_h // 2),
-                    text,
-                    fill="#999999",
-                    font=font
-                )
-
-        # コマ枠を描画
-        draw = ImageDraw.Draw(canvas)
-        for i in range(num_panels):
-            col = i % cols
-            row = i // cols
-            x = col * panel_w
-            y = row * panel_h
-            draw.rectangle([x, y, x + panel_w - 1, y + panel_h - 1], outline="black", width=2)
-
-        return canvas
-
-    def _fit_image_to_panel(self, img: Image.Image, panel_w: int, panel_h: int) -> Image.Image:
-        """画像をコマサイズにフィット（アスペクト比維持、中央クロップ）"""
-        img_w, img_h = img.size
-        img_ratio = img_w / img_h
-        panel_ratio = panel_w / panel_h
-
-        if img_ratio > panel_ratio:
-            # 画像が横長 → 上下に合わせて左右をクロップ
-            new_h = img_h
-            new_w = int(img_h * panel_ratio)
-            left = (img_w - new_w) // 2
-            img = img.crop((left, 0, left + new_w, new_h))
-        else:
-            # 画像が縦長 → 左右に合わせて上下をクロップ
-            new_w = img_w
-            new_h = int(img_w / panel_ratio)
-            top = (img_h - new_h) // 2
-            img = img.crop((0, top, new_w, top + new_h))
-
-        # リサイズ
-        img = img.resize((panel_w, panel_h), Image.Resampling.LANCZOS)
-        return img
-
-    def _draw_bubble(self, canvas: Image.Image, panel_x: int, panel_y: int,
-                     panel_w: int, panel_h: int, bubble: dict):
-        """吹き出しを描画"""
-        draw = ImageDraw.Draw(canvas)
-        text = bubble['text']
-        style = bubble['style']
-        pos = bubble['position']
-
-        # フォント
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", 16)
-        except:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-
-        # テキストサイズを計算
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-
-        # 吹き出しのサイズとパディング
-        padding = 10
-        bubble_w = text_w + padding * 2
-        bubble_h = text_h + padding * 2
-
-        # 位置を計算（コマ内の相対位置）
-        bubble_x = panel_x + int(pos[0] * panel_w) - bubble_w // 2
-        bubble_y = panel_y + int(pos[1] * panel_h) - bubble_h // 2
-
-        # コマ内に収まるように調整
-        bubble_x = max(panel_x + 5, min(bubble_x, panel_x + panel_w - bubble_w - 5))
-        bubble_y = max(panel_y + 5, min(bubble_y, panel_y + panel_h - bubble_h - 5))
-
-        # 吹き出し形状を描画
-        if style == "oval":
-            draw.ellipse(
-                [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
-                fill="white",
-                outline="black",
-                width=2
-            )
-        elif style == "rounded_rect":
-            self._draw_rounded_rectangle(
-                draw, bubble_x, bubble_y, bubble_w, bubble_h,
-                radius=10, fill="white", outline="black", width=2
-            )
-        elif style == "burst":
-            # ギザギザ（簡易版）
-            draw.ellipse(
-                [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
-                fill="white",
-                outline="black",
-                width=3
-            )
-        else:  # cloud
-            draw.ellipse(
-                [bubble_x, bubble_y, bubble_x + bubble_w, bubble_y + bubble_h],
-                fill="white",
-                outline="black",
-                width=2
-            )
-
-        # テキストを描画
-        draw.text(
-            (bubble_x + padding, bubble_y + padding),
-            text,
-            fill="black",
-            font=font
-        )
-
-    def _draw_rounded_rectangle(self, draw, x, y, w, h, radius, fill, outline, width):
-        """角丸四角形を描画"""
-        draw.rounded_rectangle(
-            [x, y, x + w, y + h],
-            radius=radius,
-            fill=fill,
-            outline=outline,
-            width=width
-        )
+    def _get_output_width(self) -> int:
+        """選択中の出力幅（px）"""
+        return OUTPUT_WIDTHS[self.output_width_menu.get()]
 
     def _update_preview(self):
-        """プレビューを更新"""
-        self.composed_image = self._compose_image()
-        if self.composed_image:
-            # プレビュー用にリサイズ
-            preview = self.composed_image.copy()
-            max_preview_width = 500
-            if preview.width > max_preview_width:
-                ratio = max_preview_width / preview.width
-                new_size = (max_preview_width, int(preview.height * ratio))
-                preview = preview.resize(new_size, Image.Resampling.LANCZOS)
-
+        """プレビューを更新（プレビュー幅で直接、高速に描画）"""
+        preview = self.composer.compose(self._get_output_width(), draft=True)
+        if preview:
             photo = ImageTk.PhotoImage(preview)
             self.preview_label.configure(image=photo, text="")
             self.preview_label.image = photo
 
     def _export_image(self):
-        """画像を出力"""
-        if not self.composed_image:
-            self._update_preview()
+        """画像を出力（出力幅・LANCZOSで描画）"""
+        filename = filedialog.asksaveasfilename(
+            initialfile="manga_page",
+            defaultextension=".png",
+            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
 
+        self.composed_image = self.composer.compose(self._get_output_width())
         if not self.composed_image:
             messagebox.showwarning("警告", "出力する画像がありません")
             return
 
+        self.composed_image.save(filename)
+        messagebox.showinfo("保存完了", f"画像を保存しました:\n{filename}")
+
+    def _add_book_page(self):
+        """今のページをブックに追加（縮小済みのコマ画像と吹き出しを保持）"""
+        if not self.composer.images:
+            messagebox.showwarning("警告", "コマ画像を選択してください")
+            return
+        self.book_pages.append(self.composer.to_page(self._get_output_width()))
+        self.book_label.configure(text=f"ブック: {len(self.book_pages)}ページ")
+
+    def _clear_book(self):
+        """ブックのページをすべて削除"""
+        if self._book_cancel is not None:
+            return
+        self.book_pages = []
+        self.book_label.configure(text="ブック: 0ページ")
+        self.book_progress_bar.set(0)
+
+    def _export_book(self):
+        """ブックをPDF/CBZに出力（ワーカースレッドで描画・書き込み）"""
+        if self._book_cancel is not None:
+            return
+        if not self.book_pages:
+            messagebox.showwarning("警告", "ブックにページがありません。「ページを追加」で追加してください")
+            return
+
         filename = filedialog.asksaveasfilename(
-            initialfile="manga_page",
-            defaultextension=".png",
-            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")]
+            initialfile="manga_book",
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("Comic book archive", "*.cbz")]
         )
-        if filename:
-            self.composed_image.save(filename)
-            messagebox.showinfo("保存完了", f"画像を保存しました:\n{filename}")
+        if not filename:
+            return
+
+        pages = list(self.book_pages)
+        self._book_cancel = threading.Event()
+        self.export_book_btn.configure(state="disabled")
+        self.clear_book_btn.configure(state="disabled")
+        self.book_progress_bar.set(0)
+        self.book_status_label.configure(text=f"出力中... 0/{len(pages)}")
+
+        thread = threading.Thread(
+            target=self._run_book_worker,
+            args=(pages, filename, self._book_cancel),
+            daemon=True
+        )
+        thread.start()
+
+    def _run_book_worker(self, pages: list, filename: str, cancel_event: threading.Event):
+        """ブック出力のワーカースレッド（UIの更新はメインスレッドで行う）"""
+        result = write_book(
+            pages, filename, compose_page,
+            progress_callback=lambda done, total: self._post(
+                lambda: self._on_book_progress(done, total)
+            ),
+            cancel_event=cancel_event
+        )
+        self._post(lambda: self._on_book_complete(filename, result))
+
+    def _on_book_progress(self, done: int, total: int):
+        """1ページ書き込むごとの進捗表示"""
+        self.book_progress_bar.set(done / total)
+        self.book_status_label.configure(text=f"出力中... {done}/{total}")
+
+    def _on_book_complete(self, filename: str, result: dict):
+        """ブック出力の完了"""
+        self._book_cancel = None
+        self.export_book_btn.configure(state="normal")
+        self.clear_book_btn.configure(state="normal")
+        if not result['success']:
+            self.book_status_label.configure(text="エラー")
+            messagebox.showerror("エラー", f"ブックの出力に失敗しました:\n{result['error']}")
+            return
+        self.book_status_label.configure(text=f"完了: {result['pages']}ページ")
+        messagebox.showinfo("保存完了", f"ブック（{result['pages']}ページ）を保存しました:\n{filename}")
+
+    def _post(self, callback):
+        """ワーカースレッドからメインスレッドで画面を更新（閉じた後は何もしない）"""
+        if self._closed:
+            return
+        try:
+            self.after(0, callback)
+        except (RuntimeError, tk.TclError):
+            pass  # 閉じている最中
+
+    def _on_close(self):
+        """ウィンドウを閉じる（ブック出力中なら残りのページを取り消す）"""
+        self._closed = True
+        if self._book_cancel is not None:
+            self._book_cancel.set()
+        self.destroy()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+候補画像の選択ウィンドウ
+同じプロンプトで並列生成した複数の候補をサムネイルで並べ、1枚を採用する
+"""
+
+import customtkinter as ctk
+from typing import Callable, Optional
+from PIL import Image, ImageTk
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# サムネイルの最大サイズ
+THUMBNAIL_SIZE = (260, 260)
+
+
+class VariantGridWindow(ctk.CTkToplevel):
+    """候補画像のサムネイルグリッド"""
+
+    def __init__(self, parent, count: int, on_select: Callable, title: str = ""):
+        """
+        Args:
+            parent: 親ウィンドウ
+            count: 候補数
+            on_select: 候補を採用したときのコールバック (image)
+            title: ウィンドウタイトルに添える説明
+        """
+        super().__init__(parent)
+        self.title(f"候補画像の選択{' - ' + title if title else ''}")
+        self.count = count
+        self.on_select = on_select
+        self.images = [None] * count  # 受け取った候補画像
+        self.slots = []  # [(image_label, status_label, select_button)]
+        self.selected_index: Optional[int] = None
+
+        self.transient(parent)
+        self._build_ui()
+
+    def _build_ui(self):
+        """UIを構築"""
+        self.header_label = ctk.CTkLabel(
+            self,
+            text=self._get_header_text(),
+            font=("Arial", 14, "bold")
+        )
+        self.header_label.pack(padx=10, pady=(10, 5))
+
+        grid_frame = ctk.CTkFrame(self)
+        grid_frame.pack(fill="both", expand=True, padx=10, pady=5)
+
+        columns = 2 if self.count <= 4 else 3
+        for index in range(self.count):
+            cell = ctk.CTkFrame(grid_frame)
+            cell.grid(row=index // columns, column=index % columns, padx=5, pady=5, sticky="nsew")
+
+            image_label = ctk.CTkLabel(
+                cell,
+                text=f"候補 {index + 1}\n生成中...",
+                width=THUMBNAIL_SIZE[0],
+                height=THUMBNAIL_SIZE[1],
+                text_color="gray"
+            )
+            image_label.pack(padx=5, pady=(5, 0))
+
+            status_label = ctk.CTkLabel(cell, text="", font=("Arial", 10), text_color="gray")
+            status_label.pack(padx=5)
+
+            select_button = ctk.CTkButton(
+                cell,
+                text="この画像を採用",
+                state="disabled",
+                command=lambda i=index: self._select(i)
+            )
+            select_button.pack(padx=5, pady=(0, 5), fill="x")
+
+            self.slots.append((image_label, status_label, select_button))
+
+        ctk.CTkButton(
+            self,
+            text="閉じる",
+            fg_color="gray",
+            command=self.destroy
+        ).pack(pady=(5, 10))
+
+    def _get_header_text(self) -> str:
+        """見出しのテキスト（受信状況）"""
+        received = sum(1 for image in self.images if image is not None)
+        return f"候補画像（{received}/{self.count}件 受信）"
+
+    def set_image(self, index: int, image: Image.Image, elapsed: float = None):
+        """
+        候補画像を表示
+
+        Args:
+            index: 候補の番号（0から）
+            image: 生成された画像
+            elapsed: 生成にかかった秒数
+        """
+        if not self.winfo_exists():
+            return
+        self.images[index] = image
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        photo = ImageTk.PhotoImage(thumbnail)
+
+        image_label, status_label, select_button = self.slots[index]
+        image_label.configure(image=photo, text="")
+        image_label.image = photo
+        status_label.configure(
+            text=f"候補 {index + 1}" + (f"（{elapsed:.1f}秒）" if elapsed is not None else ""),
+            text_color="gray"
+        )
+        select_button.configure(state="normal")
+        self.header_label.configure(text=self._get_header_text())
+
+    def set_error(self, index: int, error_msg: str):
+        """
+        候補の生成失敗を表示
+
+        Args:
+            index: 候補の番号（0から）
+            error_msg: エラーメッセージ
+        """
+        if not self.winfo_exists():
+            return
+        image_label, status_label, _ = self.slots[index]
+        image_label.configure(text=f"候補 {index + 1}\n生成失敗", text_color="#cc6666")
+        # 長いエラーは先頭だけ表示
+        preview = error_msg if len(error_msg) <= 60 else error_msg[:60] + "..."
+        status_label.configure(text=preview, text_color="#cc6666")
+
+    def _select(self, index: int):
+        """候補を採用"""
+        image = self.images[index]
+        if image is None:
+            return
+        self.selected_index = index
+        for i, (_, status_label, select_button) in enumerate(self.slots):
+            if i == index:
+                select_button.configure(text="採用中 ✓")
+            elif self.images[i] is not None:
+                select_button.configure(text="この画像を採用")
+        self.on_select(image)
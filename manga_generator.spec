@@ -37,6 +37,7 @@ hiddenimports = [
     'PIL.ImageFont',
     'PIL.ImageTk',
     'customtkinter',
+    'numpy',
     'yaml',
     'tkinter',
     'tkinter.filedialog',
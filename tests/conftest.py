@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+テスト共通設定
+app/ をimportパスに追加し、ロジックモジュールを `from logic... import` で読み込めるようにする
+"""
+
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""batch_runner のテスト（実行計画・出力の書き出し・完了順の結果）"""
+
+import json
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from logic import batch_runner
+from logic.api_client import generate_image_with_api
+from logic.batch_runner import plan_batch, run_batch, write_outputs
+from logic.fake_gemini import FakeGeminiConfig, install_fake_client, uninstall_fake_client
+from logic.retry_policy import set_rate_limit
+
+API_KEY = "batch-runner-test"
+
+
+def _write_yaml(directory, name, body):
+    path = directory / f"{name}.yaml"
+    path.write_text(body, encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def fake_client():
+    set_rate_limit(API_KEY, per_minute=6000, burst=10)
+    client = install_fake_client(FakeGeminiConfig(latency=0.0, jitter=0.0, image_scale=0.02, seed=1))
+    yield client
+    uninstall_fake_client()
+
+
+def test_plan_skips_existing_outputs(tmp_path):
+    Image.new("RGB", (4, 4)).save(tmp_path / "ref.png")
+    done = _write_yaml(tmp_path, "done", "scene: done\n")
+    todo = _write_yaml(tmp_path, "todo", "scene: todo\nimage: ref.png\nother: missing.png\naspect_ratio: '16:9'\n")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / "done.png").write_bytes(b"png")
+
+    tasks = plan_batch([done, todo], str(output_dir), resolution="1K")
+    assert [task['skip'] for task in tasks] == [True, False]
+    assert tasks[0]['prompt'] is None
+    assert tasks[1]['ref_images'] == [str(tmp_path / "ref.png")]
+    assert tasks[1]['missing_refs'] == ["missing.png"]
+    assert tasks[1]['aspect_ratio'] == "16:9"
+
+    # forceなら出力済みでも作り直す
+    assert not any(task['skip'] for task in plan_batch([done], str(output_dir), force=True))
+
+
+def test_write_outputs_replaces_atomically(tmp_path, monkeypatch):
+    task = plan_batch([_write_yaml(tmp_path, "page", "scene: page\n")], str(tmp_path))[0]
+    result = {'success': True, 'image': Image.new("RGB", (8, 8), "red")}
+    write_outputs(task, result, "normal", 1.234)
+
+    assert Image.open(task['image_path']).getpixel((0, 0)) == (255, 0, 0)
+    with open(task['metadata_path'], encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['image'] == "page.png" and metadata['elapsed_sec'] == 1.23
+    assert not os.path.exists(task['image_path'] + ".tmp")
+
+    # 置き換えに失敗しても、既存の画像は残り一時ファイルも残さない
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(batch_runner.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        write_outputs(task, {'success': True, 'image': Image.new("RGB", (8, 8), "blue")}, "normal", 1.0)
+    assert Image.open(task['image_path']).getpixel((0, 0)) == (255, 0, 0)
+    assert not os.path.exists(task['image_path'] + ".tmp")
+
+
+def test_run_batch_yields_in_completion_order(tmp_path, fake_client):
+    delays = {"slow": 0.6, "fast": 0.0, "middle": 0.3}
+    paths = [_write_yaml(tmp_path, name, f"scene: {name}\n") for name in delays]
+    paths.append(_write_yaml(tmp_path, "broken", "scene: [unclosed\n"))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / "middle.png").write_bytes(b"png")
+    tasks = plan_batch(paths, str(output_dir), resolution="1K")
+
+    def generate(**kwargs):
+        # プロンプトごとに完了までの時間を変える
+        time.sleep(delays[kwargs['yaml_prompt'].split(": ")[1].strip()])
+        return generate_image_with_api(**kwargs)
+
+    results = list(run_batch(tasks, API_KEY, max_workers=3, use_cache=False, generate_func=generate))
+    names = [os.path.basename(task['yaml_path']) for task, _, _ in results]
+    # スキップ・読込エラーが先、残りは完了した順
+    assert names == ["middle.yaml", "broken.yaml", "fast.yaml", "slow.yaml"]
+    assert results[0][1]['skipped']
+    assert not results[1][1]['success'] and 'metrics' not in results[1][1]
+    for _, result, elapsed in results[2:]:
+        assert result['success'] and result['image'] is not None
+        assert 'latency' in result['metrics']
+    assert results[3][2] >= 0.6
+    assert fake_client.stats['calls'] == 2
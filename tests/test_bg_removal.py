@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""bg_removal のテスト"""
+
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from logic import bg_removal_batch
+from logic.bg_removal import remove_color_background, _remove_spill
+from logic.bg_removal_batch import get_output_path, remove_background_file
+
+GREEN = (0, 255, 0)
+
+
+def _make_image(background=GREEN, size=(64, 48)):
+    """背景色の上に図形を描いた画像（中央の穴は背景とつながっていない）"""
+    image = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse([8, 8, 56, 40], fill=(200, 60, 40), outline=(20, 120, 30), width=3)
+    draw.rectangle([28, 20, 36, 28], fill=background)
+    return image
+
+
+def test_numpy_matches_legacy():
+    image = _make_image()
+    legacy = remove_color_background(image, GREEN, 30, method="legacy")
+    for method in ("numpy", "tiled"):
+        result = remove_color_background(image, GREEN, 30, method=method)
+        assert np.array_equal(np.array(result), np.array(legacy)), method
+
+
+def test_enclosed_background_is_kept():
+    result = np.array(remove_color_background(_make_image(), GREEN, 30))
+    assert result[0, 0, 3] == 0
+    assert result[24, 32, 3] == 255
+
+
+def test_despill_leaves_opaque_pixels_unchanged():
+    image = _make_image()
+    original = np.array(image.convert("RGBA"))
+    result = np.array(remove_color_background(image, GREEN, 30, feather=2, despill=True))
+    opaque = result[:, :, 3] == 255
+    # 緑を含む前景（輪郭線）も、不透明のまま残ったピクセルの色は変わらない
+    assert np.array_equal(result[opaque, :3], original[opaque, :3])
+
+
+def test_remove_spill_only_touches_partial_alpha():
+    background = np.array(GREEN, dtype=np.float32)
+    colors = np.array([[20, 120, 30], [20, 120, 30], [10, 200, 20]], dtype=np.float32)
+    coverage = np.array([1.0, 0.999, 0.5], dtype=np.float32)  # 0.999は丸めると255（不透明）
+    result = _remove_spill(colors.copy(), coverage, background)
+    assert np.array_equal(result[:2], colors[:2])
+    assert result[2, 1] <= max(result[2, 0], result[2, 2])
+
+
+def test_failed_save_leaves_no_temp_file(tmp_path, monkeypatch):
+    input_path = str(tmp_path / "page.png")
+    _make_image().save(input_path)
+    output_path = get_output_path(input_path)
+
+    result = remove_background_file(input_path, output_path, GREEN, 30)
+    assert result['success'] and Image.open(output_path).mode == "RGBA"
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(bg_removal_batch.os, "replace", fail_replace)
+    result = remove_background_file(input_path, output_path, GREEN, 30)
+    assert not result['success'] and "disk full" in result['error']
+    assert not os.path.exists(output_path + ".tmp")
+    assert os.path.exists(output_path)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""budget_guard のテスト（予算超過時の中止・警告と、キャッシュから返せるジョブの扱い）"""
+
+from datetime import date
+
+import pytest
+
+from logic import budget_guard
+from logic.budget_guard import BudgetGuard, BUDGET_BLOCK, BUDGET_WARN
+from logic.generation_engine import GenerationJob
+
+
+class _Tracker:
+    """1件$1で、使用済み$spent・予算$budgetのトラッカー"""
+
+    def __init__(self, spent=0.0, budget=2.0):
+        self.spent = spent
+        self.budget = budget
+        self.checked = []
+
+    def get_price(self, mode, resolution):
+        return 1.0
+
+    def check_budget(self, additional_cost=0.0):
+        self.checked.append(additional_cost)
+        if self.spent + additional_cost > self.budget:
+            return f"予算 ${self.budget:.2f} を超えます"
+        return None
+
+
+def _job(job_id=1, use_cache=True):
+    kwargs = dict(yaml_prompt=f"prompt {job_id}", char_image_paths=[], resolution="2K",
+                  mode="normal", use_cache=use_cache)
+    return GenerationJob(job_id, lambda **kwargs: None, kwargs=kwargs)
+
+
+def _guard(tracker, action, cached=(), on_warning=None):
+    """yaml_promptがcachedに含まれるジョブをキャッシュヒットとして扱う予算ガード"""
+    return BudgetGuard(tracker, action=action, on_warning=on_warning,
+                       is_cached=lambda kwargs: kwargs['yaml_prompt'] in cached)
+
+
+def test_block_counts_running_jobs():
+    tracker = _Tracker(spent=0.5)
+    guard = _guard(tracker, BUDGET_BLOCK)
+    assert guard(_job(1), []) is None
+    assert "中止" in guard(_job(3), [_job(1), _job(2)])
+    assert tracker.checked == [1.0, 3.0]
+
+
+def test_block_allows_cache_hits():
+    tracker = _Tracker(spent=2.0)
+    guard = _guard(tracker, BUDGET_BLOCK, cached={"prompt 1"})
+    # キャッシュから返せるジョブは料金0なので予算を使い切っていても実行する
+    assert guard.estimate_job_cost(_job(1)) == 0.0
+    assert guard(_job(1), []) is None
+    # 強制再生成（use_cache=False）は料金がかかる
+    assert guard.estimate_job_cost(_job(1, use_cache=False)) == 1.0
+    assert guard(_job(1, use_cache=False), []) is not None
+    assert guard(_job(2), []) is not None
+
+
+def test_warn_runs_and_notifies_once_per_day(monkeypatch, capsys):
+    today = [date(2026, 10, 1)]
+
+    class _Date(date):
+        @classmethod
+        def today(cls):
+            return today[0]
+
+    monkeypatch.setattr(budget_guard, "date", _Date)
+    warnings = []
+    guard = _guard(_Tracker(spent=2.0), BUDGET_WARN, on_warning=warnings.append)
+
+    assert guard(_job(1), []) is None
+    assert guard(_job(2), []) is None
+    assert len(warnings) == 1
+    # 毎回ログには出す
+    assert capsys.readouterr().out.count("Warning:") == 2
+
+    today[0] = date(2026, 10, 2)
+    assert guard(_job(3), []) is None
+    assert len(warnings) == 2
+
+
+@pytest.mark.parametrize("action", [BUDGET_BLOCK, BUDGET_WARN])
+def test_within_budget_does_not_warn(action):
+    warnings = []
+    guard = _guard(_Tracker(spent=0.0), action, on_warning=warnings.append)
+    assert guard(_job(1), [_job(2)]) is None
+    assert warnings == []
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""file_lock とJSONストアのロック待ちのテスト"""
+
+import threading
+import time
+
+import pytest
+
+from logic.file_lock import FileLock, FileLockTimeout
+from logic.usage_tracker import UsageTracker
+
+
+def test_lock_times_out_while_held(tmp_path):
+    path = str(tmp_path / "data.lock")
+    with FileLock(path):
+        waiter = FileLock(path, timeout=0.2)
+        started = time.monotonic()
+        with pytest.raises(FileLockTimeout):
+            with waiter:
+                pass
+        assert time.monotonic() - started >= 0.2
+        assert waiter._fd is None
+
+
+def test_lock_can_be_taken_after_release(tmp_path):
+    path = str(tmp_path / "data.lock")
+    with FileLock(path):
+        pass
+    with FileLock(path, timeout=0.2) as lock:
+        assert lock._fd is not None
+
+
+def test_usage_event_is_deferred_until_lock_is_free(tmp_path):
+    storage_path = str(tmp_path / "api_usage.json")
+    tracker = UsageTracker(storage_path, backend="json")
+    tracker.store._file_lock.timeout = 0.1
+
+    holder = FileLock(storage_path + ".lock")
+    assert holder.acquire()
+    try:
+        tracker.record_usage("normal", "2K", True)
+        # ロックを取れない間は書き込まずに保留する
+        assert tracker.get_today_count() == 0
+        assert len(tracker.store._pending) == 1
+    finally:
+        holder.release()
+
+    tracker.record_usage("normal", "2K", True)
+    assert tracker.get_today_count() == 2
+    assert tracker.store._pending == []
+
+    # 保留していたイベントも別のインスタンスから読める
+    tracker.close()
+    assert UsageTracker(storage_path, backend="json").get_today_count() == 2
+
+
+def test_reads_do_not_wait_for_file_lock(tmp_path):
+    storage_path = str(tmp_path / "api_usage.json")
+    tracker = UsageTracker(storage_path, backend="json")
+    tracker.record_usage("normal", "2K", True)
+    tracker.store._file_lock.timeout = 1.0
+
+    holder = FileLock(storage_path + ".lock")
+    assert holder.acquire()
+    try:
+        writer = threading.Thread(target=tracker.refresh)
+        writer.start()
+        time.sleep(0.1)
+        # 別スレッドがロックを待っている間も集計はすぐに読める
+        started = time.monotonic()
+        assert tracker.get_today_count() == 1
+        assert time.monotonic() - started < 0.5
+        writer.join()
+    finally:
+        holder.release()
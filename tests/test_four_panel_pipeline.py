@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""four_panel_pipeline / reference_collector のテスト"""
+
+import yaml
+from PIL import Image
+
+from logic.four_panel_pipeline import build_panel_prompt
+from logic.reference_collector import collect_reference_image_paths
+
+
+def _settings(tmp_path):
+    image_path = str(tmp_path / "b.png")
+    Image.new("RGB", (4, 4)).save(image_path)
+    return {
+        'characters': [
+            {'name': "A", 'description': "画像なし", 'image_path': ""},
+            {'name': "B", 'description': "画像あり", 'image_path': image_path},
+        ],
+        'panels': [
+            {
+                'prompt': 'He said "hi"\nand left \\ quickly',
+                'speeches': [{'character': "B", 'content': '"Wait!": she said', 'position': "left"}],
+                'narration': "Line1\nLine2",
+            },
+            {'prompt': "next", 'speeches': []},
+        ],
+    }
+
+
+def _panel_yaml(prompt: str) -> dict:
+    """プロンプトからYAML部分を取り出して解析"""
+    return yaml.safe_load(prompt.split("---", 1)[1])
+
+
+def test_attachment_numbers_follow_attached_images(tmp_path):
+    settings = _settings(tmp_path)
+    assert collect_reference_image_paths(settings) == [settings['characters'][1]['image_path']]
+
+    data = _panel_yaml(build_panel_prompt(settings, 0, "フルカラー", "アニメ調"))
+    refs = [char['reference'] for char in data['characters']]
+    assert "添付画像" not in refs[0]
+    assert refs[1] == "添付画像1を参照してください"
+
+
+def test_user_text_is_escaped(tmp_path):
+    settings = _settings(tmp_path)
+    data = _panel_yaml(build_panel_prompt(settings, 0, "フルカラー", "アニメ調", title='My "title"'))
+    assert data['title'] == 'My "title"'
+    assert data['panel']['prompt'] == 'He said "hi"\nand left \\ quickly'
+    assert data['panel']['speeches'][0]['content'] == '"Wait!": she said'
+    assert data['panel']['narration'] == "Line1\nLine2"
+    assert data['story'][1] == "2コマ目（承）: next"
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""generation_engine のテスト（キャンセル・タイムアウト時の実行枠と課金の扱い）"""
+
+import http.server
+import threading
+import time
+
+import pytest
+from google import genai
+from google.genai import types
+
+from logic import api_client
+from logic.api_client import generate_image_with_api
+from logic.fake_gemini import FakeGeminiConfig, install_fake_client, uninstall_fake_client
+from logic.generation_engine import GenerationEngine
+
+
+def _slow(delay=0.5, cancel_event=None, honor_cancel=False):
+    """delay秒かかる生成関数（honor_cancelならcancel_eventで途中で戻る）"""
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        if honor_cancel and cancel_event is not None and cancel_event.is_set():
+            return {'success': False, 'image': None, 'error': "中断", 'cancelled': True}
+        time.sleep(0.01)
+    return {'success': True, 'image': "image", 'error': None, 'metrics': {'latency': delay}}
+
+
+def _run(engine, kwargs, func=_slow, **options):
+    """ジョブを投入し、(job, 完了を待つ関数) を返す"""
+    done = threading.Event()
+    results = []
+
+    def on_complete(job, result):
+        results.append(result)
+        done.set()
+
+    shared = threading.Event()
+    job = engine.submit(func, kwargs=dict(kwargs, cancel_event=shared), on_complete=on_complete,
+                        cancel_event=shared, **options)
+
+    def wait():
+        assert done.wait(5)
+        return results[0]
+    return job, wait
+
+
+@pytest.fixture
+def engine():
+    engine = GenerationEngine(max_workers=1)
+    yield engine
+    engine.shutdown()
+
+
+def test_success(engine):
+    job, wait = _run(engine, {'delay': 0.05})
+    result = wait()
+    assert result['success'] and result['image'] == "image"
+    assert engine.is_idle()
+
+
+def test_timeout_releases_slot_and_reports_late_result():
+    late = []
+    late_done = threading.Event()
+    engine = GenerationEngine(max_workers=1, abort_grace=0.1)
+    try:
+        job, wait = _run(
+            engine, {'delay': 0.8}, timeout=0.1,
+            on_late_result=lambda job, result: (late.append(result), late_done.set())
+        )
+        second, wait_second = _run(engine, {'delay': 0.01})
+
+        # 制限時間と猶予を過ぎたら、関数が戻るのを待たずに枠を空ける
+        result = wait()
+        assert result['timed_out'] and result['abandoned'] and not result['success']
+        assert 'billed' not in result and 'metrics' not in result
+        assert job.finished_at - job.started_at < 0.5
+        assert job.cancel_event.is_set()
+        assert wait_second()['success']
+        assert [j.job_id for j in engine.get_abandoned_jobs()] == [job.job_id]
+
+        # 打ち切った関数が戻ったら、課金の有無と計測値を後から受け取る
+        assert late_done.wait(5)
+        assert late[0]['timed_out'] and late[0]['billed'] is True
+        assert late[0]['metrics'] == {'latency': 0.8}
+        assert engine.get_abandoned_jobs() == []
+    finally:
+        engine.shutdown()
+
+
+def test_cancel_running_job_returns_without_waiting(engine):
+    job, wait = _run(engine, {'delay': 2.0, 'honor_cancel': True})
+    time.sleep(0.1)
+    engine.cancel(job)
+
+    result = wait()
+    assert result['cancelled'] and result['billed'] is False
+    assert job.finished_at - job.started_at < 1.0
+    assert engine.get_abandoned_jobs() == []
+
+
+def test_cancelled_late_success_is_billed(engine):
+    job, wait = _run(engine, {'delay': 0.4})
+    time.sleep(0.1)
+    assert engine.cancel_all() == 1
+    result = wait()
+    assert result['cancelled'] and not result['success']
+    assert result['billed'] is True and result['image'] is None
+
+
+def test_cancel_queued_job_never_runs(engine):
+    first, wait_first = _run(engine, {'delay': 0.2})
+    queued, wait_queued = _run(engine, {'delay': 0.2})
+    engine.cancel(queued)
+    assert wait_queued()['cancelled']
+    assert queued.started_at is None
+    assert 'billed' not in queued.result
+    assert wait_first()['success']
+
+
+def test_budget_check_sees_interrupted_calls():
+    seen = []
+
+    def check(job, running_jobs):
+        seen.append(len(running_jobs))
+        return None
+
+    engine = GenerationEngine(max_workers=2, dispatch_check=check, abort_grace=0.05)
+    try:
+        job, wait = _run(engine, {'delay': 0.5}, timeout=0.05)
+        assert wait()['abandoned']
+        _, wait_second = _run(engine, {'delay': 0.01})
+        wait_second()
+        # 打ち切った後も応答待ちのリクエストは予算の確認に渡される
+        assert seen == [0, 1]
+    finally:
+        engine.shutdown()
+
+
+def test_max_workers_counts_interrupted_calls():
+    engine = GenerationEngine(max_workers=2, default_timeout=0.05)
+    try:
+        waits = [_run(engine, {'delay': 0.3})[1] for _ in range(4)]
+        peak = 0
+        while not engine.is_idle():
+            peak = max(peak, engine.get_active_count())
+            time.sleep(0.01)
+        assert peak == 2
+        assert all(wait()['timed_out'] for wait in waits)
+    finally:
+        engine.shutdown()
+
+
+def test_api_call_timeout_is_billed_with_metrics():
+    install_fake_client(FakeGeminiConfig(latency=0.4, jitter=0.0, image_scale=0.05, seed=1))
+    engine = GenerationEngine(max_workers=1, default_timeout=0.1)
+    try:
+        done = threading.Event()
+        results = []
+        cancel_event = threading.Event()
+        engine.submit(
+            generate_image_with_api,
+            kwargs=dict(
+                api_key="test", yaml_prompt="prompt", char_image_paths=[], resolution="1K",
+                ref_image_path=None, aspect_ratio="1:1", mode="normal", use_cache=False,
+                cancel_event=cancel_event
+            ),
+            on_complete=lambda job, result: (results.append(result), done.set()),
+            cancel_event=cancel_event
+        )
+        assert done.wait(5)
+        result = results[0]
+        assert result['timed_out'] and result['billed'] is True
+        assert result['metrics']['latency'] >= 0.4
+        assert 'image_data' not in result
+    finally:
+        engine.shutdown()
+        uninstall_fake_client()
+
+
+class _SlowHandler(http.server.BaseHTTPRequestHandler):
+    """応答を返すまで長く待つAPIサーバー"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(3)
+        try:
+            self.send_response(500)
+            self.end_headers()
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def test_timeout_aborts_sent_request():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_client.get_client_pool().set_client_factory(lambda api_key: genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            base_url=f"http://127.0.0.1:{server.server_port}",
+            client_args={'transport': api_client._create_transport()}
+        )
+    ))
+    engine = GenerationEngine(max_workers=1, default_timeout=0.3)
+    try:
+        job, wait = _run(engine, dict(
+            api_key="test", yaml_prompt="prompt", char_image_paths=[], resolution="1K",
+            use_cache=False
+        ), func=generate_image_with_api)
+        result = wait()
+        # 送信中のリクエストを打ち切り、応答を待たずに戻る
+        assert result['timed_out'] and 'abandoned' not in result
+        assert result['billed'] is False and 'latency' in result['metrics']
+        assert job.finished_at - job.started_at < 1.5
+    finally:
+        engine.shutdown()
+        api_client.get_client_pool().set_client_factory(None)
+        server.shutdown()
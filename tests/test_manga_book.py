@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""manga_layout / manga_book のテスト"""
+
+import io
+import re
+import struct
+import threading
+import zipfile
+import zlib
+
+from PIL import Image, ImageDraw
+
+from logic.manga_book import _PdfBookWriter, _render_png_page, render_pages, write_book
+from logic.manga_layout import PageComposer, compose_page, get_panel_size
+
+TEMPLATE = "4コマ（16:9縦並び）"
+
+
+def _panel_image(seed: int) -> Image.Image:
+    image = Image.new("RGB", (320, 180), (seed * 40 % 256, 120, 200))
+    ImageDraw.Draw(image).ellipse([20, 20, 200, 160], fill=(255, 255 - seed * 30 % 256, 0))
+    return image
+
+
+def _make_pages(count: int, width: int = 360) -> list:
+    return [
+        {
+            'template': TEMPLATE,
+            'output_width': width,
+            'images': {i: _panel_image(page + i) for i in range(4)},
+            'bubbles': {0: [{'text': f"p{page}", 'style': "oval", 'position': (0.5, 0.3)}]}
+        }
+        for page in range(count)
+    ]
+
+
+def _flat_page(page) -> Image.Image:
+    """合成を省いた軽いページ（書き込みだけを確かめる）"""
+    return Image.new("RGB", (64, 64), (page % 256, 0, 0))
+
+
+def _pdf_images(data: bytes) -> list:
+    """PDFの画像ストリームをPNGに組み直して読み込む（可逆で格納されているかの確認用）"""
+    images = []
+    pattern = re.compile(
+        rb"/Subtype /Image /Width (\d+) /Height (\d+) .*? /Length (\d+) >>\nstream\n", re.S
+    )
+    for match in pattern.finditer(data):
+        width, height, length = (int(v) for v in match.groups())
+        idat = data[match.end():match.end() + length]
+
+        def chunk(kind, body):
+            return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+        png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+               + chunk(b"IDAT", idat) + chunk(b"IEND", b""))
+        images.append(Image.open(io.BytesIO(png)).convert("RGB"))
+    return images
+
+
+def test_composer_matches_compose_page():
+    composer = PageComposer(TEMPLATE)
+    for i in range(4):
+        composer.set_image(i, _panel_image(i))
+    composer.bubbles[1] = [{'text': "hi", 'style': "burst", 'position': (0.4, 0.6)}]
+
+    expected = compose_page(composer.to_page(720))
+    assert expected.size == (720, get_panel_size(TEMPLATE, 720)[1] * 4)
+    assert composer.compose(720).tobytes() == expected.tobytes()
+
+
+def test_render_pages_keeps_page_order():
+    pages = list(range(20))
+    results = list(render_pages(pages, _flat_page, max_workers=4, use_processes=False))
+    assert [image.getpixel((0, 0))[0] for image in results] == pages
+
+
+def test_pdf_pages_are_lossless(tmp_path):
+    pages = _make_pages(3)
+    output = tmp_path / "book.pdf"
+    result = write_book(pages, str(output), compose_page, max_workers=2, use_processes=False)
+    assert result == {'success': True, 'pages': 3, 'error': None, 'cancelled': False}
+
+    data = output.read_bytes()
+    assert data.startswith(b"%PDF-") and data.rstrip().endswith(b"%%EOF")
+    assert data.count(b"/Type /Page ") == 3
+    assert b"/Count 3" in data
+    images = _pdf_images(data)
+    assert [image.tobytes() for image in images] == [compose_page(page).tobytes() for page in pages]
+    assert not (tmp_path / "book.pdf.tmp").exists()
+
+
+class _AppendOnlyFile(io.BytesIO):
+    """追記以外（読み込み・位置の移動）をすると失敗するファイル。1回の書き込みごとの量を記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, data):
+        assert self.tell() == len(self.getbuffer()), "書き込み済みの位置に書き直した"
+        self.writes.append(len(data))
+        return super().write(data)
+
+    def seek(self, *args):
+        raise AssertionError("書き込み済みの位置に戻った")
+
+    def read(self, *args):
+        raise AssertionError("書き込み済みのデータを読み直した")
+
+
+def test_pdf_pages_are_appended_without_rereading():
+    png = _render_png_page(_flat_page, 1)
+    fp = _AppendOnlyFile()
+    writer = _PdfBookWriter(fp, dpi=72)
+    page_sizes = []
+    for _ in range(400):
+        before = fp.tell()
+        writer.add_page(png)
+        page_sizes.append(fp.tell() - before)
+    writer.close()
+
+    # 1ページごとの書き込み量はページ数によらない（オブジェクト番号の桁数の分だけ増える）
+    assert max(page_sizes) - min(page_sizes) <= 20
+    assert sum(fp.writes) == len(fp.getvalue())
+    assert fp.getvalue().count(b"/Type /Page ") == 400
+
+
+def test_pdf_xref_points_at_objects(tmp_path):
+    output = tmp_path / "book.pdf"
+    result = write_book(list(range(50)), str(output), _flat_page, max_workers=1, use_processes=False)
+    assert result['pages'] == 50
+
+    data = output.read_bytes()
+    xref_offset = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", data).group(1))
+    assert data[xref_offset:].startswith(b"xref\n0 ")
+    size = int(re.search(rb"xref\n0 (\d+)\n", data[xref_offset:]).group(1))
+    assert size == 3 + 50 * 3
+    entries = re.findall(rb"(\d{10}) 00000 n \n", data[xref_offset:])
+    assert len(entries) == size - 1
+    for obj_id, offset in enumerate((int(entry) for entry in entries), start=1):
+        assert data[offset:].startswith(b"%d 0 obj\n" % obj_id)
+
+
+def test_cbz_contains_every_page(tmp_path):
+    output = tmp_path / "book.cbz"
+    result = write_book(list(range(12)), str(output), _flat_page, max_workers=1, use_processes=False)
+    assert result['success']
+    with zipfile.ZipFile(output) as archive:
+        names = archive.namelist()
+        assert names == [f"page_{i:03d}.png" for i in range(1, 13)]
+        first = Image.open(io.BytesIO(archive.read(names[5])))
+        assert first.getpixel((0, 0)) == (5, 0, 0)
+
+
+def test_cancel_keeps_existing_file(tmp_path):
+    output = tmp_path / "book.pdf"
+    output.write_bytes(b"old")
+    cancel_event = threading.Event()
+
+    def progress(done, total):
+        if done == 2:
+            cancel_event.set()
+
+    result = write_book(list(range(10)), str(output), _flat_page, max_workers=1, use_processes=False,
+                        progress_callback=progress, cancel_event=cancel_event)
+    assert result['cancelled'] and not result['success']
+    assert output.read_bytes() == b"old"
+    assert not (tmp_path / "book.pdf.tmp").exists()
+
+
+def test_unsupported_format(tmp_path):
+    result = write_book([1], str(tmp_path / "book.zip"), _flat_page)
+    assert not result['success'] and result['pages'] == 0
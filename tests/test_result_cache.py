@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""result_cache のテスト"""
+
+import io
+import os
+
+from PIL import Image
+
+from logic.result_cache import ResultCache, CACHE_EXTENSION
+
+
+def _jpeg_bytes(quality: int = 95) -> bytes:
+    image = Image.effect_noise((64, 48), 40).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_jpeg_round_trip_keeps_bytes(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    data = _jpeg_bytes()
+    key = ResultCache.make_key("normal", "prompt", [], "2K", "1:1", "model")
+    cache.put(key, data)
+
+    with open(cache._path_for(key), 'rb') as f:
+        assert f.read() == data
+
+    image = cache.get(key)
+    assert image.format == "JPEG"
+    assert image.tobytes() == Image.open(io.BytesIO(data)).tobytes()
+    assert cache.get_stats()['hits'] == 1
+
+
+def test_miss_and_persisted_entries(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("00" * 32) is None
+    assert cache.get_stats()['misses'] == 1
+
+    data = _jpeg_bytes()
+    cache.put("ab" * 32, data)
+    reopened = ResultCache(str(tmp_path))
+    assert reopened.get_stats()['entries'] == 1
+    assert reopened.get_stats()['size_bytes'] == len(data)
+
+
+def test_adopts_entries_written_by_another_instance(tmp_path):
+    # 同じディレクトリを共有する別プロセスのキャッシュ
+    reader = ResultCache(str(tmp_path))
+    writer = ResultCache(str(tmp_path))
+    data = _jpeg_bytes()
+    key = "cd" * 32
+    writer.put(key, data)
+
+    image = reader.get(key)
+    assert image is not None and image.format == "JPEG"
+    stats = reader.get_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 0
+    assert stats['entries'] == 1 and stats['size_bytes'] == len(data)
+
+
+def test_key_depends_on_image_contents(tmp_path):
+    first, second = tmp_path / "a.png", tmp_path / "b.png"
+    Image.new("RGB", (4, 4), "red").save(first)
+    Image.new("RGB", (4, 4), "red").save(second)
+    same = [ResultCache.make_key("normal", "p", [str(p)], "2K", "1:1", "m") for p in (first, second)]
+    assert same[0] == same[1]
+    Image.new("RGB", (4, 4), "blue").save(second)
+    assert ResultCache.make_key("normal", "p", [str(second)], "2K", "1:1", "m") != same[0]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    data = _jpeg_bytes()
+    cache = ResultCache(str(tmp_path), max_bytes=len(data) * 2)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    cache.put(keys[0], data)
+    cache.put(keys[1], data)
+    cache.get(keys[0])  # keys[0]を最近使ったものにする
+    cache.put(keys[2], data)
+
+    assert cache.get_stats()['entries'] == 2
+    assert os.path.exists(cache._path_for(keys[0]))
+    assert not os.path.exists(cache._path_for(keys[1]))
+    assert cache._path_for(keys[2]).endswith(CACHE_EXTENSION)
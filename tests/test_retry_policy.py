@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""retry_policy のテスト（待ち時間は差し替えた時計・sleepで確かめる）"""
+
+import pytest
+
+from logic import retry_policy
+from logic.retry_policy import RequestCancelled, RetryPolicy, TokenBucket, get_retry_after
+
+
+class _ApiError(Exception):
+    """ステータスコードと待ち時間ヒントを持つAPIエラー"""
+
+    def __init__(self, code, headers=None, details=None):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.details = details
+        if headers is not None:
+            self.response = type("Response", (), {'headers': headers, 'status_code': code})()
+
+
+class _Clock:
+    """sleepで進む時計"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _CancelDuringWait:
+    """待機を始めた時点でキャンセルされるEvent"""
+
+    def __init__(self):
+        self.waits = []
+
+    def is_set(self):
+        return bool(self.waits)
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return True
+
+
+def _failing(errors, result="ok"):
+    """errorsを順に送出し、なくなったらresultを返す関数"""
+    calls = []
+
+    def func():
+        calls.append(len(calls) + 1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return func, calls
+
+
+def test_backoff_is_bounded_by_exponential_ceiling(monkeypatch):
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: high)
+    assert [policy.get_delay(attempt) for attempt in range(1, 7)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+
+    monkeypatch.undo()
+    for attempt in range(1, 7):
+        for _ in range(50):
+            assert 0.0 <= policy.get_delay(attempt) <= min(10.0, 2 ** (attempt - 1))
+
+
+def test_retry_after_hints():
+    assert get_retry_after(_ApiError(429, headers={'retry-after': "7"})) == 7.0
+    assert get_retry_after(_ApiError(429, headers={'retry-after': "soon"})) is None
+    details = {'error': {'details': [{'@type': "RetryInfo", 'retryDelay': "30s"}]}}
+    assert get_retry_after(_ApiError(429, details=details)) == 30.0
+    assert get_retry_after(_ApiError(503)) is None
+
+    # ヒントは上限で抑えて優先する
+    policy = RetryPolicy(base_delay=1.0, max_delay=20.0)
+    assert policy.get_delay(1, _ApiError(429, details=details)) == 20.0
+    assert policy.get_delay(1, _ApiError(429, headers={'retry-after': "3"})) == 3.0
+
+
+def test_retries_transient_errors_until_success():
+    clock = _Clock()
+    policy = RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=60.0, sleep=clock.sleep)
+    func, calls = _failing([_ApiError(503, headers={'retry-after': "2"}), ConnectionError("reset")])
+    retries = []
+
+    assert policy.call(func, on_retry=lambda *args: retries.append(args)) == "ok"
+    assert calls == [1, 2, 3]
+    assert [attempt for attempt, _, _ in retries] == [1, 2]
+    assert clock.sleeps[0] == 2.0 and 0.0 <= clock.sleeps[1] <= 2.0
+
+
+def test_does_not_retry_client_errors():
+    clock = _Clock()
+    policy = RetryPolicy(max_attempts=4, sleep=clock.sleep)
+    func, calls = _failing([_ApiError(400)])
+    with pytest.raises(_ApiError):
+        policy.call(func)
+    assert calls == [1] and clock.sleeps == []
+
+
+def test_gives_up_after_max_attempts():
+    clock = _Clock()
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, sleep=clock.sleep)
+    func, calls = _failing([_ApiError(429) for _ in range(5)])
+    with pytest.raises(_ApiError):
+        policy.call(func)
+    assert calls == [1, 2, 3] and len(clock.sleeps) == 2
+
+
+def test_cancel_during_backoff_wait():
+    policy = RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=60.0)
+    func, calls = _failing([_ApiError(429, headers={'retry-after': "30"})])
+    cancel_event = _CancelDuringWait()
+    with pytest.raises(RequestCancelled):
+        policy.call(func, cancel_event=cancel_event)
+    assert calls == [1] and cancel_event.waits == [30.0]
+
+
+def test_token_bucket_refills_over_time():
+    clock = _Clock()
+    bucket = TokenBucket(rate_per_sec=0.5, capacity=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+
+    clock.now += 1.0  # 半分だけ補充
+    assert not bucket.acquire(timeout=0)
+    clock.now += 1.0
+    assert bucket.acquire(timeout=0)
+
+    # 容量を超えては貯まらない
+    clock.now += 60.0
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+
+
+def test_token_bucket_waits_for_refill():
+    clock = _Clock()
+    bucket = TokenBucket(rate_per_sec=0.5, capacity=1, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire()
+    assert bucket.acquire()
+    assert clock.sleeps == [2.0]
+
+    # 待ち時間の上限で打ち切る
+    assert not bucket.acquire(timeout=0.5)
+    assert clock.sleeps == [2.0, 0.5]
+
+
+def test_token_bucket_cancel_during_wait():
+    clock = _Clock()
+    bucket = TokenBucket(rate_per_sec=0.5, capacity=1, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire()
+    cancel_event = _CancelDuringWait()
+    assert not bucket.acquire(cancel_event=cancel_event)
+    assert cancel_event.waits == [2.0] and clock.sleeps == []
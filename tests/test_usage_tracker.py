@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""usage_tracker のテスト"""
+
+import json
+import os
+import sqlite3
+from datetime import date
+
+from constants import USAGE_LOG_COMPACT_EVENTS
+from logic.file_lock import FileLock
+from logic.usage_tracker import (
+    UsageTracker, get_usage_outcome, percentile, METRIC_COLUMN_TYPES,
+    OUTCOME_SUCCESS, OUTCOME_FAILED, OUTCOME_CANCELLED, OUTCOME_TIMEOUT
+)
+
+
+def _json_tracker(tmp_path, **options):
+    return UsageTracker(str(tmp_path / "api_usage.json"), backend="json", **options)
+
+
+def _sqlite_tracker(tmp_path, **options):
+    return UsageTracker(str(tmp_path / "api_usage.json"), backend="sqlite", **options)
+
+
+def _log_lines(tracker) -> list:
+    if not os.path.exists(tracker.store.log_path):
+        return []
+    with open(tracker.store.log_path, 'rb') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))  # 1..10
+    assert percentile(values, 0.5) == 5
+    assert percentile(values, 0.9) == 9
+    assert percentile(values, 0.95) == 10
+    assert percentile(values, 0.99) == 10
+    assert percentile(values, 1.0) == 10
+
+
+def test_percentile_rank_is_not_rounded_to_even():
+    # 順位 ceil(0.5 * 5) = 3 → 3番目の値
+    assert percentile([50, 10, 40, 20, 30], 0.5) == 30
+    # 順位 ceil(0.5 * 2) = 1 → 1番目の値（ratio * 件数が整数のときに1つ上の値を返さない）
+    assert percentile([2.0, 1.0], 0.5) == 1.0
+    # 順位 ceil(0.25 * 2) = 1 → 1番目の値
+    assert percentile([2.0, 1.0], 0.25) == 1.0
+    assert percentile([2.0, 1.0], 0.75) == 2.0
+
+
+def test_percentile_edges():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([7], 0.0) == 7
+    assert percentile([7], 0.95) == 7
+    assert percentile([3, 1, 2], 0.0) == 1
+
+
+def test_usage_outcome_only_for_sent_requests():
+    metrics = {'latency': 1.0}
+    assert get_usage_outcome({'success': True, 'image': "image", 'metrics': metrics}) == (True, OUTCOME_SUCCESS)
+    assert get_usage_outcome({'success': False, 'metrics': metrics}) == (False, OUTCOME_FAILED)
+    # 送信済みのリクエストを打ち切った場合（画像が返っていれば料金に含める）
+    assert get_usage_outcome({'success': False, 'cancelled': True, 'billed': False,
+                              'metrics': metrics}) == (False, OUTCOME_CANCELLED)
+    assert get_usage_outcome({'success': False, 'timed_out': True, 'billed': True,
+                              'metrics': metrics}) == (True, OUTCOME_TIMEOUT)
+
+    # キャッシュ・送信前のキャンセル・予算による中止・打ち切り（後から記録）は記録しない
+    assert get_usage_outcome({'success': True, 'image': "image", 'cached': True}) is None
+    assert get_usage_outcome({'success': False, 'cancelled': True}) is None
+    assert get_usage_outcome({'success': False, 'cancelled': True, 'billed': False}) is None
+    assert get_usage_outcome({'success': False, 'rejected': True}) is None
+    assert get_usage_outcome({'success': False, 'timed_out': True, 'abandoned': True}) is None
+
+
+def test_json_replay_after_crash_before_log_truncation(tmp_path):
+    tracker = _json_tracker(tmp_path)
+    for _ in range(3):
+        tracker.record_usage("normal", "2K", True)
+    # スナップショットを書き終えた直後、ログを消す前に落ちた状態
+    assert tracker.store._save_data()
+    tracker.record_usage("simple", "1K", False)
+    assert [event['seq'] for event in _log_lines(tracker)] == [1, 2, 3, 4]
+    with open(tracker.storage_path, encoding='utf-8') as f:
+        assert json.load(f)['last_seq'] == 3
+
+    # last_seqまでのイベントは再適用せず、それより新しいものだけを反映する
+    reopened = _json_tracker(tmp_path)
+    assert reopened.get_today_count() == 4
+    assert reopened.get_total_count() == 4
+    assert reopened.get_mode_counts()['normal'] == 3
+    assert reopened.get_mode_counts()['simple'] == 1
+    assert reopened.get_outcome_counts()[OUTCOME_FAILED] == 1
+    # 起動時にまとめ直し、番号は続きから振る
+    assert _log_lines(reopened) == []
+    reopened.record_usage("normal", "2K", True)
+    assert [event['seq'] for event in _log_lines(reopened)] == [5]
+    reopened.close()
+    assert _json_tracker(tmp_path).get_total_count() == 5
+
+
+def test_json_log_is_compacted_every_threshold_events(tmp_path):
+    tracker = _json_tracker(tmp_path)
+    for _ in range(USAGE_LOG_COMPACT_EVENTS - 1):
+        tracker.record_usage("normal", "1K", True)
+    assert len(_log_lines(tracker)) == USAGE_LOG_COMPACT_EVENTS - 1
+    assert not os.path.exists(tracker.storage_path)
+
+    tracker.record_usage("normal", "1K", True)
+    assert _log_lines(tracker) == []
+    with open(tracker.storage_path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot['last_seq'] == USAGE_LOG_COMPACT_EVENTS
+    assert snapshot['total_count'] == USAGE_LOG_COMPACT_EVENTS
+
+    tracker.record_usage("normal", "1K", True)
+    assert [event['seq'] for event in _log_lines(tracker)] == [USAGE_LOG_COMPACT_EVENTS + 1]
+
+
+def test_json_pending_events_are_kept_while_locked(tmp_path):
+    tracker = _json_tracker(tmp_path)
+    tracker.store._file_lock.timeout = 0.05
+    other = _json_tracker(tmp_path)
+
+    holder = FileLock(tracker.storage_path + ".lock")
+    assert holder.acquire()
+    try:
+        tracker.record_usage("normal", "2K", True)
+        tracker.record_usage("simple", "1K", False)
+        # 取り込み・まとめ・終了処理でもロックを取れなければ保留したまま
+        assert tracker.refresh() is False
+        tracker.store.compact()
+        tracker.close()
+        assert [event['mode'] for event in tracker.store._pending] == ["normal", "simple"]
+        assert _log_lines(tracker) == []
+    finally:
+        holder.release()
+
+    # 別のプロセスの記録を取り込んでから、保留していた順に番号を振る
+    other.record_usage("redraw", "4K", True)
+    assert tracker.refresh() is True
+    assert tracker.store._pending == []
+    assert [(event['seq'], event['mode']) for event in _log_lines(tracker)] == [
+        (1, "redraw"), (2, "normal"), (3, "simple")
+    ]
+    assert tracker.get_total_count() == 3
+    other.refresh()
+    assert other.get_total_count() == 3
+
+
+def test_sqlite_imports_json_records_once(tmp_path, capsys):
+    json_tracker = _json_tracker(tmp_path)
+    json_tracker.record_usage("normal", "2K", True, latency=1.5)
+    json_tracker.record_usage("refine", "1K", False)
+    json_tracker.close()
+
+    tracker = _sqlite_tracker(tmp_path)
+    assert tracker.get_total_count() == 2
+    assert "Imported 2 usage records" in capsys.readouterr().out
+    tracker.record_usage("simple", "4K", True)
+    tracker.close()
+
+    # 2回目以降はデータベースがあるので取り込まない
+    reopened = _sqlite_tracker(tmp_path)
+    assert reopened.get_total_count() == 3
+    assert reopened.get_mode_counts()['normal'] == 1
+    assert "Imported" not in capsys.readouterr().out
+    reopened.close()
+    # JSONの記録はそのまま残す
+    assert _json_tracker(tmp_path).get_total_count() == 2
+
+
+def test_sqlite_counts_match_json(tmp_path):
+    events = [
+        ("normal", "2K", True, None), ("normal", "4K", False, None),
+        ("simple", "1K", True, None), ("refine", "2K", False, OUTCOME_CANCELLED),
+        ("redraw", "2K", False, OUTCOME_TIMEOUT), ("normal", "2K", True, None)
+    ]
+    (tmp_path / "json").mkdir()
+    (tmp_path / "sqlite").mkdir()
+    json_tracker = _json_tracker(tmp_path / "json")
+    sqlite_tracker = _sqlite_tracker(tmp_path / "sqlite")
+    for mode, resolution, success, outcome in events:
+        for tracker in (json_tracker, sqlite_tracker):
+            tracker.record_usage(mode, resolution, success, outcome, latency=0.5)
+
+    for tracker in (json_tracker, sqlite_tracker):
+        assert tracker.get_today_count() == 6
+        assert tracker.get_month_count() == 6
+        assert tracker.get_count(mode="normal") == 3
+        assert tracker.get_mode_counts() == {'normal': 3, 'redraw': 1, 'simple': 1, 'refine': 1}
+        assert tracker.get_resolution_counts() == {'1K': 1, '2K': 4, '4K': 1}
+        assert tracker.get_outcome_counts() == {
+            OUTCOME_SUCCESS: 3, OUTCOME_FAILED: 1, OUTCOME_CANCELLED: 1, OUTCOME_TIMEOUT: 1
+        }
+    assert json_tracker.get_month_cost() == sqlite_tracker.get_month_cost()
+    assert json_tracker.get_statistics() == sqlite_tracker.get_statistics()
+
+
+def test_sqlite_adds_metric_columns_to_old_database(tmp_path):
+    db_path = tmp_path / "api_usage.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE usage_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            outcome TEXT NOT NULL
+        );
+    """)
+    conn.execute(
+        "INSERT INTO usage_events (date, time, mode, resolution, success, outcome) VALUES (?, ?, ?, ?, ?, ?)",
+        (date.today().isoformat(), "10:00:00", "normal", "2K", 1, OUTCOME_SUCCESS)
+    )
+    conn.commit()
+    conn.close()
+
+    tracker = _sqlite_tracker(tmp_path)
+    tracker.record_usage("normal", "2K", True, latency=2.0, ttfb=0.5, request_bytes=100)
+    assert tracker.get_today_count() == 2
+    assert tracker.get_metric_percentiles("latency")[("normal", "2K")]['count'] == 1
+    tracker.close()
+
+    conn = sqlite3.connect(db_path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(usage_events)")}
+    assert set(METRIC_COLUMN_TYPES) <= columns
+    conn.close()